@@ -56,6 +56,11 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ("id", "officer__name")
     inlines = [OrderItemInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # ✅ الأصناف اتعدلت من الـ inline → حدّث الإجماليات المتخزنة
+        form.instance.refresh_totals()
+
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ("order", "menuitem", "quantity")
@@ -10,6 +10,11 @@ class MainConfig(AppConfig):
 
     def ready(self):
         import main.signals  # مش yourapp — خليه اسم التطبيق الحقيقي
+        from main import recipe_cache
+
+        # الكاش بيتبني مع أول أوردر مش هنا، عشان ready() متلمسش الداتابيز
+        # (migrate على داتابيز فاضية كان هيقع)
+        recipe_cache.reset()
 
 
 @register.filter
@@ -0,0 +1,278 @@
+# closing_jobs.py
+# التقفيلة الشهرية كشغلانة في الخلفية بدل ما تتعمل كلها جوه الـ request:
+#   1) totals   — كل الإجماليات بـ aggregate في SQL (أو من كاش المعاينة preview لو الداتا ما اتغيرتش)
+#                 وبعدين MonthlyClosing في transaction واحدة
+#   2) history  — خصم المباع من SinastarInventoryHistory (الأقدم الأول) مكون مكون، كل مكون
+#                 في transaction لوحده مع تسجيله في settled_materials
+#   3) finalize — تحديث updated_at للمخزن وصفوف التقفيلة في الدفتر و ClosingSnapshot للفترة
+# كل خطوة بتحرك job.step في نفس الـ transaction بتاعتها، فلو البروسيس وقع في النص
+# التشغيل الجاي بيكمّل من نفس المكان (run_closing_jobs) ومفيش حاجة بتتخصم مرتين.
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Max, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import closing_snapshots, sales_rollup, stock
+from .models import (
+    ClosingJob, DataVersion, ExtraExpense, MonthlyClosing, Order, SinastarInventory, SinastarInventoryHistory, StockMovement,
+)
+
+logger = logging.getLogger(__name__)
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def stale_after():
+    """شغلانة running من غير heartbeat المدة دي تعتبر واقعة ويتكمّل عليها."""
+    return getattr(settings, "CLOSING_JOB_STALE_AFTER", timedelta(minutes=10))
+
+
+class AlreadyClosed(ValueError):
+    """الفترة (أو جزء منها) اتقفلت قبل كده — تقفيلتها التانية هتخصم المباع من الـ History مرتين."""
+
+    def __init__(self, closing):
+        self.closing = closing
+        super().__init__(f"الفترة دي داخلة في تقفيلة قبل كده ({closing.start_date} → {closing.end_date})")
+
+
+def enqueue(start_date, end_date, user=None):
+    """
+    يسجّل الشغلانة ويشغلها في thread بعد الـ commit. لو فيه شغلانة لنفس الفترة بيرجّعها هي:
+    اللي لسه ما خلصتش أو خلصت خلاص — والفاشلة بتكمّل من مكانها (settled_materials).
+    لو الفترة متداخلة مع تقفيلة تانية → AlreadyClosed بدل ما المباع يتخصم مرتين.
+    """
+    existing = ClosingJob.objects.filter(start_date=start_date, end_date=end_date).order_by("-id").first()
+    if existing:
+        if existing.status == "failed":
+            transaction.on_commit(lambda: start_in_background(existing.pk))
+        return existing
+
+    overlapping = Q(start_date__lte=end_date, end_date__gte=start_date)
+    closing = (
+        MonthlyClosing.objects.filter(overlapping).order_by("start_date").first()
+        or ClosingJob.objects.filter(overlapping).order_by("start_date").first()
+    )
+    if closing:
+        raise AlreadyClosed(closing)
+
+    job = ClosingJob.objects.create(start_date=start_date, end_date=end_date, requested_by=user)
+    transaction.on_commit(lambda: start_in_background(job.pk))
+    return job
+
+
+def start_in_background(job_id):
+    # CLOSING_JOBS_IN_BACKGROUND = False → الشغلانة تستنى run_closing_jobs (cron مثلًا)
+    if not getattr(settings, "CLOSING_JOBS_IN_BACKGROUND", True):
+        return
+    threading.Thread(target=_run_in_thread, args=(job_id,), name=f"closing-job-{job_id}", daemon=True).start()
+
+
+def _run_in_thread(job_id):
+    try:
+        run(job_id)
+    finally:
+        connection.close()
+
+
+def claim(job_id, resume_stale=False):
+    """queued/failed → running بـ UPDATE مشروط، فبروسيس واحد بس هو اللي بيشتغل عليها."""
+    claimable = Q(status__in=["queued", "failed"])
+    if resume_stale:
+        claimable |= Q(status="running", updated_at__lt=timezone.now() - stale_after())
+    moment = timezone.now()
+    return bool(
+        ClosingJob.objects.filter(claimable, pk=job_id).update(
+            status="running", error="", updated_at=moment, started_at=Coalesce(F("started_at"), moment)
+        )
+    )
+
+
+def run(job_id, resume_stale=False):
+    """يشغل الخطوات الباقية. بيرجّع False لو الشغلانة مش متاحة أو فشلت (والسبب في job.error)."""
+    if not claim(job_id, resume_stale):
+        return False
+    job = ClosingJob.objects.get(pk=job_id)
+    try:
+        if job.step == "totals":
+            _totals(job)
+        if job.step == "history":
+            _settle_history(job)
+        if job.step == "finalize":
+            _finalize(job)
+    except Exception as exc:
+        logger.exception("closing job %s failed at %s", job_id, job.step)
+        ClosingJob.objects.filter(pk=job_id).update(status="failed", error=str(exc) or repr(exc))
+        return False
+    return True
+
+
+def _between(field, start_date, end_date):
+    """فلتر range على العمود نفسه (بيمشي على index) من أول يوم البداية لآخر يوم النهاية."""
+    start = sales_rollup.day_bounds(start_date)[0]
+    end = sales_rollup.day_bounds(end_date)[1]
+    return Q(**{f"{field}__gte": start, f"{field}__lt": end})
+
+
+def _sold(start_date, end_date):
+    return StockMovement.objects.filter(_between("created_at", start_date, end_date), kind__in=["sale", "restore"])
+
+
+def compute_totals(start_date, end_date):
+    """أرقام التقفيلة للفترة (نفس حقول MonthlyClosing) — قراية بس، كل رقم aggregate في SQL."""
+    # 1️⃣ إجمالي مبيعات الفواتير
+    total_sales_orders = (
+        Order.objects.filter(_between("created_at", start_date, end_date), is_paid=True)
+        .aggregate(s=Sum("total"))["s"] or 0
+    )
+
+    # 2️⃣ بيع وشراء المتبقي (SinastarInventory) في استعلام واحد
+    current = SinastarInventory.objects.filter(_between("updated_at", start_date, end_date)).aggregate(
+        sale=Sum(F("addition") * F("addition_cost"), output_field=MONEY),
+        purchase=Sum(F("addition") * F("purchase_price"), output_field=MONEY),
+    )
+    total_sales_inventory = current["sale"] or 0
+    current_purchase_total = current["purchase"] or 0
+
+    # 3️⃣ إجمالي الشراء = (سعر شراء المواد المباعة + سعر شراء المخزن الحالي)
+    total_purchase_inventory = stock.sold_totals(_sold(start_date, end_date))["purchase"] + current_purchase_total
+
+    # 4️⃣ الربح، 5️⃣ الربح من المخزن، 6️⃣ الخزينة (قبل الخصم والإضافة)
+    total_profit = (total_sales_orders + total_sales_inventory) - total_purchase_inventory
+    profit_from_inventory = total_sales_inventory - current_purchase_total
+    actual_profit = total_profit - profit_from_inventory
+
+    # 7️⃣ النسريات + التبس في استعلام واحد
+    expenses = ExtraExpense.objects.filter(_between("created_at", start_date, end_date)).aggregate(
+        nesrayat=Sum("amount", filter=Q(category="nesrayat")),
+        tips=Sum("amount", filter=Q(category="tips")),
+    )
+    total_nesrayat = expenses["nesrayat"] or 0
+    total_tips = expenses["tips"] or 0
+
+    # 8️⃣ عدل الربح الفعلي (خصم النسريات + إضافة التبس)
+    actual_profit = actual_profit - total_nesrayat + total_tips
+
+    return {
+        "total_sales_orders": total_sales_orders,
+        "total_sales_inventory": total_sales_inventory,
+        "total_purchase_inventory": total_purchase_inventory,
+        "total_profit": total_profit,
+        "profit_from_inventory": profit_from_inventory,
+        "actual_profit": actual_profit,
+        "total_nesrayat": total_nesrayat,
+        "total_tips": total_tips,
+    }
+
+
+# بيزيد مع أي حفظ أو مسح في المصاريف والمخزن، ومسح الأوردرات (signals) — حاجات مالهاش عداد تاني
+VERSION_KEY = "closing_data"
+
+
+def touch():
+    DataVersion.bump(VERSION_KEY)
+
+
+def data_stamp():
+    """
+    ختم لكل الداتا اللي الأرقام بتتحسب منها من غير ما نلف على أي جدول: عداد الأوردرات
+    (كل حفظ) + VERSION_KEY + آخر id في دفتر الحركة (الخصم والرجوع بيضيفوا صفوف فيه دايمًا).
+    """
+    versions = DataVersion.objects.filter(key__in=[Order.CHANGE_SEQ_KEY, VERSION_KEY]).order_by("key")
+    parts = (
+        tuple(versions.values_list("key", "version")),
+        StockMovement.objects.aggregate(last=Max("id"))["last"],
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def preview_ttl():
+    return getattr(settings, "CLOSING_PREVIEW_TTL", 60 * 60)
+
+
+def preview(start_date, end_date):
+    """
+    (الأرقام، cached) من غير ما يكتب حاجة. النتيجة بتتخزن في الكاش بالفترة + data_stamp()،
+    فالفتح التاني بيبقى قراية ختم بس، والتقفيلة نفسها (_totals) بتاخد نفس النتيجة لو مفيش تغيير.
+    """
+    # الختم قبل الحساب: لو حصلت كتابة في النص النتيجة تتخزن على الختم القديم ومحدش يقراها
+    key = f"closing_preview:{start_date.isoformat()}:{end_date.isoformat()}:{data_stamp()}"
+    totals = cache.get(key)
+    if totals is not None:
+        return totals, True
+    totals = compute_totals(start_date, end_date)
+    cache.set(key, totals, preview_ttl())
+    return totals, False
+
+
+def _totals(job):
+    totals, _ = preview(job.start_date, job.end_date)
+    with transaction.atomic():
+        job.closing = MonthlyClosing.objects.create(
+            month=job.start_date, start_date=job.start_date, end_date=job.end_date, **totals
+        )
+        job.step = "history"
+        job.save(update_fields=["closing", "step", "updated_at"])
+
+
+def _settle_history(job):
+    """صافي المباع لكل مكون يتخصم من History الأقدم الأول — مكون مكون عشان الـ resume."""
+    sold = (
+        _sold(job.start_date, job.end_date)
+        .values("material_id").annotate(units=Sum("quantity")).order_by("material_id")
+    )
+    per_material = [(row["material_id"], -row["units"]) for row in sold if row["units"] < 0]
+    if job.materials_total != len(per_material):
+        job.materials_total = len(per_material)
+        job.save(update_fields=["materials_total", "updated_at"])
+
+    settled = set(job.settled_materials)
+    for material_id, quantity in per_material:
+        if material_id in settled:
+            continue
+        with transaction.atomic():
+            _deduct_history(material_id, quantity)
+            job.settled_materials.append(material_id)
+            job.save(update_fields=["settled_materials", "updated_at"])
+
+    job.step = "finalize"
+    job.save(update_fields=["step", "updated_at"])
+
+
+def _deduct_history(material_id, quantity):
+    """FIFO على صفوف المكون: قراية واحدة + bulk_update للي اتخصم منه + مسح اللي خلص."""
+    moment = timezone.now()
+    changed = []
+    for row in SinastarInventoryHistory.objects.filter(material_id=material_id).order_by("created_at", "id"):
+        if quantity <= 0:
+            break
+        take = min(row.addition, quantity)
+        if not take:
+            continue
+        row.addition -= take
+        row.updated_at = moment
+        quantity -= take
+        changed.append(row)
+    SinastarInventoryHistory.objects.bulk_update(changed, ["addition", "updated_at"])
+    SinastarInventoryHistory.objects.filter(material_id=material_id, addition=0).delete()
+
+
+def _finalize(job):
+    with transaction.atomic():
+        # ✅ تحديث الـ updated_at لكل المخزون
+        SinastarInventory.objects.update(updated_at=timezone.now())
+        touch()
+        # ✅ صف تقفيلة في الدفتر لكل مكون برصيده
+        stock.snapshot_closing()
+        # ✅ أرقام الفترة تتجمد عشان التقارير ما ترجعش تلف على الصفوف الخام
+        closing_snapshots.build(job.closing)
+        job.step = "finished"
+        job.status = "done"
+        job.finished_at = timezone.now()
+        job.save(update_fields=["step", "status", "finished_at", "updated_at"])
@@ -0,0 +1,129 @@
+# closing_panels.py
+# جداول صفحة التقفيلات (المباع، الـ History، المخزن، الفواتير، المصاريف) كل واحد ليه endpoint
+# لوحده بيتحمّل لما حد يفتحه: صفحة بحد أقصى PAGE_SIZE صف بـ keyset على (التاريخ، id)
+# والإجماليات aggregate في SQL على الفلتر كله — فالصفحة الرئيسية بتقرا جدول التقفيلات بس.
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.utils.dateparse import parse_date
+
+from . import closing_snapshots, stock
+from .models import ExtraExpense, MenuItem, Order, SinastarInventory, SinastarInventoryHistory, StockMovement
+from .sales_rollup import day_bounds
+
+PAGE_SIZE = 50
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _dates(params, prefix):
+    start, end = params.get(f"{prefix}_start") or "", params.get(f"{prefix}_end") or ""
+    return parse_date(start) if start else None, parse_date(end) if end else None
+
+
+def _between_dates(queryset, field, start, end):
+    """بحدود يوم الشغل (day_bounds) زي الأيام المقفولة — مش __date — فالصف ما يتحسبش مرتين ولا يقع."""
+    if start:
+        queryset = queryset.filter(**{f"{field}__gte": day_bounds(start)[0]})
+    if end:
+        queryset = queryset.filter(**{f"{field}__lt": day_bounds(end)[1]})
+    return queryset
+
+
+def _stock_totals(queryset):
+    """إجمالي البيع والشراء والربح لصفوف فيها addition × السعر (History والمخزن)."""
+    totals = queryset.aggregate(
+        sale=Sum(F("addition") * F("addition_cost"), output_field=MONEY),
+        purchase=Sum(F("addition") * F("purchase_price"), output_field=MONEY),
+    )
+    sale, purchase = totals["sale"] or 0, totals["purchase"] or 0
+    return {"sale": sale, "purchase": purchase, "profit": sale - purchase}
+
+
+def sold(params):
+    """المباع من دفتر الحركة — الأيام المقفولة صف لكل مكون من ClosingSnapshot."""
+    start, end = _dates(params, "sold")
+    ranges = closing_snapshots.closed_ranges(start, end)
+    rows = _between_dates(
+        StockMovement.objects.filter(kind__in=["sale", "restore"]).select_related("material"), "created_at", start, end
+    ).filter(closing_snapshots.outside("created_at", ranges))
+
+    live = stock.sold_totals(rows)
+    closed = closing_snapshots.totals(ranges, "material")
+    sale = live["sale"] + closed["amount"]
+    purchase = live["purchase"] + closed["purchase"]
+    return rows, "created_at", {
+        "closed_rows": closing_snapshots.by_key(ranges, "material"),
+        "totals": {"units": live["units"] + closed["units"], "sale": sale, "purchase": purchase, "profit": sale - purchase},
+    }
+
+
+def history(params):
+    start, end = _dates(params, "inv")
+    rows = _between_dates(SinastarInventoryHistory.objects.select_related("material"), "created_at", start, end)
+    return rows, "created_at", {"totals": _stock_totals(rows)}
+
+
+def store(params):
+    start, end = _dates(params, "store")
+    rows = _between_dates(SinastarInventory.objects.select_related("material"), "updated_at", start, end)
+    return rows, "updated_at", {"totals": _stock_totals(rows)}
+
+
+def orders(params):
+    """الفواتير المدفوعة — الإجمالي من عمود total (مش لفة على أصناف كل أوردر)."""
+    start, end = _dates(params, "order")
+    ranges = closing_snapshots.closed_ranges(start, end)
+    rows = _between_dates(
+        Order.objects.filter(is_paid=True).select_related("cashier"), "created_at", start, end
+    ).filter(closing_snapshots.outside("created_at", ranges))
+
+    live = rows.aggregate(n=Count("id"), s=Sum("total"))
+    closed = closing_snapshots.totals(ranges, "orders")
+    labels = dict(MenuItem.SECTION_CHOICES)
+    return rows, "created_at", {
+        "closed": closed,
+        "closed_sections": [
+            dict(row, label=labels.get(row["key"], row["key"]))
+            for row in closing_snapshots.by_key(ranges, "section")
+        ],
+        "totals": {"count": live["n"] + closed["count"], "sales": (live["s"] or 0) + closed["amount"]},
+    }
+
+
+def expenses(params):
+    start, end = _dates(params, "exp")
+    ranges = closing_snapshots.closed_ranges(start, end)
+    rows = _between_dates(ExtraExpense.objects.all(), "created_at", start, end).filter(
+        closing_snapshots.outside("created_at", ranges)
+    )
+
+    live = rows.aggregate(
+        nesrayat=Sum("amount", filter=Q(category="nesrayat")),
+        tips=Sum("amount", filter=Q(category="tips")),
+    )
+    closed = {row["key"]: row for row in closing_snapshots.by_key(ranges, "expense")}
+    nesrayat = (live["nesrayat"] or 0) + closed.get("nesrayat", {}).get("amount", 0)
+    tips = (live["tips"] or 0) + closed.get("tips", {}).get("amount", 0)
+    return rows, "created_at", {
+        "closed_rows": closed,
+        "totals": {"nesrayat": nesrayat, "tips": tips, "all": nesrayat + tips},
+    }
+
+
+PANELS = {
+    "sold": sold,
+    "history": history,
+    "store": store,
+    "orders": orders,
+    "expenses": expenses,
+}
+
+
+def page(rows, field, before=None):
+    """(صفوف الصفحة، (تاريخ، id) لآخر صف لو فيه صفحة بعدها) — الأحدث الأول."""
+    if before:
+        moment, pk = before
+        rows = rows.filter(Q(**{f"{field}__lt": moment}) | Q(**{field: moment, "id__lt": pk}))
+    rows = list(rows.order_by(f"-{field}", "-id")[:PAGE_SIZE + 1])
+    if len(rows) <= PAGE_SIZE:
+        return rows, None
+    last = rows[PAGE_SIZE - 1]
+    return rows[:PAGE_SIZE], (getattr(last, field), last.id)
@@ -0,0 +1,148 @@
+# closing_snapshots.py
+# الفترات المقفولة بتتجمد في صفوف ClosingSnapshot صغيرة (يوم × نوع × مفتاح) وقت التقفيلة،
+# وتقرير التقفيلات بيقسم أي فترة لجزئين: الأيام المقفولة من الـ snapshots والباقي (الذيل المفتوح)
+# بيتحسب live من الصفوف الخام زي الأول — فكل ما الشهور تقفل التقرير ما بيكبرش معاها.
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import ClosingSnapshot, DailySalesRollup, ExtraExpense, MonthlyClosing, Order, StockMovement
+from .sales_rollup import business_day, day_bounds
+
+ZERO = Decimal("0.00")
+
+
+def build(closing):
+    """يجمّد أرقام فترة التقفيلة يوم بيوم (ولو اتبنت قبل كده بتتبني من الأول)."""
+    start, end = day_bounds(closing.start_date)[0], day_bounds(closing.end_date)[1]
+    rows = {}
+
+    def row(day, kind, key, **fields):
+        if (day, kind, str(key)) not in rows:
+            rows[(day, kind, str(key))] = ClosingSnapshot(closing=closing, day=day, kind=kind, key=str(key), **fields)
+        return rows[(day, kind, str(key))]
+
+    # 🧾 الفواتير المدفوعة: عدد وإجمالي لكل يوم
+    paid = Order.objects.filter(is_paid=True, created_at__gte=start, created_at__lt=end)
+    for created_at, total in paid.values_list("created_at", "total").iterator():
+        snapshot = row(business_day(created_at), "orders", "paid")
+        snapshot.count += 1
+        snapshot.amount += total
+
+    # 🍳 إيراد كل قسم من الملخص اليومي (صفوف قليلة أصلًا)
+    sections = (
+        DailySalesRollup.objects.filter(day__gte=closing.start_date, day__lte=closing.end_date)
+        .values("day", "section")
+        .annotate(qty=Sum("quantity"), revenue=Sum("revenue"), cost=Sum("cost"))
+        .order_by()
+    )
+    for section in sections:
+        row(section["day"], "section", section["section"],
+            units=section["qty"], amount=section["revenue"], purchase=section["cost"])
+
+    # 📦 المباع لكل مكون (البيع موجب والرجوع سالب زي الدفتر)
+    sold = StockMovement.objects.filter(kind__in=["sale", "restore"], created_at__gte=start, created_at__lt=end)
+    for created_at, material_id, quantity, cost, price in sold.values_list(
+        "created_at", "material_id", "quantity", "addition_cost", "purchase_price"
+    ).iterator():
+        snapshot = row(business_day(created_at), "material", material_id, material_id=material_id)
+        snapshot.units -= quantity
+        snapshot.amount -= quantity * cost
+        snapshot.purchase -= quantity * price
+
+    # 📒 النسريات والتبس
+    expenses = ExtraExpense.objects.filter(created_at__gte=start, created_at__lt=end)
+    for created_at, category, amount in expenses.values_list("created_at", "category", "amount").iterator():
+        snapshot = row(business_day(created_at), "expense", category)
+        snapshot.count += 1
+        snapshot.amount += amount
+
+    with transaction.atomic():
+        closing.snapshots.all().delete()
+        ClosingSnapshot.objects.bulk_create(rows.values(), batch_size=500)
+        closing.snapshot_at = timezone.now()
+        closing.save(update_fields=["snapshot_at"])
+    return len(rows)
+
+
+def closed_ranges(start=None, end=None):
+    """
+    [(من، لحد)] الأيام المقفولة (اللي ليها snapshot) جوه [start, end] — مقصوصة عليه
+    ومدموجة لو الفترات متلاصقة أو متداخلة. None يعني من غير حد.
+    """
+    closings = MonthlyClosing.objects.filter(
+        snapshot_at__isnull=False, start_date__isnull=False, end_date__isnull=False
+    )
+    if start:
+        closings = closings.filter(end_date__gte=start)
+    if end:
+        closings = closings.filter(start_date__lte=end)
+
+    ranges = []
+    for first, last in sorted(closings.values_list("start_date", "end_date")):
+        first = max(first, start) if start else first
+        last = min(last, end) if end else last
+        if ranges and first.toordinal() <= ranges[-1][1].toordinal() + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def outside(field, ranges):
+    """فلتر الذيل المفتوح: الصفوف الخام اللي مش في أي يوم مقفول."""
+    condition = Q()
+    for first, last in ranges:
+        condition &= ~Q(**{f"{field}__gte": day_bounds(first)[0], f"{field}__lt": day_bounds(last)[1]})
+    return condition
+
+
+def _within(ranges, kind):
+    days = Q()
+    for first, last in ranges:
+        days |= Q(day__gte=first, day__lte=last)
+    # لو تقفيلتين غطوا نفس اليوم بناخد صفوف آخر واحدة بس عشان اليوم ما يتحسبش مرتين
+    latest = (
+        MonthlyClosing.objects.filter(
+            snapshot_at__isnull=False, start_date__lte=OuterRef("day"), end_date__gte=OuterRef("day")
+        )
+        .order_by("-id")
+        .values("id")[:1]
+    )
+    return ClosingSnapshot.objects.filter(days, kind=kind, closing_id=Subquery(latest))
+
+
+def totals(ranges, kind):
+    """{"count", "units", "amount", "purchase"} لنوع واحد على الأيام المقفولة."""
+    if not ranges:
+        return {"count": 0, "units": 0, "amount": ZERO, "purchase": ZERO}
+    result = _within(ranges, kind).aggregate(
+        count=Sum("count"), units=Sum("units"), amount=Sum("amount"), purchase=Sum("purchase")
+    )
+    return {
+        "count": result["count"] or 0,
+        "units": result["units"] or 0,
+        "amount": result["amount"] or ZERO,
+        "purchase": result["purchase"] or ZERO,
+    }
+
+
+def by_key(ranges, kind):
+    """صف لكل مفتاح (قسم / مكون / نوع مصروف) مجموع على الأيام المقفولة."""
+    if not ranges:
+        return []
+    return list(
+        _within(ranges, kind)
+        .values("key")
+        .annotate(
+            name=F("material__name"),
+            count=Sum("count"),
+            units=Sum("units"),
+            amount=Sum("amount"),
+            purchase=Sum("purchase"),
+        )
+        .annotate(profit=F("amount") - F("purchase"))
+        .order_by("key")
+    )
@@ -1,6 +1,14 @@
 # utils.py
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
 from django.shortcuts import redirect
 from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils.timezone import now
 
 def role_required(allowed_roles):
     def decorator(view_func):
@@ -12,3 +20,61 @@ def role_required(allowed_roles):
             raise PermissionDenied  # لو مش مسموحله
         return _wrapped_view
     return decorator
+
+
+IDEMPOTENCY_KEY_TTL = getattr(settings, "IDEMPOTENCY_KEY_TTL", timedelta(hours=24))
+
+
+def _replay(record):
+    if not record.status_code:
+        # نفس المفتاح لسه بيتنفذ في request تاني
+        return JsonResponse({"error": "الطلب ده لسه بيتنفذ"}, status=409)
+    response = JsonResponse(record.response_body, status=record.status_code, safe=False)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view_func):
+    """
+    لو الـ POST جاي بـ Idempotency-Key وشفناه قبل كده (لنفس اليوزر ونفس الـ endpoint)، بنرجّع نفس الرد المتخزن
+    باستعلام واحد من غير ما الأوردر يتعمل تاني. الردود الفاشلة مش بتتخزن
+    عشان إعادة المحاولة تشتغل عادي. المفاتيح القديمة بتتمسح لوحدها.
+    """
+    from .models import IdempotencyKey
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if request.method not in ("POST", "PATCH") or not key:
+            return view_func(request, *args, **kwargs)
+
+        user = request.user if request.user.is_authenticated else None
+        cutoff = now() - IDEMPOTENCY_KEY_TTL
+        record = IdempotencyKey.objects.filter(user=user, key=key, created_at__gte=cutoff).first()
+        if record:
+            if record.endpoint != request.path:
+                # نفس المفتاح على عملية تانية — غلط من الكلاينت، مش إعادة إرسال
+                return JsonResponse({"error": "مفتاح الطلب ده اتستخدم مع عملية تانية"}, status=422)
+            return _replay(record)
+
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(key=key, endpoint=request.path, user=user)
+            except IntegrityError:
+                return _replay(IdempotencyKey.objects.get(user=user, key=key, endpoint=request.path))
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code >= 400:
+                # منخزنش الفشل: نشيل المفتاح وإعادة المحاولة تنفذ من الأول
+                transaction.set_rollback(True)
+                return response
+
+            body = json.loads(response.content or "null")
+            record.status_code = response.status_code
+            record.response_body = body
+            record.order_id = body.get("order_id") if isinstance(body, dict) else None
+            record.save(update_fields=["status_code", "response_body", "order"])
+        return response
+    return _wrapped_view
@@ -0,0 +1,123 @@
+# events.py
+# قناة push للشاشات (Server-Sent Events): pub/sub جوه البروسيس بدل ما كل شاشة تسأل كل كام ثانية.
+# اللي بيكتب (الكاشير، المطبخ، الدفع) بينشر حدث بعد الـ commit، والشاشات المفتوحة على
+# /events/ بتستلمه على طول. الـ id بتاع كل حدث "<boot>-<n>" عشان المتصفح يكمّل من آخر حدث
+# شافه (Last-Event-ID) بعد ما النت يقطع؛ لو الحدث ده خرج من الذاكرة أو السيرفر اتعمله restart
+# بيوصل حدث reset والشاشة تحمّل من الأول.
+# ⚠️ ده شغال على ASGI بس (sinastarsystem/asgi.py) وبروسيس واحد — على WSGI الـ endpoint بيرجع 204
+# والشاشة بترجع للـ polling.
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+BOOT = str(int(time.time()))
+BUFFER_SIZE = 500
+
+_ids = itertools.count(1)
+_recent = deque(maxlen=BUFFER_SIZE)  # (seq, event, data) لآخر الأحداث عشان الـ resume
+_subscribers = set()
+_lock = threading.Lock()
+
+
+def heartbeat():
+    """كل قد إيه ثانية نبعت ping عشان البروكسي ما يقفلش الاتصال الساكت."""
+    return getattr(settings, "EVENTS_HEARTBEAT", 15)
+
+
+def lifetime():
+    """الاتصال بيتقفل بعد المدة دي والمتصفح بيفتحه تاني لوحده ويكمّل من آخر id."""
+    return getattr(settings, "EVENTS_STREAM_LIFETIME", 300)
+
+
+class _Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def offer(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:
+            # الـ loop اتقفل والشاشة مشيت
+            pass
+
+
+def publish(event, data):
+    """
+    ينشر الحدث بعد commit الـ transaction الحالية (ومن غير transaction على طول) —
+    عشان الشاشة ما تشوفش أوردر لسه ممكن يترجع.
+    """
+    transaction.on_commit(lambda: _dispatch(event, data))
+
+
+def _dispatch(event, data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+    with _lock:
+        message = (next(_ids), event, payload)
+        _recent.append(message)
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        subscriber.offer(message)
+
+
+def _backlog(last_event_id):
+    """الأحداث اللي بعد last_event_id، أو None لو مش هنقدر نكمّل منه (لازم تتنادي جوه _lock)."""
+    if not last_event_id:
+        return []
+    boot, _, seq = last_event_id.partition("-")
+    if boot != BOOT or not seq.isdigit():
+        return None
+    seq = int(seq)
+    if _recent and seq < _recent[0][0] - 1:
+        return None
+    return [message for message in _recent if message[0] > seq]
+
+
+def subscribe(last_event_id=None):
+    """(subscriber, backlog) — التسجيل وقراية الـ backlog تحت نفس القفل فمفيش حدث بيقع بينهم."""
+    subscriber = _Subscriber(asyncio.get_running_loop())
+    with _lock:
+        backlog = _backlog(last_event_id)
+        _subscribers.add(subscriber)
+    return subscriber, backlog
+
+
+def unsubscribe(subscriber):
+    with _lock:
+        _subscribers.discard(subscriber)
+
+
+def _format(message):
+    seq, event, payload = message
+    return f"id: {BOOT}-{seq}\nevent: {event}\ndata: {payload}\n\n"
+
+
+async def stream(last_event_id=None):
+    """الـ body بتاع الـ response: backlog الأول وبعدين الأحداث أول بأول لحد lifetime()."""
+    subscriber, backlog = subscribe(last_event_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + lifetime()
+    try:
+        yield "retry: 3000\n\n"
+        if backlog is None:
+            yield "event: reset\ndata: {}\n\n"
+            backlog = []
+        for message in backlog:
+            yield _format(message)
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), min(heartbeat(), remaining))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield _format(message)
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,172 @@
+# kitchen_feed.py
+# فيد التغييرات لشاشات المطبخ: كل تعديل في أصناف الأوردرات بياخد رقم من عداد واحد
+# متزايد (DataVersion "order_items")، والشاشة بتسأل "إيه اللي اتغير بعد رقم كذا".
+# العداد بيتزود جوه نفس transaction الكتابة، والـ UPDATE بيقفل صفه لحد الـ commit —
+# فالأرقام بتوصل للقراية بالترتيب ومفيش تغيير بيتنط من ورا الـ cursor.
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DataVersion, OrderItem, OrderItemTombstone
+
+SEQ_KEY = OrderItem.CHANGE_SEQ_KEY
+PRUNED_KEY = "order_items_pruned"
+
+
+def tombstone_ttl():
+    """أثر الصنف الممسوح بيفضل قد إيه — الشاشة اللي غابت أكتر من كده بتعمل reload."""
+    return getattr(settings, "KITCHEN_FEED_TOMBSTONE_TTL", timedelta(days=1))
+
+
+def head():
+    return DataVersion.current(SEQ_KEY)
+
+
+def next_seq():
+    """رقم واحد لكل transaction — كل الأصناف اللي اتغيرت فيها بتاخده."""
+    return DataVersion.bump(SEQ_KEY)
+
+
+def stamp(items, seq=None):
+    """يحط رقم التغيير على أصناف قبل bulk_create / bulk_update (ولازم change_seq يبقى في الحقول)."""
+    seq = seq or next_seq()
+    for item in items:
+        item.change_seq = seq
+    return seq
+
+
+def remove_items(queryset, seq=None):
+    """يمسح الأصناف ويسيب أثر لكل واحد بنفس رقم التغيير."""
+    rows = list(queryset.values_list("id", "order_id", "menuitem__section"))
+    if not rows:
+        return
+    seq = seq or next_seq()
+    OrderItemTombstone.objects.bulk_create([
+        OrderItemTombstone(item_id=item_id, order_id=order_id, section=section or "", change_seq=seq)
+        for item_id, order_id, section in rows
+    ])
+    OrderItem.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    _prune()
+
+
+def _ticket(order_id=None, item_ids=None, section=None):
+    items = OrderItem.objects.filter(is_done=False, order__is_paid=False)
+    if order_id is not None:
+        items = items.filter(order_id=order_id)
+    if item_ids is not None:
+        items = items.filter(id__in=item_ids)
+    if section:
+        items = items.filter(menuitem__section=section)
+    return items
+
+
+def _mark(items, **fields):
+    with transaction.atomic():
+        # العداد الأول: صفه بيفضل مقفول لحد الـ commit فالأوردرات اللي اتقرت هي نفسها اللي هتتحدث
+        seq = next_seq()
+        order_ids = sorted(set(items.values_list("order_id", flat=True)))
+        count = items.update(change_seq=seq, **fields)
+    return count, seq, order_ids
+
+
+def complete_items(order_id=None, item_ids=None, section=None):
+    """
+    يخلّص تذكرة كاملة (order_id) أو أصناف بعينها (item_ids) لقسم واحد في UPDATE واحد،
+    بوقت الخلاص ورقم تغيير واحد. بيرجّع (عدد الأصناف، رقم التغيير، أرقام الأوردرات اللي اتأثرت).
+    """
+    return _mark(_ticket(order_id, item_ids, section), is_done=True, done_at=timezone.now())
+
+
+def start_items(order_id=None, item_ids=None, section=None):
+    """المطبخ بدأ في التذكرة — أول ضغطة بس هي اللي بتتسجل."""
+    return _mark(_ticket(order_id, item_ids, section).filter(started_at__isnull=True), started_at=timezone.now())
+
+
+def serve_items(queryset):
+    """الويتر قدّم الأصناف: بتفضل في الأوردر (والحساب) وبتختفي من شاشته."""
+    return _mark(queryset.filter(is_done=True, served_at__isnull=True), served_at=timezone.now())
+
+
+def _prune():
+    cutoff = timezone.now() - tombstone_ttl()
+    old = OrderItemTombstone.objects.filter(created_at__lt=cutoff)
+    last = old.order_by("-change_seq").values_list("change_seq", flat=True).first()
+    if last is None:
+        return
+    old.delete()
+    if last > DataVersion.current(PRUNED_KEY):
+        DataVersion.objects.update_or_create(key=PRUNED_KEY, defaults={"version": last})
+
+
+def open_items(is_done, section=None):
+    """
+    أصناف الأوردرات المفتوحة متجمعة بالأوردر: [{"order", "items"}] بترتيب وقت الأوردر.
+    استعلام واحد على OrderItem (index is_done + order) بدل استعلامات لكل أوردر.
+    """
+    items = (
+        OrderItem.objects.filter(is_done=is_done, served_at__isnull=True, order__is_paid=False)
+        .select_related("order", "menuitem")
+        .order_by("order__created_at", "order_id", "id")
+    )
+    if section:
+        items = items.filter(menuitem__section=section)
+
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item.order_id, {"order": item.order, "items": []})["items"].append(item)
+    return list(grouped.values())
+
+
+def _status(item):
+    if item.order.is_paid:
+        return "removed"
+    if item.served_at:
+        return "served"
+    if item.is_done:
+        return "done"
+    return "started" if item.started_at else "pending"
+
+
+def changes_since(cursor, section=None):
+    """
+    {"cursor": رقم جديد, "changes": [...], "reset": bool}.
+    لو مفيش جديد: استعلام واحد على صف العداد بالـ unique key وخلاص.
+    """
+    top = head()
+    if top <= cursor:
+        return {"cursor": top, "changes": [], "reset": False}
+    if cursor and cursor < DataVersion.current(PRUNED_KEY):
+        # آثار المسح اللي الشاشة محتاجاها اتشالت → لازم تحمّل من الأول
+        return {"cursor": top, "changes": [], "reset": True}
+
+    items = (
+        OrderItem.objects.filter(change_seq__gt=cursor, change_seq__lte=top)
+        .select_related("order", "menuitem")
+        .order_by("change_seq", "id")
+    )
+    removed = OrderItemTombstone.objects.filter(change_seq__gt=cursor, change_seq__lte=top)
+    if section:
+        items = items.filter(menuitem__section=section)
+        removed = removed.filter(section=section)
+
+    changes = [
+        {
+            "id": item.id,
+            "order_id": item.order_id,
+            "order_type": item.order.order_type,
+            "table": item.order.table_number,
+            "name": item.menuitem.name,
+            "qty": item.quantity,
+            "section": item.menuitem.section,
+            "status": _status(item),
+            "started": item.started_at is not None,
+        }
+        for item in items
+    ]
+    changes.extend(
+        {"id": t.item_id, "order_id": t.order_id, "section": t.section, "status": "removed"}
+        for t in removed.order_by("change_seq", "id")
+    )
+    return {"cursor": top, "changes": changes, "reset": False}
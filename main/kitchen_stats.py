@@ -0,0 +1,139 @@
+# kitchen_stats.py
+# تقرير ضغط الأقسام: من دورة حياة الأصناف (queued → started → done) بنحسب لكل قسم ولكل ساعة
+# في اليوم: كام صنف بيخلص في الساعة، وقت التحضير p50/p95، وطول الطابور.
+# الحساب بيلف على أصناف آخر كام يوم فبيتعمل مرة (build_kitchen_stats / زرار في التقرير)
+# ويتخزن في KitchenLoadStat، والتقرير نفسه بيقرا الجدول ده بس.
+import math
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import KitchenLoadStat, MenuItem, OrderItem
+
+DEFAULT_DAYS = 28
+
+
+def percentile(values, pct):
+    """nearest-rank على لستة مترتبة."""
+    if not values:
+        return None
+    return values[max(math.ceil(pct / 100 * len(values)), 1) - 1]
+
+
+def prep_seconds(row):
+    """من أول ما المطبخ بدأ (أو من الطلب لو محدش داس "بدأ") لحد ما خلص."""
+    start = row["started_at"] or row["queued_at"]
+    return max(int((row["done_at"] - start).total_seconds()), 0)
+
+
+def _hour(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def _queue_peaks(moves):
+    """
+    moves: [(وقت, +1 دخل الطابور / -1 خرج)] لقسم واحد → {بداية الساعة: أعلى طابور فيها}.
+    الساعات اللي ما حصلش فيها حركة والطابور مش فاضي بتاخد الطول اللي كان عليه.
+    """
+    peaks = {}
+    depth = 0
+    bucket = None
+    for moment, delta in sorted(moves):
+        hour = _hour(moment)
+        if bucket is not None and depth:
+            gap = bucket + timedelta(hours=1)
+            while gap < hour:
+                peaks[gap] = max(peaks.get(gap, 0), depth)
+                gap += timedelta(hours=1)
+        depth += delta
+        peaks[hour] = max(peaks.get(hour, 0), depth)
+        bucket = hour
+    return peaks
+
+
+def compute(days=DEFAULT_DAYS, now=None):
+    """لستة KitchenLoadStat (مش محفوظة) لكل (قسم، ساعة) فيها أي حركة في آخر days يوم."""
+    since = (now or timezone.now()) - timedelta(days=days)
+    rows = (
+        OrderItem.objects.filter(queued_at__gte=since)
+        .values("menuitem__section", "queued_at", "started_at", "done_at", "order__is_paid")
+        .order_by()
+    )
+
+    prep = defaultdict(list)
+    moves = defaultdict(list)
+    for row in rows.iterator():
+        section = row["menuitem__section"]
+        if row["done_at"]:
+            prep[(section, timezone.localtime(row["done_at"]).hour)].append(prep_seconds(row))
+            moves[section] += [(row["queued_at"], 1), (row["done_at"], -1)]
+        elif not row["order__is_paid"]:
+            # لسه مستني فعلًا — الأوردر المدفوع من غير ما الصنف يخلص ما يتحسبش طابور للأبد
+            moves[section].append((row["queued_at"], 1))
+
+    depth_sum = defaultdict(int)
+    depth_peak = defaultdict(int)
+    for section, section_moves in moves.items():
+        for hour, peak in _queue_peaks(section_moves).items():
+            key = (section, hour.hour)
+            depth_sum[key] += peak
+            depth_peak[key] = max(depth_peak[key], peak)
+
+    stats = []
+    for section, hour in sorted(set(prep) | set(depth_sum)):
+        times = sorted(prep.get((section, hour), []))
+        stats.append(KitchenLoadStat(
+            section=section,
+            hour=hour,
+            days=days,
+            items_per_hour=(Decimal(len(times)) / days).quantize(Decimal("0.01")),
+            prep_p50=percentile(times, 50),
+            prep_p95=percentile(times, 95),
+            queue_depth=(Decimal(depth_sum[(section, hour)]) / days).quantize(Decimal("0.01")),
+            queue_peak=depth_peak[(section, hour)],
+        ))
+    return stats
+
+
+def rebuild(days=DEFAULT_DAYS):
+    stats = compute(days)
+    with transaction.atomic():
+        KitchenLoadStat.objects.all().delete()
+        KitchenLoadStat.objects.bulk_create(stats)
+    return stats
+
+
+def live_queue():
+    """{قسم: عدد الأصناف المستنية دلوقتي} — استعلام واحد مجمّع."""
+    return dict(
+        OrderItem.objects.filter(is_done=False, served_at__isnull=True, order__is_paid=False)
+        .values_list("menuitem__section")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+
+
+def report():
+    """[{"section", "label", "hours": [stat أو None × 24], "waiting"}] + وقت آخر حساب."""
+    labels = dict(MenuItem.SECTION_CHOICES)
+    by_section = defaultdict(dict)
+    computed_at = None
+    for stat in KitchenLoadStat.objects.all():
+        by_section[stat.section][stat.hour] = stat
+        computed_at = max(computed_at or stat.computed_at, stat.computed_at)
+
+    waiting = live_queue()
+    sections = []
+    for section in sorted(set(by_section) | set(waiting)):
+        hours = by_section.get(section, {})
+        sections.append({
+            "section": section,
+            "label": labels.get(section, section),
+            "hours": [hours.get(hour) for hour in range(24)],
+            "waiting": waiting.get(section, 0),
+        })
+    return sections, computed_at
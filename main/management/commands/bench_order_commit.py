@@ -0,0 +1,68 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from main.models import Material, MenuItem, Recipe, SinastarInventory
+from main.order_commit import OrderCommitter
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "قياس زمن حفظ الأوردر وعدد الاستعلامات حسب عدد الأصناف (كل حاجة بترجع rollback)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1,5,10,20,50", help="أحجام الأوردر مفصولة بفاصلة")
+        parser.add_argument("--repeat", type=int, default=5, help="عدد المرات لكل حجم")
+        parser.add_argument("--ingredients", type=int, default=3, help="عدد المكونات لكل صنف")
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options["sizes"].split(",") if s.strip()]
+        try:
+            with transaction.atomic():
+                self._run(sizes, options["repeat"], options["ingredients"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, sizes, repeat, ingredients):
+        user = User.objects.filter(is_superuser=True).first()
+        menu = self._fixture(max(sizes), ingredients)
+        committer = OrderCommitter(user)
+        committer.create("takeaway", [(menu[0].id, 1)])  # تسخين كاش الريسيبي
+
+        self.stdout.write(f"{'items':>6} {'queries':>8} {'avg ms':>8} {'max ms':>8}")
+        for size in sizes:
+            lines = [(item.id, 1) for item in menu[:size]]
+            timings = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    committer.create("takeaway", lines)
+                    timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{size:>6} {len(ctx.captured_queries):>8} "
+                f"{sum(timings) / len(timings):>8.2f} {max(timings):>8.2f}"
+            )
+
+    def _fixture(self, size, ingredients):
+        materials = Material.objects.bulk_create([
+            Material(name=f"bench-material-{i}", quantity=0) for i in range(size * ingredients)
+        ])
+        SinastarInventory.objects.bulk_create([
+            SinastarInventory(material=m, type=t, addition=100000)
+            for m in materials for t in ("Baresta", "Canteen")
+        ])
+        menu = MenuItem.objects.bulk_create([
+            MenuItem(name=f"bench-item-{i}", price=10, section="barista") for i in range(size)
+        ])
+        Recipe.objects.bulk_create([
+            Recipe(menuitem=item, material=materials[i * ingredients + j], quantity=1)
+            for i, item in enumerate(menu) for j in range(ingredients)
+        ])
+        return menu
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main import closing_snapshots
+from main.models import MonthlyClosing
+
+
+class Command(BaseCommand):
+    help = "يجمّد أرقام التقفيلات الشهرية في ClosingSnapshot (للتقفيلات القديمة أو بعد تصحيح داتا)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("closing_ids", nargs="*", type=int, help="تقفيلات بعينها (من غير = اللي لسه ما اتعملهاش)")
+        parser.add_argument("--all", action="store_true", help="يعيد بناء كل التقفيلات")
+
+    def handle(self, *args, **options):
+        closings = MonthlyClosing.objects.filter(start_date__isnull=False, end_date__isnull=False)
+        if options["closing_ids"]:
+            closings = closings.filter(id__in=options["closing_ids"])
+        elif not options["all"]:
+            closings = closings.filter(snapshot_at__isnull=True)
+
+        for closing in closings.order_by("start_date"):
+            rows = closing_snapshots.build(closing)
+            self.stdout.write(f"{closing}: {rows} صف")
+        self.stdout.write(self.style.SUCCESS("✅ خلصت"))
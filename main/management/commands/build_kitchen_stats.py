@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main import kitchen_stats
+
+
+class Command(BaseCommand):
+    help = "يحسب تقرير ضغط الأقسام بالساعة (وقت التحضير p50/p95، أصناف في الساعة، الطابور) ويخزنه"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=kitchen_stats.DEFAULT_DAYS, help="عدد الأيام اللي يتحسب منها")
+
+    def handle(self, *args, **options):
+        stats = kitchen_stats.rebuild(options["days"])
+        sections = {stat.section for stat in stats}
+        self.stdout.write(self.style.SUCCESS(
+            f"اتحسب {len(stats)} ساعة لـ {len(sections)} قسم من آخر {options['days']} يوم"
+        ))
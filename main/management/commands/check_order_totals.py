@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from main.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = "يقارن Order.subtotal/total المتخزنين بمجموع الأصناف الفعلي (و --fix يصلحهم)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="صلّح الأوردرات اللي فيها فرق")
+
+    def handle(self, *args, **options):
+        money = DecimalField(max_digits=12, decimal_places=2)
+        items_sum = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(s=Sum(F("unit_price") * F("quantity"), output_field=money))
+            .values("s")
+        )
+        orders = Order.objects.annotate(
+            actual_subtotal=Coalesce(Subquery(items_sum, output_field=money), Value(Decimal("0")), output_field=money),
+        ).annotate(
+            actual_total=F("actual_subtotal") - F("discount") + F("service_charge") + F("tax"),
+        )
+        drifted = [
+            o for o in orders.only("id", "subtotal", "total", "discount", "service_charge", "tax")
+            if o.subtotal != round(o.actual_subtotal, 2) or o.total != round(o.actual_total, 2)
+        ]
+
+        for order in drifted:
+            self.stdout.write(
+                f"Order #{order.id}: subtotal {order.subtotal} ≠ {order.actual_subtotal:.2f}, "
+                f"total {order.total} ≠ {order.actual_total:.2f}"
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("كل الإجماليات مظبوطة"))
+            return
+
+        if options["fix"]:
+            for order in drifted:
+                order.subtotal = order.actual_subtotal
+                order.total = order.actual_total
+            Order.objects.bulk_update(drifted, ["subtotal", "total"], batch_size=500)
+            self.stdout.write(self.style.SUCCESS(f"اتصلح {len(drifted)} أوردر"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} أوردر فيهم فرق — شغّل بـ --fix"))
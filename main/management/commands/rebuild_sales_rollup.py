@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from main import sales_rollup
+
+
+class Command(BaseCommand):
+    help = "يعيد حساب DailySalesRollup من أصناف الأوردرات (كله أو أيام معينة)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("days", nargs="*", help="أيام بصيغة YYYY-MM-DD (من غيرها: كله)")
+
+    def handle(self, *args, **options):
+        days = [parse_date(day) for day in options["days"]] or None
+        count = sales_rollup.rebuild(days)
+        self.stdout.write(self.style.SUCCESS(f"اتحسب {count} صف"))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main import stock
+from main.models import MaterialStock
+
+
+class Command(BaseCommand):
+    help = "يقارن ملخص MaterialStock ورصيد دفتر الحركة بمجموع صفوف SinastarInventory (و --fix يعيد حساب الملخص)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="اعيد حساب الملخص للمكونات اللي فيها فرق")
+
+    def handle(self, *args, **options):
+        fields = ["total", *MaterialStock.TYPE_FIELDS.values()]
+        counted = stock.count_material_stock()
+        stored = {row["material_id"]: row for row in MaterialStock.objects.values("material_id", *fields)}
+
+        drifted = []
+        for material_id in sorted(set(counted) | set(stored)):
+            actual = counted.get(material_id)
+            saved = stored.get(material_id)
+            if actual is None:
+                self.stdout.write(f"Material #{material_id}: ملخص من غير ولا صف مخزن")
+            elif saved is None:
+                self.stdout.write(f"Material #{material_id}: مالوش ملخص (المفروض {actual['total']})")
+            else:
+                diffs = [f"{f} {saved[f]} ≠ {actual[f]}" for f in fields if saved[f] != actual[f]]
+                if not diffs:
+                    continue
+                self.stdout.write(f"Material #{material_id}: " + "، ".join(diffs))
+            drifted.append(material_id)
+
+        # الدفتر ما بيتعدلش: الفرق هنا معناه حركة اتعملت من ورا الدفتر (UPDATE مباشر مثلًا)
+        levels = stock.ledger_levels()
+        for material_id in sorted(set(levels) | set(counted)):
+            actual = counted.get(material_id, {}).get("total", 0)
+            if (levels.get(material_id) or 0) != actual:
+                self.stdout.write(self.style.WARNING(
+                    f"Material #{material_id}: رصيد الدفتر {levels.get(material_id) or 0} ≠ المخزن {actual}"
+                ))
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("ملخص المخزن مظبوط"))
+            return
+
+        if options["fix"]:
+            with transaction.atomic():
+                stock.recount_material_stock(drifted, record=False)
+            self.stdout.write(self.style.SUCCESS(f"اتصلح {len(drifted)} مكون"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(drifted)} مكون فيهم فرق — شغّل بـ --fix"))
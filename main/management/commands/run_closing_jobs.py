@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from main import closing_jobs
+from main.models import ClosingJob
+
+
+class Command(BaseCommand):
+    help = "يشغل التقفيلات الشهرية المستنية ويكمّل اللي وقعت في النص (من غير ما يخصم حاجة مرتين)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("job_ids", nargs="*", type=int, help="أرقام شغلانات بعينها (حتى لو فشلت قبل كده)")
+        parser.add_argument("--retry-failed", action="store_true", help="يعيد كمان الشغلانات اللي فشلت")
+
+    def handle(self, *args, **options):
+        if options["job_ids"]:
+            jobs = ClosingJob.objects.filter(id__in=options["job_ids"])
+        else:
+            # المستنية + اللي بقالها كتير running من غير heartbeat (البروسيس بتاعها وقع)
+            pending = Q(status="queued") | Q(
+                status="running", updated_at__lt=timezone.now() - closing_jobs.stale_after()
+            )
+            if options["retry_failed"]:
+                pending |= Q(status="failed")
+            jobs = ClosingJob.objects.filter(pending)
+
+        for job_id in jobs.order_by("created_at").values_list("id", flat=True):
+            if closing_jobs.run(job_id, resume_stale=True):
+                self.stdout.write(self.style.SUCCESS(f"✅ تقفيلة #{job_id} خلصت"))
+                continue
+            job = ClosingJob.objects.get(id=job_id)
+            if job.status == "failed":
+                self.stdout.write(self.style.ERROR(f"❌ تقفيلة #{job_id} فشلت عند {job.step}: {job.error}"))
+            else:
+                self.stdout.write(f"تقفيلة #{job_id} مش متاحة ({job.status})")
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model("main", "Order")
+    OrderItem = apps.get_model("main", "OrderItem")
+
+    subtotals = dict(
+        OrderItem.objects.values("order_id")
+        .annotate(s=models.Sum(
+            models.F("menuitem__price") * models.F("quantity"),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ))
+        .values_list("order_id", "s")
+    )
+
+    batch = []
+    for order in Order.objects.only("id", "discount", "service_charge", "tax").iterator():
+        order.subtotal = subtotals.get(order.id) or 0
+        order.total = order.subtotal - order.discount + order.service_charge + order.tax
+        batch.append(order)
+        if len(batch) >= 500:
+            Order.objects.bulk_update(batch, ["subtotal", "total"])
+            batch = []
+    Order.objects.bulk_update(batch, ["subtotal", "total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0039_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
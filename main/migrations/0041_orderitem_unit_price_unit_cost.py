@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+def backfill_unit_price(apps, schema_editor):
+    OrderItem = apps.get_model("main", "OrderItem")
+    MenuItem = apps.get_model("main", "MenuItem")
+    OrderItem.objects.update(unit_price=models.Subquery(
+        MenuItem.objects.filter(pk=models.OuterRef("menuitem_id")).values("price")[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0040_order_subtotal_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+            preserve_default=False,
+        ),
+        # الأسعار القديمة مش متسجلة، فأقرب حاجة ليها سعر المنيو الحالي.
+        # unit_cost بيفضل صفر للأصناف القديمة لأن تكلفتها وقتها مش معروفة.
+        migrations.RunPython(backfill_unit_price, migrations.RunPython.noop),
+    ]
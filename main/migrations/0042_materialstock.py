@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TYPE_FIELDS = {
+    'Canteen': 'canteen',
+    'mat3am': 'mat3am',
+    'Baresta': 'baresta',
+    '7alak': 'halak',
+    'shesha': 'shesha',
+}
+
+
+def backfill_stock(apps, schema_editor):
+    SinastarInventory = apps.get_model("main", "SinastarInventory")
+    MaterialStock = apps.get_model("main", "MaterialStock")
+
+    stocks = {}
+    for material_id, inv_type, total in (
+        SinastarInventory.objects.values("material_id", "type")
+        .annotate(total=models.Sum("addition"))
+        .values_list("material_id", "type", "total")
+    ):
+        row = stocks.setdefault(material_id, MaterialStock(material_id=material_id))
+        field = TYPE_FIELDS.get(inv_type)
+        if field:
+            setattr(row, field, getattr(row, field) + total)
+        row.total += total
+    MaterialStock.objects.bulk_create(stocks.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0041_orderitem_unit_price_unit_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialStock',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='main.material')),
+                ('total', models.IntegerField(default=0)),
+                ('canteen', models.IntegerField(default=0)),
+                ('mat3am', models.IntegerField(default=0)),
+                ('baresta', models.IntegerField(default=0)),
+                ('halak', models.IntegerField(default=0)),
+                ('shesha', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_ledger(apps, schema_editor):
+    """
+    سجل المبيعات القديم يتنقل للدفتر كحركات بيع (من غير ربط بأوردر)،
+    وبعده صف تقفيلة افتتاحي لكل مكون برصيده الحالي.
+    """
+    SoldMaterialHistory = apps.get_model("main", "SoldMaterialHistory")
+    MaterialStock = apps.get_model("main", "MaterialStock")
+    StockMovement = apps.get_model("main", "StockMovement")
+
+    batch = []
+    for sold in SoldMaterialHistory.objects.order_by("id").iterator():
+        batch.append(StockMovement(
+            material_id=sold.material_id,
+            type=sold.type,
+            kind="sale",
+            quantity=-sold.quantity,
+            addition_cost=sold.addition_cost,
+            purchase_price=sold.purchase_price,
+            created_at=sold.created_at,
+        ))
+        if len(batch) >= 500:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(material_id=material_id, kind="closing", balance=total)
+            for material_id, total in MaterialStock.objects.values_list("material_id", "total")
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0042_materialstock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(blank=True, choices=[('Canteen', 'Canteen'), ('mat3am', 'mat3am'), ('Baresta', 'Baresta'), ('7alak', '7alak'), ('shesha', 'shesha')], max_length=20)),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('restore', 'Restore'), ('adjustment', 'Adjustment'), ('closing', 'Closing')], max_length=20)),
+                ('quantity', models.IntegerField(default=0)),
+                ('balance', models.IntegerField(blank=True, null=True)),
+                ('addition_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('purchase_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('inventory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.sinastarinventory')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.material')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='main.order')),
+                ('order_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='main.orderitem')),
+                ('reverses', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reversals', to='main.stockmovement')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', 'kind', 'id'], name='main_stockm_materia_f53541_idx'), models.Index(fields=['order', 'kind'], name='main_stockm_order_i_959825_idx')],
+            },
+        ),
+        migrations.RunPython(seed_ledger, migrations.RunPython.noop),
+    ]
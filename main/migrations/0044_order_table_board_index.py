@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0043_stockmovement'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_type', 'is_paid', 'table_number'], name='main_order_order_t_e0c156_idx'),
+        ),
+    ]
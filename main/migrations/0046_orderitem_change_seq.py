@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0045_order_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItemTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.BigIntegerField()),
+                ('order_id', models.BigIntegerField()),
+                ('section', models.CharField(blank=True, max_length=20)),
+                ('change_seq', models.PositiveBigIntegerField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0046_orderitem_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['is_done', 'order'], name='orderitem_done_order_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0047_orderitem_done_order_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0048_order_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='done_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_queued_at(apps, schema_editor):
+    # الأصناف القديمة اتطلبت مع الأوردر بتاعها
+    Order = apps.get_model("main", "Order")
+    OrderItem = apps.get_model("main", "OrderItem")
+    OrderItem.objects.update(
+        queued_at=models.Subquery(Order.objects.filter(pk=models.OuterRef("order_id")).values("created_at")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0049_orderitem_done_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='queued_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='served_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='KitchenLoadStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(max_length=20)),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('days', models.PositiveSmallIntegerField()),
+                ('items_per_hour', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('prep_p50', models.PositiveIntegerField(blank=True, null=True)),
+                ('prep_p95', models.PositiveIntegerField(blank=True, null=True)),
+                ('queue_depth', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('queue_peak', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['section', 'hour'],
+                'unique_together': {('section', 'hour')},
+            },
+        ),
+        migrations.RunPython(backfill_queued_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    # اليوم العادي (CAFE_DAY_STARTS_AT = 0) — لو اتغير: manage.py rebuild_sales_rollup
+    OrderItem = apps.get_model("main", "OrderItem")
+    DailySalesRollup = apps.get_model("main", "DailySalesRollup")
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    rows = (
+        OrderItem.objects.annotate(day=TruncDate("order__created_at"))
+        .values("day", "menuitem__section", "menuitem_id")
+        .annotate(
+            qty=models.Sum("quantity"),
+            revenue=models.Sum(models.F("unit_price") * models.F("quantity"), output_field=money),
+            cost=models.Sum(models.F("unit_cost") * models.F("quantity"), output_field=money),
+        )
+        .order_by()
+    )
+    DailySalesRollup.objects.bulk_create(
+        [
+            DailySalesRollup(
+                day=row["day"], section=row["menuitem__section"], menuitem_id=row["menuitem_id"],
+                quantity=row["qty"], revenue=row["revenue"], cost=row["cost"],
+            )
+            for row in rows
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0051_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('section', models.CharField(max_length=20)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('menuitem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='main.menuitem')),
+            ],
+            options={
+                'unique_together': {('day', 'section', 'menuitem')},
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
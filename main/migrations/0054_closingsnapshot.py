@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0053_closingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlyclosing',
+            name='snapshot_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ClosingSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(choices=[('orders', 'الفواتير'), ('section', 'إيراد قسم'), ('material', 'مكون مباع'), ('expense', 'مصاريف')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=50)),
+                ('count', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('purchase', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('closing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='main.monthlyclosing')),
+                ('material', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.material')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'day'], name='closing_snapshot_kind_day')],
+                'unique_together': {('closing', 'day', 'kind', 'key')},
+            },
+        ),
+    ]
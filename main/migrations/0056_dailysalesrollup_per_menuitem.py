@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:05
+
+from django.db import migrations
+
+
+def merge_sections(apps, schema_editor):
+    # الصنف اللي اتنقل بين قسمين كان ليه أكتر من صف في نفس اليوم → صف واحد (قسم أقدم صف)
+    DailySalesRollup = apps.get_model("main", "DailySalesRollup")
+    kept = {}
+    merged = {}
+    extra = []
+    for row in DailySalesRollup.objects.order_by("id").iterator():
+        first = kept.setdefault((row.day, row.menuitem_id), row)
+        if first is row:
+            continue
+        first.quantity += row.quantity
+        first.revenue += row.revenue
+        first.cost += row.cost
+        merged[first.pk] = first
+        extra.append(row.pk)
+    if extra:
+        DailySalesRollup.objects.filter(pk__in=extra).delete()
+        DailySalesRollup.objects.bulk_update(list(merged.values()), ["quantity", "revenue", "cost"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0055_idempotencykey_scope'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_sections, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='dailysalesrollup',
+            unique_together={('day', 'menuitem')},
+        ),
+    ]
@@ -85,6 +85,37 @@ class SinastarInventory(models.Model):
 
 
 
+class MaterialStock(models.Model):
+    """
+    ملخص المتاح من كل مكون في كل المخازن — صف واحد لكل مكون.
+    بيتعدل في نفس transaction مع أي خصم أو رجوع أو إضافة للمخزن،
+    فالتشيك بيبقى قراية بالـ primary key بدل جمع صفوف SinastarInventory.
+    """
+    # type في SinastarInventory → اسم الحقل هنا (7alak مينفعش يبقى اسم حقل)
+    TYPE_FIELDS = {
+        'Canteen': 'canteen',
+        'mat3am': 'mat3am',
+        'Baresta': 'baresta',
+        '7alak': 'halak',
+        'shesha': 'shesha',
+    }
+
+    material = models.OneToOneField(Material, on_delete=models.CASCADE, primary_key=True, related_name='stock')
+    total = models.IntegerField(default=0)
+    canteen = models.IntegerField(default=0)
+    mat3am = models.IntegerField(default=0)
+    baresta = models.IntegerField(default=0)
+    halak = models.IntegerField(default=0)
+    shesha = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def by_type(self):
+        return {t: getattr(self, field) for t, field in self.TYPE_FIELDS.items()}
+
+    def __str__(self):
+        return f"{self.material_id} - {self.total}"
+
+
 class SinastarInventoryHistory(models.Model):
     TYPE_CHOICES = [
         ('Canteen', 'Canteen'),
@@ -212,16 +243,53 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, blank=True, null=True)
     note = models.TextField(blank=True, null=True)
 
+    # ✅ إجماليات متخزنة — بتتحدث مع كل إضافة/تعديل/حذف أصناف (refresh_totals)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True)
+
+    # ✅ بيزيد مع كل تعديل في الأصناف — الجرسون بيبعته عشان نعرف لو حد سبقه
+    version = models.PositiveIntegerField(default=0)
+
+    # ✅ رقم آخر حفظ (عداد واحد لكل الأوردرات) — صفحة الأوردرات بتسأل "إيه اللي اتغير بعد رقم كذا"
+    change_seq = models.PositiveBigIntegerField(default=0, db_index=True, editable=False)
+
+    CHANGE_SEQ_KEY = "orders"
+
+    class Meta:
+        indexes = [
+            # لوحة الترابيزات: الأوردرات المفتوحة في الكافيه مترتبة بالترابيزة
+            models.Index(fields=["order_type", "is_paid", "table_number"]),
+            # صفحة الأوردرات: keyset على (created_at, id) من الأحدث، ولوحدها أو لكاشير واحد
+            models.Index(fields=["-created_at", "-id"], name="order_recent_idx"),
+            models.Index(fields=["cashier", "-created_at", "-id"], name="order_cashier_recent_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.get_order_type_display()}"
 
-    @property
-    def subtotal(self):
-        return sum(item.total_price for item in self.items.all())
-
-    @property
-    def total(self):
-        return self.subtotal - self.discount + self.service_charge + self.tax
+    def save(self, *args, **kwargs):
+        # الـ total دايمًا مشتق من باقي الأعمدة
+        self.total = self.subtotal - self.discount + self.service_charge + self.tax
+        self.change_seq = DataVersion.bump(self.CHANGE_SEQ_KEY)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [*{*update_fields, "total", "change_seq"}]
+        super().save(*args, **kwargs)
+
+    def items_subtotal(self):
+        """مجموع الأصناف محسوب في SQL."""
+        return self.items.aggregate(
+            s=models.Sum(
+                models.F("unit_price") * models.F("quantity"),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        )["s"] or 0
+
+    def refresh_totals(self, save=True):
+        self.subtotal = self.items_subtotal()
+        if save:
+            self.save(update_fields=["subtotal"])
+        return self.subtotal
 
 
 class OrderItem(models.Model):
@@ -229,13 +297,47 @@ class OrderItem(models.Model):
     menuitem = models.ForeignKey("MenuItem", on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     is_done = models.BooleanField(default=False)
+    # ✅ دورة حياة الصنف: اتطلب → المطبخ بدأ فيه → خلص → الويتر قدّمه
+    # (المقدَّم بيفضل في الأوردر وما بيتمسحش — ده اللي بيتحسب منه وقت التحضير وضغط الأقسام)
+    queued_at = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    done_at = models.DateTimeField(null=True, blank=True, editable=False)
+    served_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # ✅ سعر البيع وتكلفة المكونات وقت الطلب — تعديل المنيو بعد كده ما يغيرش الإيرادات القديمة
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    # ✅ رقم آخر تغيير (عداد واحد متزايد لكل الأصناف) — شاشات المطبخ بتسأل "إيه اللي اتغير بعد رقم كذا"
+    change_seq = models.PositiveBigIntegerField(default=0, db_index=True, editable=False)
+
+    CHANGE_SEQ_KEY = "order_items"
+
+    class Meta:
+        indexes = [
+            # شاشة المطبخ (is_done=False) والويتر (is_done=True) بيقروا الأصناف مجمعة بالأوردر
+            models.Index(fields=["is_done", "order"], name="orderitem_done_order_idx"),
+        ]
 
     def __str__(self):
         return f"{self.menuitem.name} x {self.quantity}"
 
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.menuitem.price
+        if self.is_done and self.done_at is None:
+            self.done_at = timezone.now()
+        elif not self.is_done:
+            self.done_at = None
+        self.change_seq = DataVersion.bump(self.CHANGE_SEQ_KEY)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [*{*update_fields, "change_seq", "done_at"}]
+        super().save(*args, **kwargs)
+
     @property
     def total_price(self):
-        return self.menuitem.price * self.quantity
+        return self.unit_price * self.quantity
 
     @property
     def section(self):
@@ -247,6 +349,64 @@ class OrderItem(models.Model):
 
 
 
+class OrderItemTombstone(models.Model):
+    """
+    أثر الصنف اللي اتمسح من أوردر — عشان شاشة المطبخ تعرف تشيله.
+    مش FK لأن الصنف نفسه مبقاش موجود.
+    """
+    item_id = models.BigIntegerField()
+    order_id = models.BigIntegerField()
+    section = models.CharField(max_length=20, blank=True)
+    change_seq = models.PositiveBigIntegerField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"removed item {self.item_id} @ {self.change_seq}"
+
+
+class KitchenLoadStat(models.Model):
+    """
+    ضغط كل قسم بالساعة على مدار اليوم — محسوب مسبقًا (build_kitchen_stats) من آخر كام يوم
+    عشان تقرير التوزيع يبقى استعلام واحد على 24 صف لكل قسم.
+    """
+    section = models.CharField(max_length=20)
+    hour = models.PositiveSmallIntegerField()  # 0..23 بتوقيت المحل
+    days = models.PositiveSmallIntegerField()  # الفترة اللي اتحسب منها
+    items_per_hour = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    prep_p50 = models.PositiveIntegerField(null=True, blank=True)  # ثواني
+    prep_p95 = models.PositiveIntegerField(null=True, blank=True)
+    queue_depth = models.DecimalField(max_digits=8, decimal_places=2, default=0)  # متوسط أعلى طابور في الساعة
+    queue_peak = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("section", "hour")
+        ordering = ["section", "hour"]
+
+    def __str__(self):
+        return f"{self.section} {self.hour:02d}:00"
+
+
+class DailySalesRollup(models.Model):
+    """
+    مبيعات كل صنف في كل يوم شغل متجمعة — بتتحدث في نفس transaction الأوردر
+    (إنشاء / تعديل / حذف) عن طريق sales_rollup، والتقفيل اليومي بيقرا منها بدل ما يلف على الأصناف.
+    صف واحد لكل (يوم، صنف)؛ section قسم الصنف وقت ما الصف اتعمل.
+    """
+    day = models.DateField()
+    section = models.CharField(max_length=20)
+    menuitem = models.ForeignKey("MenuItem", on_delete=models.CASCADE, related_name="daily_sales")
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("day", "menuitem")
+
+    def __str__(self):
+        return f"{self.day} {self.section} #{self.menuitem_id} x {self.quantity}"
+
+
 class Profile(models.Model):
     ROLE_CHOICES = [
         ("barista", "باريستا"),
@@ -276,12 +436,82 @@ class MonthlyClosing(models.Model):
     total_nesrayat = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     total_tips = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # اتعملها ClosingSnapshot — التقارير بتقرا أيامها من الـ snapshots مش من الصفوف الخام
+    snapshot_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Closing from {self.start_date} to {self.end_date}"
 
+
+class ClosingSnapshot(models.Model):
+    """
+    أرقام فترة مقفولة متجمدة يوم بيوم (closing_snapshots): الفواتير، إيراد كل قسم،
+    المباع والشراء لكل مكون، والمصاريف. ما بتتعدلش بعد التقفيلة.
+    """
+    KIND_CHOICES = [
+        ("orders", "الفواتير"),
+        ("section", "إيراد قسم"),
+        ("material", "مكون مباع"),
+        ("expense", "مصاريف"),
+    ]
+
+    closing = models.ForeignKey(MonthlyClosing, on_delete=models.CASCADE, related_name="snapshots")
+    day = models.DateField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    key = models.CharField(max_length=50, blank=True)  # القسم / رقم المكون / نوع المصروف
+    material = models.ForeignKey(Material, on_delete=models.SET_NULL, null=True, blank=True)
+    count = models.IntegerField(default=0)  # عدد الفواتير / عدد المصاريف
+    units = models.IntegerField(default=0)  # الكمية (أصناف القسم / وحدات المكون)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # الإيراد / البيع / المبلغ
+    purchase = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # الشراء أو التكلفة
+
+    class Meta:
+        unique_together = ("closing", "day", "kind", "key")
+        indexes = [models.Index(fields=["kind", "day"], name="closing_snapshot_kind_day")]
+
+    def __str__(self):
+        return f"{self.day} {self.kind} {self.key}: {self.amount}"
+
+
+class ClosingJob(models.Model):
+    """
+    تقفيلة شهرية شغالة في الخلفية (closing_jobs): الإجماليات ← تسوية الـ History مكون مكون ← الختام.
+    كل خطوة بتسجل مكانها فلو البروسيس وقع الشغل بيكمّل من نفس النقطة ومفيش حاجة بتتعمل مرتين.
+    """
+    STATUS_CHOICES = [
+        ("queued", "في الانتظار"),
+        ("running", "شغال"),
+        ("done", "خلص"),
+        ("failed", "فشل"),
+    ]
+    STEP_CHOICES = [
+        ("totals", "حساب الإجماليات"),
+        ("history", "تسوية الـ History"),
+        ("finalize", "الختام"),
+        ("finished", "خلص"),
+    ]
+
+    start_date = models.DateField()
+    end_date = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued", db_index=True)
+    step = models.CharField(max_length=20, choices=STEP_CHOICES, default="totals")
+    closing = models.OneToOneField(MonthlyClosing, on_delete=models.SET_NULL, null=True, blank=True, related_name="job")
+    # المكونات اللي اتسوت في خطوة الـ History — عشان الـ resume ما يخصمش منها تاني
+    settled_materials = models.JSONField(default=list, blank=True)
+    materials_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # heartbeat
+
+    def __str__(self):
+        return f"Closing job {self.start_date} → {self.end_date} ({self.status})"
+
         
 
+# ⚠️ قديم: المبيعات بقت بتتسجل في StockMovement (اتنقلت له في 0043) — الجدول ده للقراية بس
 class SoldMaterialHistory(models.Model):
     TYPE_CHOICES = [
         ('Canteen', 'Canteen'),
@@ -317,6 +547,62 @@ class SoldMaterialHistory(models.Model):
         return f"{self.material.name} - {self.addition}"
 
 
+class StockMovement(models.Model):
+    """
+    دفتر حركة المخزن — كل بيع / رجوع / تعديل يدوي / تقفيلة صف واحد ما بيتعدلش.
+    الكمية بالإشارة: البيع بالسالب والرجوع بالموجب.
+    الرجوع بيتسجل كقيد عكسي (reverses) للبيع اللي اتسحب منه بدل ما نعدّل البيع نفسه.
+    صف التقفيلة (closing) بيشيل الرصيد في اللحظة دي، والرصيد الحالي = آخر تقفيلة + الحركات بعدها.
+    """
+    KIND_CHOICES = [
+        ('sale', 'Sale'),
+        ('restore', 'Restore'),
+        ('adjustment', 'Adjustment'),
+        ('closing', 'Closing'),
+    ]
+
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    inventory = models.ForeignKey(SinastarInventory, on_delete=models.SET_NULL, null=True, blank=True)
+    type = models.CharField(max_length=20, choices=SinastarInventory.TYPE_CHOICES, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(default=0)
+    balance = models.IntegerField(null=True, blank=True)  # للتقفيلة بس
+    addition_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # سعر البيع للوحدة
+    purchase_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # سعر الشراء للوحدة
+
+    order = models.ForeignKey("Order", on_delete=models.SET_NULL, null=True, blank=True, related_name="stock_movements")
+    order_item = models.ForeignKey("OrderItem", on_delete=models.SET_NULL, null=True, blank=True, related_name="stock_movements")
+    reverses = models.ForeignKey("self", on_delete=models.SET_NULL, null=True, blank=True, related_name="reversals")
+
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["material", "kind", "id"]),
+            models.Index(fields=["order", "kind"]),
+        ]
+
+    @property
+    def units_sold(self):
+        # البيع موجب والرجوع سالب — زي quantity في SoldMaterialHistory
+        return -self.quantity
+
+    @property
+    def total_sale_price(self):
+        return self.units_sold * self.addition_cost
+
+    @property
+    def total_purchase_price(self):
+        return self.units_sold * self.purchase_price
+
+    @property
+    def profit(self):
+        return self.total_sale_price - self.total_purchase_price
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.material_id} {self.quantity:+d}"
+
+
 # models.py
 class ExtraExpense(models.Model):
     CATEGORY_CHOICES = [
@@ -331,3 +617,49 @@ class ExtraExpense(models.Model):
 
     def __str__(self):
         return f"{self.get_category_display()} - {self.amount} - {self.created_at.strftime('%Y-%m-%d')}"
+
+
+# -------------------
+# Data Versions (ختم نسخة مشترك بين كل الـ workers)
+# -------------------
+class DataVersion(models.Model):
+    key = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+    @classmethod
+    def current(cls, key):
+        return cls.objects.filter(key=key).values_list("version", flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, key, step=1):
+        """يزوّد النسخة بـ UPDATE واحد ويرجّع الرقم الجديد."""
+        if not cls.objects.filter(key=key).update(version=models.F("version") + step):
+            obj, created = cls.objects.get_or_create(key=key, defaults={"version": step})
+            if not created:
+                cls.objects.filter(key=key).update(version=models.F("version") + step)
+        return cls.current(key)
+
+
+# -------------------
+# Idempotency Keys (عشان إعادة الإرسال على الواي فاي الضعيف ما تعملش أوردر مكرر)
+# -------------------
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=100)
+    endpoint = models.CharField(max_length=200)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey("Order", on_delete=models.SET_NULL, null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField(default=0)  # 0 = لسه بيتنفذ
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        # المفتاح بيخص اليوزر والـ endpoint: نفس المفتاح من حد تاني ما يرجّعش رده
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key", "endpoint"], name="idempotency_user_key_endpoint"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} → {self.endpoint} ({self.status_code})"
@@ -0,0 +1,383 @@
+# order_commit.py
+# المكان الوحيد اللي بيكتب أوردرات: كافيه / تيك أواي / قطاع / تعديل / حذف
+# كله بيعدّي من هنا عشان التشيك والخصم والسجل يتعملوا بنفس الطريقة
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import MenuItem, Order, OrderItem
+from . import events, kitchen_feed, sales_rollup, stock, recipe_cache
+
+InsufficientStock = stock.InsufficientStock
+
+
+class UnknownMenuItems(LookupError):
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        super().__init__(f"أصناف غير موجودة: {self.ids}")
+
+
+class StaleOrder(Exception):
+    """الـ version اللي مع الجرسون قديم — حد تاني عدّل الأوردر قبله."""
+
+    def __init__(self, order):
+        self.order = order
+        self.version = order.version
+        super().__init__(f"الأوردر اتعدل (النسخة الحالية {order.version})")
+
+
+class BadVersion(ValueError):
+    """الـ version اللي جاي في الطلب مش رقم — غلط من الكلاينت مش تعارض."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(f"رقم النسخة غير صالح: {value!r}")
+
+
+class OrderClosed(ValueError):
+    def __init__(self, order):
+        self.order = order
+        super().__init__("الأوردر اتدفع ومينفعش يتعدل")
+
+
+class OrderCommitter:
+    """
+    بيحفظ الأوردر في transaction واحدة قصيرة:
+    Order + bulk_create للأصناف → تشيك وخصم المكونات → حركات بيع في الدفتر مربوطة بكل سطر.
+    """
+
+    CAFE_TAX_RATE = Decimal("0.14")
+
+    def __init__(self, user=None):
+        self.user = user
+
+    # ----- إنشاء -----
+    def create(self, order_type, items, *, table_number=None, officer=None, note=None):
+        """items: لستة (menuitem_id, quantity)."""
+        lines = stock.merge_lines(items)
+        menuitems = self._menuitems(lines)
+
+        with transaction.atomic():
+            order = Order.objects.create(
+                order_type=order_type,
+                table_number=table_number,
+                cashier=self.user,
+                officer=officer,
+                note=note,
+            )
+            items = [
+                OrderItem(order=order, menuitem=menuitems[mid], quantity=qty, unit_price=menuitems[mid].price)
+                for mid, qty in lines.items()
+            ]
+            kitchen_feed.stamp(items)
+            OrderItem.objects.bulk_create(items)
+            sold = stock.deduct_lines(
+                lines.items(), order=order, order_items={item.menuitem_id: item for item in items}
+            )
+            self._snapshot_costs(items, sold)
+
+            subtotal = sum((item.total_price for item in items), Decimal("0.00"))
+            self._price(order, subtotal)
+            sales_rollup.apply_diff(order, {})
+            self.announce(order, "created")
+        return order
+
+    # ----- ترابيزة الكافيه -----
+    def set_table_items(self, table_number, items, expected_version=None):
+        """
+        items هي كل أصناف الترابيزة اللي لسه ما اتقدمتش: اللي مش موجود يتشال، والكمية صفر تشيله.
+        اللي اتقدم خلاص مش جزء منها وما بيتلمسش. بيفتح أوردر جديد لو مفيش أوردر مفتوح على الترابيزة.
+        """
+        desired = {}
+        for mid, qty in items:
+            desired[int(mid)] = int(qty)
+        menuitems = self._menuitems({mid for mid, qty in desired.items() if qty > 0})
+
+        with transaction.atomic():
+            order = Order.objects.filter(
+                order_type="cafe", table_number=table_number, is_paid=False
+            ).first()
+            if order:
+                self.claim(order, expected_version)
+                rollup_before = sales_rollup.snapshot(order)
+                self.announce(order, "updated")
+            else:
+                rollup_before = {}
+                order = Order.objects.create(
+                    order_type="cafe", table_number=table_number, cashier=self.user
+                )
+                self.announce(order, "created")
+
+            deltas = []
+            changed = []
+            removed = []
+            new_items = []
+            lines = self._open_lines(order)
+            for mid in sorted(set(lines) | {mid for mid, qty in desired.items() if qty > 0}):
+                target = max(desired.get(mid, 0), 0)
+                diff, line_changes, new_item, line_removed, _ = self._resize(
+                    order, lines.get(mid, []), target, menuitems.get(mid)
+                )
+                if diff:
+                    deltas.append((mid, diff))
+                changed.extend(line_changes)
+                removed.extend(line_removed)
+                if new_item:
+                    new_items.append(new_item)
+
+            seq = kitchen_feed.stamp([*changed, *new_items])
+            OrderItem.objects.bulk_update(changed, ["quantity", "change_seq"])
+            OrderItem.objects.bulk_create(new_items)
+            sold = self._apply_stock(order, deltas, {item.menuitem_id: item for item in (*changed, *new_items)})
+            kitchen_feed.remove_items(OrderItem.objects.filter(pk__in=removed), seq)
+            self._snapshot_costs(new_items, sold)
+            self._price(order, order.items_subtotal())
+            sales_rollup.apply_diff(order, rollup_before)
+        return order
+
+    # ----- النسخة (optimistic concurrency) -----
+    def claim(self, order, expected_version=None):
+        """
+        compare-and-swap على Order.version: UPDATE ... WHERE version = المتوقع.
+        لو حد عدّل الأوردر من ساعة ما اتقرا → StaleOrder بالنسخة الجديدة ومفيش أي كتابة.
+        من غير expected_version بنقارن بالنسخة اللي اتقرت مع الأوردر.
+        لازم يتنادي جوه transaction قبل أي كتابة — والـ UPDATE نفسه بيقفل الصف لحد الـ commit.
+        """
+        if expected_version in (None, ""):
+            expected = order.version
+        else:
+            try:
+                expected = int(expected_version)
+            except (TypeError, ValueError):
+                raise BadVersion(expected_version) from None
+        if not Order.objects.filter(pk=order.pk, version=expected).update(version=F("version") + 1):
+            raise StaleOrder(Order.objects.get(pk=order.pk))
+        if order.version != expected:
+            # النسخة اللي في إيدنا أقدم من اللي الجرسون شافه
+            order.refresh_from_db()
+        else:
+            order.version = expected + 1
+
+    # ----- الدفع / شيل اللي اتقدم -----
+    def pay(self, order, method, expected_version=None):
+        with transaction.atomic():
+            self.claim(order, expected_version)
+            order.payment_method = method
+            order.is_paid = True
+            order.save(update_fields=["payment_method", "is_paid"])
+            # الأوردر المدفوع بيختفي من شاشة المطبخ
+            order.items.update(change_seq=kitchen_feed.next_seq())
+            self.announce(order, "paid")
+        return order
+
+    def clear_done_items(self, order, expected_version=None):
+        """صفحة الجرسون: الأصناف اللي خلصت بتتعلم إنها اتقدمت (served_at) — ما بتتمسحش."""
+        with transaction.atomic():
+            self.claim(order, expected_version)
+            kitchen_feed.serve_items(order.items.all())
+            self.announce(order, "updated")
+        return order
+
+    # ----- تعديل سطور بعينها -----
+    def patch_lines(self, order_id, changes, expected_version=None):
+        """
+        changes: لستة (menuitem_id, quantity, delta) — quantity كمية جديدة، delta زيادة/نقص.
+        بيلمس السطور دي بس ومكونات الأصناف دي بس، والإجمالي بيتحسب بالفرق.
+        expected_version: لو مختلف عن نسخة الأوردر → StaleOrder من غير أي تعديل.
+        بيرجّع (order, {menuitem_id: الكمية الجديدة}).
+        """
+        wanted = {}
+        for menuitem_id, quantity, delta in changes:
+            menuitem_id = int(menuitem_id)
+            if quantity is not None:
+                wanted[menuitem_id] = ("set", int(quantity))
+            else:
+                mode, n = wanted.get(menuitem_id, ("add", 0))
+                wanted[menuitem_id] = (mode, n + int(delta))
+
+        with transaction.atomic():
+            order = Order.objects.get(pk=order_id)
+            self.claim(order, expected_version)
+            if order.is_paid:
+                raise OrderClosed(order)
+
+            lines = self._open_lines(order, wanted)
+            menuitems = self._menuitems({mid for mid in wanted if mid not in lines})
+
+            deltas = []
+            changed = []
+            removed = []
+            new_items = []
+            result = {}
+            money = Decimal("0.00")
+            for mid, (mode, n) in wanted.items():
+                old_qty = sum(line.quantity for line in lines.get(mid, []))
+                new_qty = max(n if mode == "set" else old_qty + n, 0)
+                result[mid] = new_qty
+                if new_qty == old_qty:
+                    continue
+                menuitem = menuitems.get(mid) or lines[mid][0].menuitem
+                diff, line_changes, new_item, line_removed, line_money = self._resize(
+                    order, lines.get(mid, []), new_qty, menuitem
+                )
+                deltas.append((mid, diff))
+                changed.extend(line_changes)
+                removed.extend(line_removed)
+                if new_item:
+                    new_items.append(new_item)
+                money += line_money
+
+            if deltas:
+                rollup_before = sales_rollup.snapshot(order)
+                seq = kitchen_feed.stamp([*changed, *new_items])
+                OrderItem.objects.bulk_update(changed, ["quantity", "change_seq"])
+                OrderItem.objects.bulk_create(new_items)
+                sold = self._apply_stock(order, deltas, {item.menuitem_id: item for item in (*changed, *new_items)})
+                kitchen_feed.remove_items(OrderItem.objects.filter(pk__in=removed), seq)
+                self._snapshot_costs(new_items, sold)
+                self._price(order, order.subtotal + money)
+                sales_rollup.apply_diff(order, rollup_before)
+                self.announce(order, "updated")
+        return order, result
+
+    # ----- تعديل / حذف -----
+    def settle(self, order, deltas, new_items=(), rollup_before=None):
+        """
+        deltas: (menuitem_id, فرق الكمية). السالب يرجع للمخزن والموجب يتخصم.
+        للي بيحفظ صفوف الأصناف بنفسه (زي فورمست التعديل) — لازم يتنادي جوه transaction
+        وبعد claim() اللي قبل حفظ الصفوف.
+        new_items: الأصناف اللي اتضافت (محفوظة بسعرها) عشان تتسجل تكلفتها.
+        rollup_before: sales_rollup.snapshot(order) قبل حفظ الصفوف — عشان ملخص اليوم يتعدل بالفرق.
+        """
+        lines = {item.menuitem_id: item for item in order.items.all()}
+        sold = self._apply_stock(order, deltas, lines)
+        self._snapshot_costs(new_items, sold)
+        self._price(order, order.items_subtotal())
+        if rollup_before is not None:
+            sales_rollup.apply_diff(order, rollup_before)
+        self.announce(order, "updated")
+        return order
+
+    def delete(self, order, expected_version=None):
+        with transaction.atomic():
+            self.claim(order, expected_version)
+            sales_rollup.apply_diff(order, sales_rollup.snapshot(order), after={})
+            stock.restore_lines(order.items.values_list("menuitem_id", "quantity"), order=order)
+            kitchen_feed.remove_items(order.items.all())
+            self.announce(order, "deleted")
+            order.delete()
+
+    # ----- شاشات الـ push -----
+    @staticmethod
+    def announce(order, status):
+        """حدث "order" لشاشات المطبخ والأوردرات — بيتبعت بعد الـ commit بس."""
+        events.publish("order", {
+            "id": order.pk,
+            "status": status,
+            "order_type": order.order_type,
+            "table": order.table_number,
+            "version": order.version,
+        })
+
+    # ----- helpers -----
+    @staticmethod
+    def _open_lines(order, menuitem_ids=None):
+        """
+        {menuitem_id: [سطور]} للسطور اللي لسه ما اتقدمتش بس — المستني الأول وبعده اللي خلص.
+        اللي اتقدم (served_at) اتاكل خلاص: ما بيتعدلش ولا بيرجع مخزن.
+        """
+        rows = order.items.filter(served_at__isnull=True).select_related("menuitem").order_by("is_done", "id")
+        if menuitem_ids is not None:
+            rows = rows.filter(menuitem_id__in=menuitem_ids)
+        lines = {}
+        for line in rows:
+            lines.setdefault(line.menuitem_id, []).append(line)
+        return lines
+
+    @staticmethod
+    def _resize(order, lines, target, menuitem):
+        """
+        يخلي مجموع سطور الصنف (من _open_lines) = target.
+        الزيادة بتروح على سطر لسه مستني أو سطر جديد — عمرها ما بتتضاف على سطر المطبخ خلّصه،
+        وإلا الوحدات الجديدة ما توصلش للمطبخ. النقص بيتشال من المستني الأول.
+        بيرجّع (الفرق، السطور اللي اتغيرت، سطر جديد أو None، السطور اللي اتمسحت، فرق الفلوس).
+        """
+        diff = target - sum(line.quantity for line in lines)
+        changed, removed, new_item, money = [], [], None, Decimal("0.00")
+        if diff > 0:
+            pending = next((line for line in lines if not line.is_done), None)
+            if pending:
+                pending.quantity += diff
+                changed.append(pending)
+                money += pending.unit_price * diff
+            else:
+                new_item = OrderItem(order=order, menuitem=menuitem, quantity=diff, unit_price=menuitem.price)
+                money += menuitem.price * diff
+        elif diff < 0:
+            left = -diff
+            for line in lines:
+                if not left:
+                    break
+                take = min(line.quantity, left)
+                line.quantity -= take
+                left -= take
+                money -= line.unit_price * take
+                if line.quantity:
+                    changed.append(line)
+                else:
+                    removed.append(line.pk)
+        return diff, changed, new_item, removed, money
+
+    def _apply_stock(self, order, deltas, order_items):
+        net = defaultdict(int)
+        for mid, diff in deltas:
+            net[int(mid)] += int(diff)
+        to_restore = [(mid, -diff) for mid, diff in net.items() if diff < 0]
+        to_deduct = [(mid, diff) for mid, diff in net.items() if diff > 0]
+        # الرجوع الأول عشان الكمية اللي رجعت تبقى متاحة للخصم
+        stock.restore_lines(to_restore, order=order)
+        return stock.deduct_lines(to_deduct, order=order, order_items=order_items)
+
+    def _snapshot_costs(self, items, sold):
+        """
+        التكلفة = مكونات الريسيبي × متوسط سعر الشراء للوحدات اللي اتسحبت فعلًا
+        في الخصم ده (حركات البيع بالسالب).
+        """
+        if not items:
+            return
+        spent = defaultdict(Decimal)
+        units = defaultdict(int)
+        for move in sold:
+            spent[move.material_id] += move.purchase_price * -move.quantity
+            units[move.material_id] += -move.quantity
+        recipes = recipe_cache.get_many(item.menuitem_id for item in items)
+
+        for item in items:
+            item.unit_cost = sum(
+                (per_unit * spent[material_id] / units[material_id]
+                 for material_id, per_unit in recipes[item.menuitem_id] if units[material_id]),
+                Decimal("0.00"),
+            ).quantize(Decimal("0.01"))
+        OrderItem.objects.bulk_update(items, ["unit_cost"])
+
+    def _menuitems(self, ids):
+        menuitems = MenuItem.objects.in_bulk(list(ids))
+        unknown = set(ids).difference(menuitems)
+        if unknown:
+            raise UnknownMenuItems(unknown)
+        return menuitems
+
+    def _price(self, order, subtotal):
+        """
+        بيخزن الـ subtotal والضريبة/الخصم، والـ total بيتحسب في Order.save().
+        الـ version بيزيد في claim() قبل الكتابة.
+        """
+        order.subtotal = subtotal
+        if order.order_type == "cafe":
+            order.tax = subtotal * self.CAFE_TAX_RATE
+        elif order.order_type == "qeta3" and order.officer_id:
+            order.discount = subtotal * order.officer.discount_rate
+            order.tax = Decimal("0.00")
+        order.save(update_fields=["subtotal", "tax", "discount"])
@@ -0,0 +1,102 @@
+# order_feed.py
+# فيد صفحة الأوردرات: كل حفظ لأوردر بياخد رقم من عداد واحد (DataVersion "orders")،
+# والصفحة بتسأل "إيه اللي اتضاف أو اتعدل بعد رقم كذا" — ولو مفيش جديد الطلب بيستنى
+# (long-poll) لحد ما حاجة تتغير أو المهلة تخلص بدل ما الصفحة تسأل كل 5 ثواني.
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+
+from . import events
+from .models import DataVersion, Order
+
+BATCH_SIZE = 200
+PAYMENT_LABELS = dict(Order.PAYMENT_CHOICES)
+
+
+def max_wait():
+    """أطول مدة بيستناها الطلب — أقل من timeout البروكسي (ORDERS_LONG_POLL_TIMEOUT، افتراضي 25 ثانية)."""
+    return getattr(settings, "ORDERS_LONG_POLL_TIMEOUT", 25)
+
+
+def recheck_interval():
+    """كل قد إيه نبص على العداد بنفسنا — للتعديلات اللي ما بتعديش على events (أدمن، بروسيس تاني)."""
+    return getattr(settings, "ORDERS_LONG_POLL_RECHECK", 2)
+
+
+def head():
+    return DataVersion.current(Order.CHANGE_SEQ_KEY)
+
+
+def changes_since(cursor, top=None):
+    """
+    {"cursor", "orders", "more", "reset"} — الأوردرات اللي اتحفظت بعد cursor لحد top
+    في استعلام واحد (اسم الكاشير annotation مش select لكل أوردر).
+    """
+    top = head() if top is None else top
+    if top < cursor:
+        # العداد رجع لورا (داتابيز جديدة) → الصفحة تحمّل من الأول
+        return {"cursor": top, "more": False, "orders": [], "reset": True}
+
+    rows = list(
+        Order.objects.filter(change_seq__gt=cursor, change_seq__lte=top)
+        .order_by("change_seq", "id")
+        .annotate(cashier_name=F("cashier__username"))
+        .values(
+            "id", "order_type", "table_number", "cashier_name", "created_at", "is_paid",
+            "payment_method", "subtotal", "discount", "tax", "total", "note", "version", "change_seq",
+        )[:BATCH_SIZE + 1]
+    )
+    more = len(rows) > BATCH_SIZE
+    if more:
+        # ما نقطعش في نص مجموعة ليها نفس الرقم، وإلا الباقي يضيع ورا الـ cursor
+        last = rows[BATCH_SIZE - 1]["change_seq"]
+        rows = [row for row in rows[:BATCH_SIZE] if row["change_seq"] < last] or rows[:BATCH_SIZE]
+
+    return {
+        "cursor": rows[-1]["change_seq"] if more else top,
+        "more": more,
+        "reset": False,
+        "orders": [
+            {
+                "id": row["id"],
+                "order_type": row["order_type"],
+                "table_number": row["table_number"],
+                "cashier": row["cashier_name"] or "",
+                "created_at": row["created_at"].strftime("%Y-%m-%d %H:%M"),
+                "is_paid": row["is_paid"],
+                "payment_method": PAYMENT_LABELS.get(row["payment_method"], "") if row["is_paid"] else "",
+                "subtotal": float(row["subtotal"]),
+                "discount": float(row["discount"]),
+                "tax": float(row["tax"]),
+                "total": float(row["total"]),
+                "note": row["note"] or "",
+                "version": row["version"],
+            }
+            for row in rows
+        ],
+    }
+
+
+async def wait_for_change(cursor, timeout):
+    """
+    يستنى لحد ما العداد يتغير عن cursor أو المهلة تخلص ويرجّع آخر رقم.
+    بيصحى على أحداث events (نفس البروسيس) وبيبص على العداد كل recheck_interval() للباقي.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # الاشتراك قبل أول قراية عشان حدث يجي بينهم ما يضيعش
+    subscriber, _ = events.subscribe()
+    try:
+        while True:
+            top = await sync_to_async(head)()
+            remaining = deadline - loop.time()
+            if top != cursor or remaining <= 0:
+                return top
+            try:
+                await asyncio.wait_for(subscriber.queue.get(), min(recheck_interval(), remaining))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        events.unsubscribe(subscriber)
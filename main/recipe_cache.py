@@ -0,0 +1,78 @@
+# recipe_cache.py
+# كاش في الذاكرة لكل process: MenuItem.id -> ((material_id, qty_per_unit), ...)
+# الريسيبي نادرًا ما بتتغير وقت الشغل، فبدل ما كل أوردر يقرأها من الداتابيز
+# بنقراها مرة واحدة ونمسح الصنف اللي اتغير بس من الـ signals.
+# ختم النسخة في DataVersion بيخلي باقي الـ workers يعرفوا إن فيه تغيير.
+import threading
+
+from .models import DataVersion, Recipe
+
+VERSION_KEY = "recipes"
+
+_lock = threading.Lock()
+_entries = {}
+_version = None
+
+
+def reset():
+    global _entries, _version
+    with _lock:
+        _entries = {}
+        _version = None
+
+
+def _load(menuitem_ids=None):
+    rows = Recipe.objects.values_list("menuitem_id", "material_id", "quantity")
+    if menuitem_ids is not None:
+        rows = rows.filter(menuitem_id__in=menuitem_ids)
+
+    loaded = {mid: [] for mid in menuitem_ids} if menuitem_ids is not None else {}
+    for menuitem_id, material_id, qty in rows.order_by("id"):
+        loaded.setdefault(menuitem_id, []).append((material_id, qty))
+    return {mid: tuple(lines) for mid, lines in loaded.items()}
+
+
+def get_many(menuitem_ids):
+    """
+    يرجّع {menuitem_id: ((material_id, qty_per_unit), ...)}.
+    استعلام واحد صغير لختم النسخة، ومفيش استعلامات ريسيبي طول ما الكاش سليم.
+    """
+    global _entries, _version
+    menuitem_ids = {int(mid) for mid in menuitem_ids}
+    version = DataVersion.current(VERSION_KEY)
+
+    with _lock:
+        if version != _version:
+            # worker تاني غيّر حاجة → نبني الكاش من الأول
+            _entries = _load()
+            _version = version
+        missing = menuitem_ids.difference(_entries)
+        if missing:
+            # صنف جديد أو اتمسح من الكاش → نجيبه هو بس
+            _entries.update(_load(missing))
+        return {mid: _entries.get(mid, ()) for mid in menuitem_ids}
+
+
+def get(menuitem_id):
+    return get_many([menuitem_id])[int(menuitem_id)]
+
+
+def invalidate(menuitem_id=None, material_id=None):
+    """يمسح الأصناف اللي اتأثرت بس ويزوّد ختم النسخة للـ workers التانية."""
+    global _entries, _version
+    new_version = DataVersion.bump(VERSION_KEY)
+
+    with _lock:
+        if _version is None or new_version != _version + 1:
+            # فاتنا تغيير من worker تاني → نسيب الكاش يتبني من الأول
+            _entries = {}
+            _version = None
+            return
+
+        if menuitem_id is not None:
+            _entries.pop(menuitem_id, None)
+        if material_id is not None:
+            for mid in [mid for mid, lines in _entries.items()
+                        if any(m == material_id for m, _ in lines)]:
+                del _entries[mid]
+        _version = new_version
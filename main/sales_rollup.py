@@ -0,0 +1,168 @@
+# sales_rollup.py
+# ملخص المبيعات اليومي (DailySalesRollup): كل تعديل في أصناف أوردر بيتحول لفرق
+# (كمية، إيراد، تكلفة) لكل صنف ويتضاف على صف (اليوم، الصنف) بـ UPDATE ... F()
+# جوه نفس الـ transaction — فالتقفيل بيقرا كام صف متجمعين بدل ما يلف على كل الأصناف.
+# القسم مجرد خانة على الصف بتتسجل أول ما الصف يتعمل: لو الصنف اتنقل لقسم تاني وبعدين
+# أوردر قديم اتعدل، الفرق بيروح على نفس الصف مش على صف جديد بالقسم الجديد.
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+
+from .models import DailySalesRollup, OrderItem
+
+ZERO = Decimal("0.00")
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def day_starts_at():
+    """ساعة بداية يوم الشغل — CAFE_DAY_STARTS_AT (افتراضي 0، يعني اليوم العادي)."""
+    return getattr(settings, "CAFE_DAY_STARTS_AT", 0)
+
+
+def business_day(moment):
+    """الأوردر اللي بعد نص الليل وقبل ساعة البداية بيتحسب على اليوم اللي قبله."""
+    return (timezone.localtime(moment) - timedelta(hours=day_starts_at())).date()
+
+
+def day_bounds(day):
+    """(بداية، نهاية) يوم الشغل كـ datetime — فلتر range بيمشي على index مش __date."""
+    start = timezone.make_aware(datetime.combine(day, time(hour=day_starts_at())))
+    return start, start + timedelta(days=1)
+
+
+def snapshot(order):
+    """{menuitem_id: (section, كمية، إيراد، تكلفة)} لأصناف الأوردر — استعلام واحد مجمّع."""
+    rows = (
+        OrderItem.objects.filter(order_id=order.pk)
+        .values("menuitem_id", "menuitem__section")
+        .annotate(
+            qty=Sum("quantity"),
+            revenue=Sum(F("unit_price") * F("quantity"), output_field=MONEY),
+            cost=Sum(F("unit_cost") * F("quantity"), output_field=MONEY),
+        )
+        .order_by()
+    )
+    return {
+        row["menuitem_id"]: (row["menuitem__section"], row["qty"], row["revenue"], row["cost"])
+        for row in rows
+    }
+
+
+def apply_diff(order, before, after=None):
+    """
+    يضيف الفرق بين before و after (snapshot) على ملخص يوم الأوردر.
+    after=None يعني اقرا الأصناف دلوقتي؛ {} لو الأوردر اتمسح.
+    لازم يتنادي جوه transaction الأوردر.
+    """
+    if after is None:
+        after = snapshot(order)
+    day = business_day(order.created_at)
+
+    diff = defaultdict(lambda: [0, ZERO, ZERO])
+    sections = {}
+    for sign, lines in ((-1, before), (1, after)):
+        for menuitem_id, (section, qty, revenue, cost) in lines.items():
+            sections[menuitem_id] = section
+            row = diff[menuitem_id]
+            row[0] += sign * qty
+            row[1] += sign * revenue
+            row[2] += sign * cost
+
+    diff = {menuitem_id: change for menuitem_id, change in diff.items() if any(change)}
+    if diff:
+        _add(day, diff, sections)
+
+
+def _add(day, diff, sections):
+    """
+    الفرق على صفوف اليوم بعدد ثابت من الاستعلامات مهما كانت الأصناف:
+    قراية الصفوف الموجودة، bulk_update بـ F() (الجمع في SQL)، و bulk_create للجديد.
+    sections بيتستخدم بس للصفوف الجديدة — الموجود بيفضل بقسمه.
+    لو transaction تانية عملت نفس الصف الجديد الأول (أول بيعة للصنف في اليوم من كاشيرين)
+    الـ bulk_create بيقع على الـ unique، فبنرجع للأصناف دي ونزودها بالـ UPDATE.
+    """
+    for _ in range(2):
+        existing = {
+            row.menuitem_id: row
+            for row in DailySalesRollup.objects.select_for_update().filter(day=day, menuitem_id__in=set(diff))
+        }
+        changed = []
+        created = []
+        for menuitem_id, (qty, revenue, cost) in diff.items():
+            row = existing.get(menuitem_id)
+            if row is None:
+                created.append(DailySalesRollup(
+                    day=day, section=sections[menuitem_id], menuitem_id=menuitem_id,
+                    quantity=qty, revenue=revenue, cost=cost,
+                ))
+                continue
+            row.quantity = F("quantity") + qty
+            row.revenue = F("revenue") + revenue
+            row.cost = F("cost") + cost
+            changed.append(row)
+        DailySalesRollup.objects.bulk_update(changed, ["quantity", "revenue", "cost"])
+        try:
+            with transaction.atomic():
+                DailySalesRollup.objects.bulk_create(created)
+            return
+        except IntegrityError:
+            diff = {row.menuitem_id: diff[row.menuitem_id] for row in created}
+    raise IntegrityError(f"DailySalesRollup {day}: صفوف {sorted(diff)} مش راضية تتعمل ولا تتحدث")
+
+
+def rebuild(days=None):
+    """
+    يعيد حساب الملخص من الأصناف نفسها (لأيام معينة أو كله) — بعد تغيير CAFE_DAY_STARTS_AT
+    أو لو حد عدّل أصناف من ورا OrderCommitter.
+    """
+    items = OrderItem.objects.values(
+        "order__created_at", "menuitem__section", "menuitem_id", "quantity", "unit_price", "unit_cost"
+    )
+    existing = DailySalesRollup.objects.all()
+    if days is not None:
+        days = set(days)
+        start = min(day_bounds(day)[0] for day in days)
+        end = max(day_bounds(day)[1] for day in days)
+        items = items.filter(order__created_at__gte=start, order__created_at__lt=end)
+        existing = existing.filter(day__in=days)
+
+    totals = defaultdict(lambda: [0, ZERO, ZERO])
+    sections = {}
+    for row in items.iterator():
+        day = business_day(row["order__created_at"])
+        if days is not None and day not in days:
+            continue
+        sections[row["menuitem_id"]] = row["menuitem__section"]
+        total = totals[(day, row["menuitem_id"])]
+        total[0] += row["quantity"]
+        total[1] += row["unit_price"] * row["quantity"]
+        total[2] += row["unit_cost"] * row["quantity"]
+
+    with transaction.atomic():
+        existing.delete()
+        DailySalesRollup.objects.bulk_create(
+            [
+                DailySalesRollup(
+                    day=day, section=sections[menuitem_id], menuitem_id=menuitem_id,
+                    quantity=qty, revenue=revenue, cost=cost,
+                )
+                for (day, menuitem_id), (qty, revenue, cost) in totals.items()
+            ],
+            batch_size=500,
+        )
+    return len(totals)
+
+
+def day_summary(day):
+    """صفوف اليوم (كام صف لكل صنف) — للتقفيل اليومي."""
+    return (
+        DailySalesRollup.objects.filter(day=day)
+        .exclude(quantity=0, revenue=0)
+        .select_related("menuitem")
+        .order_by("section", "menuitem__name")
+    )
@@ -1,8 +1,9 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import Profile, Recipe, MenuItem, Material, SinastarInventory, ExtraExpense, Order
+from . import closing_jobs, recipe_cache, stock
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
@@ -10,3 +11,42 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
     else:
         instance.profile.save()
+
+
+# ----- كاش الريسيبي -----
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    recipe_cache.invalidate(menuitem_id=instance.menuitem_id)
+
+
+@receiver([post_save, post_delete], sender=MenuItem)
+def invalidate_menuitem(sender, instance, **kwargs):
+    recipe_cache.invalidate(menuitem_id=instance.id)
+
+
+@receiver(post_delete, sender=Material)
+def invalidate_material(sender, instance, **kwargs):
+    # حفظ المكون نفسه مش بيغير (material_id, qty) فمالوش لازمة هنا
+    recipe_cache.invalidate(material_id=instance.id)
+
+
+# ----- ملخص المخزن (MaterialStock) -----
+# الخصم والرجوع بيعدلوا الملخص بنفسهم (UPDATE بـ F)؛ ده للحفظ العادي:
+# إضافة مخزن، تعديل الكمية، الأدمن — وبيشتغل جوه نفس الـ transaction بتاعة الحفظ،
+# والفرق بيتسجل في دفتر الحركة كتعديل يدوي
+@receiver([post_save, post_delete], sender=SinastarInventory)
+def recount_material_stock(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Material) or getattr(origin, "model", None) is Material:
+        # المكون نفسه بيتمسح → الملخص والدفتر بتوعه ماشيين معاه
+        return
+    stock.recount_material_stock([instance.material_id])
+
+
+# ----- ختم معاينة التقفيلة -----
+# الحفظ العادي للأوردر بيزوّد عداده بنفسه، والخصم والرجوع بيكتبوا في الدفتر؛
+# الباقي (مصاريف، مخزن، مسح أوردر) بيزوّد closing_jobs.VERSION_KEY
+@receiver([post_save, post_delete], sender=ExtraExpense)
+@receiver([post_save, post_delete], sender=SinastarInventory)
+@receiver(post_delete, sender=Order)
+def touch_closing_data(sender, **kwargs):
+    closing_jobs.touch()
@@ -0,0 +1,470 @@
+# stock.py
+# محرك خصم المخزن على مستوى الأوردر كله:
+# الريسيبي من الكاش + استعلام واحد للمخازن + كتابة bulk
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Max, OuterRef, PositiveIntegerField, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Material, MaterialStock, SinastarInventory, StockMovement
+from . import recipe_cache
+
+
+# عدد المحاولات لو كاشير تاني سحب من نفس الصفوف في نفس اللحظة
+DEDUCT_RETRIES = 3
+
+
+class InsufficientStock(ValueError):
+    """المخزن لا يكفي — بيشيل لستة بالمكونات الناقصة."""
+
+    def __init__(self, missing):
+        self.missing = list(missing)
+        super().__init__("، ".join(self.missing))
+
+
+class _StockMoved(Exception):
+    """الشرط addition >= n فشل في صف أو أكتر — حد تاني سبقنا."""
+
+
+def merge_lines(lines):
+    """يجمع (menuitem_id, quantity) المتكررة في سطر واحد لكل صنف."""
+    merged = defaultdict(int)
+    for menuitem_id, qty in lines:
+        merged[int(menuitem_id)] += int(qty)
+    return {mid: qty for mid, qty in merged.items() if qty > 0}
+
+
+def _line_requirements(lines):
+    """
+    {material_id: [(menuitem_id, الكمية), ...]} — نصيب كل صنف من كل مكون،
+    عشان كل حركة في الدفتر تتربط بسطر الأوردر بتاعها.
+    """
+    lines = merge_lines(lines)
+    needs = defaultdict(list)
+    for menuitem_id, recipe in recipe_cache.get_many(lines).items():
+        for material_id, per_unit in recipe:
+            needs[material_id].append((menuitem_id, per_unit * lines[menuitem_id]))
+    return needs
+
+
+def material_requirements(lines):
+    """
+    يرجّع {material_id: الكمية المطلوبة} لكل أصناف الأوردر
+    من كاش الريسيبي من غير استعلامات ريسيبي.
+    """
+    return {
+        material_id: sum(qty for _, qty in shares)
+        for material_id, shares in _line_requirements(lines).items()
+    }
+
+
+def _inventories_by_material(material_ids, lock=False):
+    inventories = defaultdict(list)
+    qs = SinastarInventory.objects.filter(material_id__in=material_ids).order_by("id")
+    if lock:
+        # الترتيب بالـ id بيخلي كل الكاشيرات يقفلوا الصفوف بنفس الترتيب (مفيش deadlock)
+        qs = qs.select_for_update()
+    for inv in qs:
+        inventories[inv.material_id].append(inv)
+    return inventories
+
+
+def _totals(inventories):
+    return {material_id: sum(inv.addition for inv in rows) for material_id, rows in inventories.items()}
+
+
+def find_shortages(required, available):
+    """available: {material_id: المتاح} — المكون اللي مش فيها مش موجود في أي مخزن."""
+    short = {}
+    for material_id, required_qty in required.items():
+        total_addition = available.get(material_id, 0)
+        if total_addition < required_qty:
+            short[material_id] = (required_qty, total_addition, material_id in available)
+    if not short:
+        return []
+
+    # الأسامي بنحتاجها بس في حالة النقص
+    names = dict(Material.objects.filter(id__in=short).values_list("id", "name"))
+    missing = []
+    for material_id, (required_qty, total_addition, stocked) in short.items():
+        name = names.get(material_id, material_id)
+        if not stocked:
+            missing.append(f"{name} مش موجود في أي مخزن")
+        else:
+            missing.append(f"{name} (مطلوب {required_qty}، متاح {total_addition})")
+    return missing
+
+
+def check_lines(lines):
+    """يرجّع لستة المكونات الناقصة من غير أي خصم."""
+    required = material_requirements(lines)
+    if not required:
+        return []
+    return find_shortages(required, available_by_material(required))
+
+
+def _conditional_decrement(plan, stamp):
+    """
+    UPDATE واحد: addition = addition - n WHERE addition >= n لكل صف.
+    لو عدد الصفوف اللي اتعدلت أقل من المطلوب يبقى فيه سباق → _StockMoved.
+    """
+    ids = sorted(plan)
+    condition = Q()
+    for inv_id in ids:
+        condition |= Q(pk=inv_id, addition__gte=plan[inv_id])
+    updated = SinastarInventory.objects.filter(condition).update(
+        addition=Case(
+            *[When(pk=inv_id, then=F("addition") - plan[inv_id]) for inv_id in ids],
+            default=F("addition"),
+            output_field=PositiveIntegerField(),
+        ),
+        updated_at=stamp,
+    )
+    if updated != len(ids):
+        raise _StockMoved
+
+
+@transaction.atomic
+def _deduct_once(needs, required, order, order_items):
+    inventories = _inventories_by_material(required, lock=True)
+    missing = find_shortages(required, _totals(inventories))
+    if missing:
+        raise InsufficientStock(missing)
+
+    stamp = timezone.now()
+    left = {inv.id: inv.addition for rows in inventories.values() for inv in rows}
+    plan = defaultdict(int)
+    moved = defaultdict(int)
+    movements = []
+    for material_id, shares in needs.items():
+        for menuitem_id, remaining in shares:
+            for inv in inventories[material_id]:
+                if remaining <= 0:
+                    break
+                deducted = min(left[inv.id], remaining)
+                if deducted <= 0:
+                    continue
+                remaining -= deducted
+                left[inv.id] -= deducted
+                plan[inv.id] += deducted
+                moved[(material_id, inv.type)] -= deducted
+                movements.append(StockMovement(
+                    material_id=material_id,
+                    inventory_id=inv.id,
+                    type=inv.type,
+                    kind="sale",
+                    quantity=-deducted,
+                    addition_cost=inv.addition_cost,
+                    purchase_price=inv.purchase_price,
+                    order=order,
+                    order_item=order_items.get(menuitem_id),
+                    created_at=stamp,
+                ))
+
+    _conditional_decrement(plan, stamp)
+    shift_material_stock(moved, stamp)
+    return StockMovement.objects.bulk_create(movements)
+
+
+def deduct_lines(lines, order=None, order_items=None):
+    """
+    يخصم مكونات كل أصناف الأوردر مرة واحدة ويسجل حركة بيع لكل (سطر، مخزن).
+    order_items: {menuitem_id: OrderItem} محفوظين، عشان الحركة تتربط بسطرها.
+    عدد الاستعلامات ثابت مهما كان حجم الأوردر:
+    ختم الريسيبي + مخازن + UPDATE شرطي واحد + الملخص + bulk_create للدفتر.
+    الخصم نفسه بيحصل جوه الداتابيز (F) فمفيش كتابة بتمسح كتابة كاشير تاني؛
+    لو الشرط فشل بنعيد القراية والمحاولة، ولو المخزن فعلًا خلص بيرمي InsufficientStock.
+    """
+    needs = _line_requirements(lines)
+    required = {material_id: sum(qty for _, qty in shares) for material_id, shares in needs.items()}
+    if not required:
+        return []
+
+    for _ in range(DEDUCT_RETRIES):
+        try:
+            return _deduct_once(needs, required, order, order_items or {})
+        except _StockMoved:
+            continue
+
+    # لسه بيتسابق بعد كل المحاولات: نرفض بأرقام حديثة
+    missing = find_shortages(required, available_by_material(required))
+    raise InsufficientStock(missing or ["المخزن اتغير أثناء الطلب، حاول تاني"])
+
+
+def _open_sales(order, material_ids):
+    """حركات البيع بتاعة الأوردر اللي لسه ما رجعتش كلها — الأحدث الأول."""
+    reversed_qty = (
+        StockMovement.objects.filter(reverses=OuterRef("pk"))
+        .values("reverses").annotate(s=Sum("quantity")).values("s")
+    )
+    return (
+        StockMovement.objects.filter(order=order, kind="sale", material_id__in=material_ids)
+        .exclude(inventory=None)
+        .annotate(reversed_qty=Coalesce(Subquery(reversed_qty), Value(0)))
+        .order_by("-id")
+    )
+
+
+def restore_lines(lines, order=None):
+    """
+    يرجّع مكونات الأصناف اللي اتشالت أو قلت للمخزن.
+    كل رجوع قيد جديد في الدفتر عكس حركة بيع الأوردر نفسه ولنفس المخزن اللي اتسحب منه —
+    من غير ما نلمس أي حركة قديمة ولا نلف على تاريخ المبيعات كله.
+    الباقي (أوردر قديم قبل الدفتر مثلًا) بيرجع لأول مخزن فيه المكون.
+    """
+    remaining = material_requirements(lines)
+    if not remaining:
+        return []
+
+    stamp = timezone.now()
+    movements = []
+    if order is not None:
+        for sale in _open_sales(order, list(remaining)):
+            back = min(-sale.quantity - sale.reversed_qty, remaining[sale.material_id])
+            if back <= 0:
+                continue
+            remaining[sale.material_id] -= back
+            movements.append(StockMovement(
+                material_id=sale.material_id,
+                inventory_id=sale.inventory_id,
+                type=sale.type,
+                kind="restore",
+                quantity=back,
+                addition_cost=sale.addition_cost,
+                purchase_price=sale.purchase_price,
+                order=order,
+                order_item_id=sale.order_item_id,
+                reverses=sale,
+                created_at=stamp,
+            ))
+
+    leftover = {material_id: qty for material_id, qty in remaining.items() if qty > 0}
+    if leftover:
+        first_rows = {}
+        for inv in SinastarInventory.objects.filter(material_id__in=leftover).order_by("id").only(
+            "id", "material_id", "type", "addition_cost", "purchase_price"
+        ):
+            first_rows.setdefault(inv.material_id, inv)
+        for material_id, inv in first_rows.items():
+            movements.append(StockMovement(
+                material_id=material_id,
+                inventory_id=inv.id,
+                type=inv.type,
+                kind="restore",
+                quantity=leftover[material_id],
+                addition_cost=inv.addition_cost,
+                purchase_price=inv.purchase_price,
+                order=order,
+                created_at=stamp,
+            ))
+    if not movements:
+        return []
+
+    # UPDATE واحد بـ F لكل المخازن اللي راجع لها حاجة
+    per_row = defaultdict(int)
+    moved = defaultdict(int)
+    for move in movements:
+        per_row[move.inventory_id] += move.quantity
+        moved[(move.material_id, move.type)] += move.quantity
+    SinastarInventory.objects.filter(pk__in=list(per_row)).update(
+        addition=Case(
+            *[When(pk=inv_id, then=F("addition") + qty) for inv_id, qty in per_row.items()],
+            default=F("addition"),
+            output_field=PositiveIntegerField(),
+        ),
+        updated_at=stamp,
+    )
+    shift_material_stock(moved, stamp)
+    return StockMovement.objects.bulk_create(movements)
+
+
+# ----- MaterialStock: ملخص المتاح لكل مكون -----
+def available_by_material(material_ids):
+    """{material_id: المتاح في كل المخازن} — قراية بالـ primary key من MaterialStock."""
+    return dict(
+        MaterialStock.objects.filter(pk__in=list(material_ids)).values_list("material_id", "total")
+    )
+
+
+def shift_material_stock(moved, stamp=None):
+    """
+    moved: {(material_id, type): الفرق}. UPDATE واحد بـ F زي الخصم نفسه،
+    فكاشيرين بيخصموا من نفس المكون ما يمسحوش كتابة بعض.
+    """
+    moved = {key: diff for key, diff in moved.items() if diff}
+    if not moved:
+        return
+    per_material = defaultdict(int)
+    per_field = defaultdict(dict)
+    for (material_id, inv_type), diff in moved.items():
+        per_material[material_id] += diff
+        field = MaterialStock.TYPE_FIELDS[inv_type]
+        per_field[field][material_id] = per_field[field].get(material_id, 0) + diff
+
+    changes = {"total": per_material, **per_field}
+    MaterialStock.objects.filter(pk__in=sorted(per_material)).update(
+        **{
+            field: Case(
+                *[When(pk=material_id, then=F(field) + diff) for material_id, diff in diffs.items()],
+                default=F(field),
+            )
+            for field, diffs in changes.items()
+        },
+        updated_at=stamp or timezone.now(),
+    )
+
+
+def count_material_stock(material_ids=None):
+    """الأرقام الصح من SinastarInventory مباشرة: {material_id: {field: n}}."""
+    rows = SinastarInventory.objects.all()
+    if material_ids is not None:
+        rows = rows.filter(material_id__in=material_ids)
+    counted = {}
+    for material_id, inv_type, total in (
+        rows.values("material_id", "type").annotate(total=Sum("addition"))
+        .values_list("material_id", "type", "total")
+    ):
+        fields = counted.setdefault(
+            material_id, dict.fromkeys(["total", *MaterialStock.TYPE_FIELDS.values()], 0)
+        )
+        fields[MaterialStock.TYPE_FIELDS[inv_type]] += total
+        fields["total"] += total
+    return counted
+
+
+def recount_material_stock(material_ids=None, record=True):
+    """
+    يعيد حساب الملخص من الصفر للمكونات دي (أو كلها) — للتعديلات اليدوية والـ reconcile.
+    بيقفل صفوف الملخص الأول عشان أي خصم F() شغال يتطبق فوق الرقم الجديد مش قبله.
+    record: الفرق عن الملخص القديم بيتسجل في الدفتر كتعديل يدوي.
+    """
+    fields = ["total", *MaterialStock.TYPE_FIELDS.values()]
+    locked = MaterialStock.objects.select_for_update()
+    if material_ids is not None:
+        material_ids = list(material_ids)
+        locked = locked.filter(pk__in=material_ids)
+    existing = {row["material_id"]: row for row in locked.values("material_id", *fields)}
+
+    counted = count_material_stock(material_ids)
+    MaterialStock.objects.bulk_create(
+        [MaterialStock(material_id=material_id, **values) for material_id, values in counted.items()],
+        update_conflicts=True,
+        unique_fields=["material"],
+        update_fields=[*fields, "updated_at"],
+    )
+    # مكون ملوش ولا صف في أي مخزن → ملوش ملخص (عشان يبان "مش موجود في أي مخزن")
+    gone = set(existing).difference(counted)
+    if gone:
+        MaterialStock.objects.filter(pk__in=gone).delete()
+
+    if record:
+        stamp = timezone.now()
+        adjustments = []
+        for material_id in set(existing) | set(counted):
+            before = existing.get(material_id, {})
+            after = counted.get(material_id, {})
+            for inv_type, field in MaterialStock.TYPE_FIELDS.items():
+                diff = after.get(field, 0) - before.get(field, 0)
+                if diff:
+                    adjustments.append(StockMovement(
+                        material_id=material_id, type=inv_type, kind="adjustment",
+                        quantity=diff, created_at=stamp,
+                    ))
+        StockMovement.objects.bulk_create(adjustments)
+
+
+def cart_availability(lines):
+    """
+    تشيك السلة كلها مرة واحدة: الاحتياج المجمّع لكل مكون، النقص لو فيه،
+    وأقصى كمية ممكنة لكل سطر مع باقي السلة زي ما هي.
+    lines: (menuitem_id, quantity) — الكمية صفر مسموحة عشان نعرف الحد قبل الإضافة.
+    """
+    quantities = defaultdict(int)
+    for menuitem_id, qty in lines:
+        quantities[int(menuitem_id)] += max(int(qty), 0)
+    recipes = recipe_cache.get_many(quantities)
+
+    required = defaultdict(int)
+    for menuitem_id, qty in quantities.items():
+        for material_id, per_unit in recipes[menuitem_id]:
+            required[material_id] += per_unit * qty
+    available = available_by_material(required)
+
+    shortages = []
+    short_ids = [m for m, qty in required.items() if available.get(m, 0) < qty]
+    if short_ids:
+        names = dict(Material.objects.filter(id__in=short_ids).values_list("id", "name"))
+        for material_id in short_ids:
+            have = available.get(material_id, 0)
+            shortages.append({
+                "material_id": material_id,
+                "name": names.get(material_id, str(material_id)),
+                "required": required[material_id],
+                "available": have,
+                "missing": required[material_id] - have,
+            })
+
+    result_lines = []
+    for menuitem_id, qty in quantities.items():
+        # كام وحدة كمان ينفع تتضاف من الصنف ده من غير ما باقي السلة يقع
+        headroom = [
+            (available.get(material_id, 0) - required[material_id]) // per_unit
+            for material_id, per_unit in recipes[menuitem_id] if per_unit
+        ]
+        can_add = max(min(headroom), 0) if headroom else None
+        result_lines.append({
+            "menuitem_id": menuitem_id,
+            "quantity": qty,
+            "can_add": can_add,
+            "max_quantity": None if can_add is None else qty + can_add,
+        })
+
+    return {"ok": not shortages, "shortages": shortages, "lines": result_lines}
+
+
+# ----- الدفتر: الرصيد = آخر تقفيلة + الحركات بعدها -----
+def snapshot_closing(stamp=None):
+    """صف تقفيلة لكل مكون برصيده دلوقتي — نقطة البداية لحساب الرصيد من الدفتر."""
+    stamp = stamp or timezone.now()
+    return StockMovement.objects.bulk_create([
+        StockMovement(material_id=material_id, kind="closing", balance=total, created_at=stamp)
+        for material_id, total in MaterialStock.objects.values_list("material_id", "total")
+    ])
+
+
+def sold_totals(movements):
+    """إجماليات المباع من حركات بيع/رجوع في استعلام واحد (البيع موجب والرجوع سالب)."""
+    money = DecimalField(max_digits=14, decimal_places=2)
+    totals = movements.aggregate(
+        units=Sum("quantity"),
+        sale=Sum(F("quantity") * F("addition_cost"), output_field=money),
+        purchase=Sum(F("quantity") * F("purchase_price"), output_field=money),
+    )
+    return {key: -(value or 0) for key, value in totals.items()}
+
+
+def ledger_levels(material_ids=None):
+    """{material_id: الرصيد} من الدفتر بس: رصيد آخر تقفيلة + مجموع الحركات اللي بعدها."""
+    closings = StockMovement.objects.filter(kind="closing")
+    moves = StockMovement.objects.exclude(kind="closing")
+    if material_ids is not None:
+        material_ids = list(material_ids)
+        closings = closings.filter(material_id__in=material_ids)
+        moves = moves.filter(material_id__in=material_ids)
+
+    last_ids = closings.values("material_id").annotate(last=Max("id")).values("last")
+    levels = dict(StockMovement.objects.filter(pk__in=last_ids).values_list("material_id", "balance"))
+    last_closing = (
+        StockMovement.objects.filter(kind="closing", material_id=OuterRef("material_id"))
+        .order_by("-id").values("id")[:1]
+    )
+    after = (
+        moves.annotate(since=Coalesce(Subquery(last_closing), Value(0)))
+        .filter(id__gt=F("since"))
+        .values("material_id").annotate(s=Sum("quantity")).values_list("material_id", "s")
+    )
+    for material_id, total in after:
+        levels[material_id] = (levels.get(material_id) or 0) + total
+    return levels
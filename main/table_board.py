@@ -0,0 +1,64 @@
+# table_board.py
+# لوحة ترابيزات الكافيه: كل الأوردرات المفتوحة بأصنافها وإجمالياتها في استعلامين
+# (الأوردرات + prefetch للأصناف) بدل استعلام لكل ترابيزة.
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+
+
+def table_count():
+    """عدد الترابيزات — CAFE_TABLE_COUNT في الـ settings (افتراضي 20)."""
+    return getattr(settings, "CAFE_TABLE_COUNT", 20)
+
+
+def indoor_tables():
+    """الترابيزات من 1 لحد الرقم ده جوه، والباقي شماسي على البحر."""
+    return getattr(settings, "CAFE_INDOOR_TABLES", 10)
+
+
+def open_orders():
+    """أوردرات الكافيه المفتوحة — بيمشي على index (order_type, is_paid, table_number)."""
+    return (
+        Order.objects.filter(order_type="cafe", is_paid=False, table_number__isnull=False)
+        .order_by("table_number", "id")
+        .prefetch_related(
+            Prefetch("items", queryset=OrderItem.objects.select_related("menuitem").order_by("id"))
+        )
+    )
+
+
+def board():
+    """لستة {"number", "umbrella", "order"} لكل ترابيزة — order بـ None لو فاضية."""
+    by_table = {}
+    for order in open_orders():
+        # لو فيه أكتر من أوردر مفتوح على نفس الترابيزة ناخد الأقدم زي get_order
+        by_table.setdefault(order.table_number, order)
+
+    indoor = indoor_tables()
+    return [
+        {"number": number, "umbrella": number > indoor, "order": by_table.get(number)}
+        for number in range(1, table_count() + 1)
+    ]
+
+
+def board_json():
+    """نسخة صغيرة للتابلت: الترابيزات المشغولة بس بأصنافها، والفاضي رقمه بس."""
+    occupied = []
+    free = []
+    for table in board():
+        order = table["order"]
+        if order is None:
+            free.append(table["number"])
+            continue
+        occupied.append({
+            "table": table["number"],
+            "order_id": order.id,
+            "version": order.version,
+            "total": str(order.total),
+            "items": [
+                {"id": oi.menuitem_id, "name": oi.menuitem.name, "qty": oi.quantity, "done": oi.is_done}
+                for oi in order.items.all()
+            ],
+        })
+    return {"tables": table_count(), "occupied": occupied, "free": free}
@@ -1,3 +1,1224 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Material, MenuItem, Order, OrderItem, Recipe, SinastarInventory, StockMovement
+
+
+class StockFixtureMixin:
+    """مكونات وأصناف بسيطة لتجارب الخصم."""
+
+    def make_menu(self, count, stock_per_material=1000):
+        items = []
+        for i in range(count):
+            material = Material.objects.create(name=f"mat-{i}", quantity=0)
+            SinastarInventory.objects.create(material=material, type="Baresta", addition=stock_per_material // 2)
+            SinastarInventory.objects.create(material=material, type="Canteen", addition=stock_per_material // 2)
+            item = MenuItem.objects.create(name=f"item-{i}", price=10, section="barista")
+            Recipe.objects.create(menuitem=item, material=material, quantity=2)
+            items.append(item)
+        return items
+
+    def login(self):
+        self.user = User.objects.create_user("cashier", password="pw")
+        self.client.force_login(self.user)
+
+    def post_json(self, url, payload, **extra):
+        return self.client.post(url, json.dumps(payload), content_type="application/json", **extra)
+
+
+class TakeawayDeductionTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+
+    def _order(self, items):
+        payload = {"items": [{"menuitem_id": it.id, "quantity": 3} for it in items]}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_json(reverse("create_takeaway_order"), payload)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def test_deducts_across_inventory_rows(self):
+        item = self.make_menu(1, stock_per_material=10)[0]
+        self.post_json(reverse("create_takeaway_order"), {"items": [{"menuitem_id": item.id, "quantity": 4}]})
+        self.assertEqual(
+            sum(SinastarInventory.objects.values_list("addition", flat=True)), 2
+        )
+        self.assertEqual(sum(StockMovement.objects.filter(kind="sale").values_list("quantity", flat=True)), -8)
+
+    def test_shortage_rejects_without_writing(self):
+        item = self.make_menu(1, stock_per_material=4)[0]
+        response = self.post_json(
+            reverse("create_takeaway_order"), {"items": [{"menuitem_id": item.id, "quantity": 3}]}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(sum(SinastarInventory.objects.values_list("addition", flat=True)), 4)
+
+    def test_query_count_does_not_grow_with_cart(self):
+        items = self.make_menu(10)
+        self._order(items)  # تسخين كاش الريسيبي
+        small = self._order(items[:2])
+        large = self._order(items)
+        self.assertEqual(small, large)
+
+
+class RecipeCacheTests(StockFixtureMixin, TestCase):
+    def test_lookup_needs_no_recipe_queries_once_warm(self):
+        from . import recipe_cache
+
+        item = self.make_menu(1)[0]
+        recipe_cache.get(item.id)
+        with CaptureQueriesContext(connection) as ctx:
+            recipe_cache.get(item.id)
+        self.assertFalse(any("main_recipe" in q["sql"] for q in ctx.captured_queries))
+
+    def test_recipe_change_is_picked_up(self):
+        from . import recipe_cache
+
+        item = self.make_menu(1)[0]
+        recipe = item.recipes.get()
+        self.assertEqual(recipe_cache.get(item.id), ((recipe.material_id, 2),))
+        recipe.quantity = 5
+        recipe.save()
+        self.assertEqual(recipe_cache.get(item.id), ((recipe.material_id, 5),))
+        recipe.delete()
+        self.assertEqual(recipe_cache.get(item.id), ())
+
+
+class ConcurrentTakeawayTests(StockFixtureMixin, TransactionTestCase):
+    THREADS = 8
+    ORDERS_PER_THREAD = 6
+
+    def test_parallel_cashiers_never_oversell(self):
+        user = User.objects.create_user("cashier", password="pw")
+        item = self.make_menu(1, stock_per_material=80)[0]  # 80 وحدة، كل صنف بياخد 2
+        url = reverse("create_takeaway_order")
+        payload = json.dumps({"items": [{"menuitem_id": item.id, "quantity": 1}]})
+        statuses = []
+        start = threading.Barrier(self.THREADS, timeout=10)
+
+        def cashier():
+            client = Client()
+            client.force_login(user)
+            start.wait()
+            try:
+                for _ in range(self.ORDERS_PER_THREAD):
+                    response = client.post(url, payload, content_type="application/json")
+                    statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=cashier) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        sold = statuses.count(200)
+        self.assertEqual(sold, 40)  # 48 طلب على مخزن يكفي 40 بس
+        self.assertEqual(statuses.count(400), 8)
+        self.assertEqual(Order.objects.count(), sold)
+        self.assertEqual(sum(SinastarInventory.objects.values_list("addition", flat=True)), 0)
+        self.assertEqual(sum(StockMovement.objects.filter(kind="sale").values_list("quantity", flat=True)), -80)
+
+
+class ConditionalDecrementTests(StockFixtureMixin, TestCase):
+    def test_stale_read_is_retried_not_overwritten(self):
+        from . import stock
+
+        item = self.make_menu(1, stock_per_material=10)[0]
+        real_read = stock._inventories_by_material
+        calls = []
+
+        def stale_then_real(material_ids, lock=False):
+            inventories = real_read(material_ids, lock=lock)
+            if not calls:
+                # قراية قديمة: كأن كاشير تاني لسه ما خصمش
+                for rows in inventories.values():
+                    for inv in rows:
+                        inv.addition += 100
+            calls.append(1)
+            return inventories
+
+        SinastarInventory.objects.update(addition=3)  # 6 وحدات فعليًا
+        with mock.patch.object(stock, "_inventories_by_material", stale_then_real):
+            stock.deduct_lines([(item.id, 2)])
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sum(SinastarInventory.objects.values_list("addition", flat=True)), 2)
+
+
+class OrderCommitterTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+
+    def stock_left(self):
+        return sum(SinastarInventory.objects.values_list("addition", flat=True))
+
+    def test_cafe_table_edit_restores_and_deducts_difference(self):
+        tea, coffee = self.make_menu(2, stock_per_material=100)
+        order = self.committer.set_table_items(5, [(tea.id, 3), (coffee.id, 1)])
+        self.assertEqual(self.stock_left(), 200 - 8)
+
+        same = self.committer.set_table_items(5, [(tea.id, 1)])
+        self.assertEqual(same.pk, order.pk)
+        self.assertEqual(list(order.items.values_list("menuitem_id", "quantity")), [(tea.id, 1)])
+        self.assertEqual(self.stock_left(), 200 - 2)
+        same.refresh_from_db()
+        self.assertEqual(same.subtotal, 10)
+        self.assertEqual(same.tax, Decimal("1.40"))
+        self.assertEqual(same.total, Decimal("11.40"))
+
+    def test_delete_returns_everything(self):
+        tea = self.make_menu(1, stock_per_material=100)[0]
+        order = self.committer.create("takeaway", [(tea.id, 4)])
+        self.committer.delete(order)
+        self.assertEqual(self.stock_left(), 100)
+        # البيع فاضل زي ما هو وقصاده قيد عكسي
+        sale = StockMovement.objects.get(kind="sale")
+        self.assertEqual(sale.quantity, -8)
+        self.assertEqual([r.quantity for r in sale.reversals.all()], [8])
+
+    def test_line_keeps_price_and_cost_from_commit_time(self):
+        tea = self.make_menu(1, stock_per_material=100)[0]
+        SinastarInventory.objects.update(purchase_price=Decimal("1.50"))
+        order = self.committer.create("takeaway", [(tea.id, 2)])
+
+        MenuItem.objects.filter(pk=tea.pk).update(price=99)
+        line = order.items.get()
+        self.assertEqual(line.unit_price, 10)
+        self.assertEqual(line.unit_cost, Decimal("3.00"))  # 2 وحدة × 1.50
+        self.assertEqual(order.items_subtotal(), 20)
+
+
+class IdempotencyKeyTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+        self.item = self.make_menu(1, stock_per_material=100)[0]
+        self.payload = {"items": [{"menuitem_id": self.item.id, "quantity": 2}]}
+
+    def test_replay_returns_stored_order_without_second_deduction(self):
+        url = reverse("create_takeaway_order")
+        first = self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="abc")
+        with self.assertNumQueries(3):  # session + user + استعلام المفتاح بس
+            replay = self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="abc")
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(sum(SinastarInventory.objects.values_list("addition", flat=True)), 96)
+
+    def test_key_is_scoped_to_user_and_endpoint(self):
+        url = reverse("create_takeaway_order")
+        first = self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="shared")
+        other = self.post_json(reverse("create_qeta3_order"), self.payload, HTTP_IDEMPOTENCY_KEY="shared")
+        self.assertEqual(other.status_code, 422)
+
+        self.client.force_login(User.objects.create_user("cashier2", password="pw"))
+        second = self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="shared")
+        self.assertNotIn("Idempotent-Replayed", second)
+        self.assertNotEqual(second.json()["order_id"], first.json()["order_id"])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failed_request_does_not_burn_the_key(self):
+        url = reverse("create_takeaway_order")
+        SinastarInventory.objects.update(addition=0)
+        self.assertEqual(self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="k").status_code, 400)
+        SinastarInventory.objects.update(addition=50)
+        self.assertEqual(self.post_json(url, self.payload, HTTP_IDEMPOTENCY_KEY="k").status_code, 200)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class CheckCartTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+
+    def test_reports_shared_shortage_and_line_limits(self):
+        tea = self.make_menu(1, stock_per_material=10)[0]
+        latte = MenuItem.objects.create(name="latte", price=20, section="barista")
+        Recipe.objects.create(menuitem=latte, material=tea.recipes.get().material, quantity=3)
+
+        # كل صنف لوحده يكفي، لكن مع بعض 2×2 + 3×2 = 10 بالظبط
+        data = self.post_json(reverse("check_cart"), {"items": [
+            {"menuitem_id": tea.id, "quantity": 2}, {"menuitem_id": latte.id, "quantity": 2},
+        ]}).json()
+        self.assertTrue(data["ok"])
+        limits = {line["menuitem_id"]: line["max_quantity"] for line in data["lines"]}
+        self.assertEqual(limits, {tea.id: 2, latte.id: 2})
+
+        data = self.post_json(reverse("check_cart"), {"items": [
+            {"menuitem_id": tea.id, "quantity": 3}, {"menuitem_id": latte.id, "quantity": 2},
+        ]}).json()
+        self.assertFalse(data["ok"])
+        self.assertEqual(data["shortages"][0]["missing"], 2)
+
+    def test_items_already_on_the_order_are_not_counted_twice(self):
+        from .order_commit import OrderCommitter
+
+        tea = self.make_menu(1, stock_per_material=10)[0]
+        order = OrderCommitter(self.user).set_table_items(3, [(tea.id, 4)])  # باقي 2
+        data = self.post_json(reverse("check_cart"), {
+            "items": [{"menuitem_id": tea.id, "quantity": 5}], "order_id": order.id,
+        }).json()
+        self.assertTrue(data["ok"])
+        self.assertEqual(data["lines"][0]["max_quantity"], 5)
+
+
+class MaterialStockTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+        self.item = self.make_menu(1, stock_per_material=10)[0]
+        self.material = self.item.recipes.get().material
+
+    def summary(self):
+        from .models import MaterialStock
+
+        return MaterialStock.objects.get(pk=self.material.pk)
+
+    def test_follows_deduction_restore_and_manual_edit(self):
+        from .order_commit import OrderCommitter
+
+        self.assertEqual((self.summary().total, self.summary().baresta), (10, 5))
+        order = OrderCommitter(self.user).create("takeaway", [(self.item.id, 4)])  # 8 وحدات
+        self.assertEqual((self.summary().total, self.summary().baresta, self.summary().canteen), (2, 0, 2))
+
+        OrderCommitter(self.user).delete(order)
+        self.assertEqual(self.summary().total, 10)
+
+        inv = SinastarInventory.objects.filter(material=self.material).first()
+        self.post_json(reverse("update_addition", args=[inv.id, "increase"]), {"amount": 7})
+        self.assertEqual(self.summary().total, 17)
+
+    def test_reconcile_detects_and_fixes_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        SinastarInventory.objects.update(addition=1)  # من غير signals → الملخص قديم
+        out = StringIO()
+        call_command("reconcile_material_stock", stdout=out)
+        self.assertIn("total 10 ≠ 2", out.getvalue())
+
+        call_command("reconcile_material_stock", "--fix", stdout=StringIO())
+        self.assertEqual(self.summary().total, 2)
+
+
+class StockLedgerTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea = self.make_menu(1, stock_per_material=10)[0]
+        self.material = self.tea.recipes.get().material
+
+    def level(self):
+        from . import stock
+
+        return stock.ledger_levels([self.material.id]).get(self.material.id)
+
+    def test_sales_link_to_order_lines_and_restore_reverses_them(self):
+        order = self.committer.set_table_items(1, [(self.tea.id, 4)])  # 8 وحدات من صفين
+        line = order.items.get()
+        sales = StockMovement.objects.filter(kind="sale")
+        self.assertEqual(sorted(sales.values_list("quantity", flat=True)), [-5, -3])
+        self.assertEqual(set(sales.values_list("order_item", flat=True)), {line.pk})
+
+        self.committer.set_table_items(1, [(self.tea.id, 2)])
+        # الرجوع قيود عكسية من الأحدث للأقدم ولنفس المخزن، والبيع نفسه ما اتلمسش
+        restores = StockMovement.objects.filter(kind="restore").select_related("reverses").order_by("id")
+        self.assertEqual([(r.quantity, r.reverses.quantity) for r in restores], [(3, -3), (1, -5)])
+        self.assertTrue(all(r.inventory_id == r.reverses.inventory_id for r in restores))
+        self.assertEqual(sorted(sales.values_list("quantity", flat=True)), [-5, -3])
+
+    def test_level_is_last_closing_plus_later_movements(self):
+        from . import stock
+
+        self.assertEqual(self.level(), 10)  # تعديلات الإضافة من الـ signal
+        stock.snapshot_closing()
+        self.committer.create("takeaway", [(self.tea.id, 3)])
+        inv = SinastarInventory.objects.filter(material=self.material).first()
+        self.post_json(reverse("update_addition", args=[inv.id, "increase"]), {"amount": 5})
+        self.assertEqual(self.level(), 10 - 6 + 5)
+        self.assertEqual(StockMovement.objects.filter(kind="adjustment").last().quantity, 5)
+
+
+class TableBoardTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        tea, coffee = self.make_menu(2)
+        committer = OrderCommitter(self.user)
+        for table in (2, 5, 9):
+            committer.set_table_items(table, [(tea.id, 1), (coffee.id, 2)])
+
+    def test_board_costs_two_queries_whatever_the_table_count(self):
+        from . import table_board
+
+        with self.assertNumQueries(2):
+            tables = table_board.board()
+            self.assertEqual([t["number"] for t in tables if t["order"]], [2, 5, 9])
+            self.assertEqual(sum(len(t["order"].items.all()) for t in tables if t["order"]), 6)
+
+    @override_settings(CAFE_TABLE_COUNT=6)
+    def test_json_board_uses_configured_table_count(self):
+        data = self.client.get(reverse("table_board")).json()
+        self.assertEqual(data["tables"], 6)
+        self.assertEqual(data["free"], [1, 3, 4, 6])
+        self.assertEqual([t["table"] for t in data["occupied"]], [2, 5])
+        self.assertEqual(data["occupied"][0]["total"], "34.20")
+
+
+class PatchOrderLinesTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.items = self.make_menu(3, stock_per_material=100)
+        tea, coffee, _ = self.items
+        self.order = OrderCommitter(self.user).set_table_items(4, [(tea.id, 2), (coffee.id, 1)])
+        self.url = reverse("patch_order_lines", args=[self.order.id])
+
+    def test_touches_only_the_changed_lines(self):
+        tea, coffee, juice = self.items
+        response = self.post_json(self.url, {"version": self.order.version, "lines": [
+            {"menuitem_id": tea.id, "delta": 1},
+            {"menuitem_id": coffee.id, "quantity": 0},
+            {"menuitem_id": juice.id, "quantity": 2},
+        ]})
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data["version"], self.order.version + 1)
+        self.assertEqual(data["subtotal"], "50.00")
+        self.assertEqual(
+            sorted(self.order.items.values_list("menuitem_id", "quantity")),
+            sorted([(tea.id, 3), (juice.id, 2)]),
+        )
+        # كل صنف بياخد 2 من مكونه: الشاي 6، القهوة رجعت، العصير 4
+        self.assertEqual(sum(SinastarInventory.objects.values_list("addition", flat=True)), 300 - 10)
+
+    def test_stale_version_is_rejected_without_changes(self):
+        tea = self.items[0]
+        stale = self.order.version
+        self.post_json(self.url, {"version": stale, "lines": [{"menuitem_id": tea.id, "delta": 1}]})
+        response = self.post_json(self.url, {"version": stale, "lines": [{"menuitem_id": tea.id, "delta": 1}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["version"], stale + 1)
+        self.assertEqual(self.order.items.get(menuitem=tea).quantity, 3)
+
+
+class OrderVersionTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.tea = self.make_menu(1, stock_per_material=100)[0]
+        self.order = OrderCommitter(self.user).set_table_items(7, [(self.tea.id, 1)])
+        self.seen = self.order.version
+        # جرسون تاني زوّد شاي بعد ما الأول فتح الترابيزة
+        self.post_json(reverse("patch_order_lines", args=[self.order.id]),
+                       {"lines": [{"menuitem_id": self.tea.id, "delta": 1}]})
+
+    def test_stale_full_table_save_gets_fresh_state(self):
+        response = self.post_json(reverse("create_order"), {
+            "table_number": 7, "version": self.seen,
+            "items": [{"menuitem_id": self.tea.id, "quantity": 5}],
+        })
+        self.assertEqual(response.status_code, 409)
+        data = response.json()
+        self.assertEqual(data["order"]["version"], self.seen + 1)
+        self.assertEqual(data["items"][0]["quantity"], 2)
+        self.assertEqual(self.order.items.get().quantity, 2)
+
+    def test_stale_payment_is_refused(self):
+        url = reverse("confirm_payment", args=[self.order.id, "cash"])
+        self.assertEqual(self.client.get(url, {"version": self.seen}).status_code, 409)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+        self.assertEqual(self.client.get(url, {"version": self.order.version}).status_code, 302)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+
+
+    def test_malformed_version_is_a_bad_request(self):
+        self.assertEqual(
+            self.client.get(reverse("confirm_payment", args=[self.order.id, "cash"]), {"version": "abc"}).status_code, 400
+        )
+        self.assertEqual(self.client.get(reverse("waiter_mark_done", args=[self.order.id]), {"version": "1.5"}).status_code, 400)
+        paid = self.client.post(reverse("mark_order_paid", args=[self.order.id]), {"payment_method": "cash", "version": "x"})
+        self.assertEqual(paid.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+class KitchenFeedTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=100)
+        self.url = reverse("kitchen_feed")
+
+    def feed(self, since, **params):
+        return self.client.get(self.url, {"since": since, **params}).json()
+
+    def test_idle_poll_is_one_query(self):
+        from . import kitchen_feed
+
+        self.committer.set_table_items(3, [(self.tea.id, 1)])
+        cursor = self.feed(0)["cursor"]
+        with CaptureQueriesContext(connection) as ctx:
+            data = kitchen_feed.changes_since(cursor)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(data["changes"], [])
+
+    def test_created_done_and_removed_show_up(self):
+        order = self.committer.set_table_items(3, [(self.tea.id, 1), (self.coffee.id, 1)])
+        data = self.feed(0, type="barista")
+        self.assertEqual({c["status"] for c in data["changes"]}, {"pending"})
+        self.assertEqual(len(data["changes"]), 2)
+        cursor = data["cursor"]
+
+        tea = order.items.get(menuitem=self.tea)
+        self.client.post(reverse("mark_item_done", args=[tea.id]))
+        order.refresh_from_db()
+        self.committer.set_table_items(3, [(self.tea.id, 1)], expected_version=order.version)
+
+        data = self.feed(cursor)
+        by_status = {c["status"]: c["id"] for c in data["changes"]}
+        self.assertEqual(by_status["done"], tea.id)
+        self.assertIn("removed", by_status)
+        self.assertEqual(self.feed(data["cursor"])["changes"], [])
+
+    def test_paid_order_leaves_the_screen(self):
+        order = self.committer.set_table_items(3, [(self.tea.id, 1)])
+        cursor = self.feed(0)["cursor"]
+        self.committer.pay(order, "cash", order.version)
+        self.assertEqual([c["status"] for c in self.feed(cursor)["changes"]], ["removed"])
+
+
+class OrderEventsTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+        self.tea = self.make_menu(1, stock_per_material=100)[0]
+
+    def create_order(self):
+        from .order_commit import OrderCommitter
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return OrderCommitter(self.user).create("takeaway", [(self.tea.id, 1)])
+
+    def test_commit_publishes_after_commit(self):
+        from . import events
+
+        order = self.create_order()
+        seq, event, payload = events._recent[-1]
+        self.assertEqual(event, "order")
+        self.assertEqual(json.loads(payload)["id"], order.id)
+        self.assertEqual(json.loads(payload)["status"], "created")
+
+    def test_resume_from_last_event_id(self):
+        from . import events
+
+        self.create_order()
+        last = f"{events.BOOT}-{events._recent[-1][0]}"
+        order = self.create_order()
+        with events._lock:
+            backlog = events._backlog(last)
+        self.assertEqual([json.loads(m[2])["id"] for m in backlog], [order.id])
+        with events._lock:
+            self.assertIsNone(events._backlog("0-1"))
+
+    def test_wsgi_falls_back_to_polling(self):
+        self.assertEqual(self.client.get(reverse("order_events")).status_code, 204)
+
+    @override_settings(EVENTS_STREAM_LIFETIME=0.2, EVENTS_HEARTBEAT=0.05)
+    async def test_stream_replays_backlog(self):
+        from asgiref.sync import sync_to_async
+
+        from . import events
+
+        last = f"{events.BOOT}-{events._recent[-1][0] if events._recent else 0}"
+        await sync_to_async(self.create_order)()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("order_events"), headers={"Last-Event-ID": last})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertIn("event: order", body)
+        self.assertIn(": ping", body)
+
+
+class KitchenScreenQueryTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=1000)
+
+    def open_tables(self, count):
+        for table in range(1, count + 1):
+            self.committer.set_table_items(table, [(self.tea.id, 1), (self.coffee.id, 1)])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_open_items_is_one_query(self):
+        from . import kitchen_feed
+
+        self.open_tables(3)
+        with self.assertNumQueries(1):
+            grouped = kitchen_feed.open_items(is_done=False, section="barista")
+            names = [[item.menuitem.name for item in data["items"]] for data in grouped]
+        self.assertEqual(len(grouped), 3)
+        self.assertEqual(names[0], ["item-0", "item-1"])
+
+    def test_screens_do_not_grow_with_open_orders(self):
+        self.open_tables(1)
+        OrderItem.objects.filter(menuitem=self.coffee).update(is_done=True)
+        pending = self.count_queries(reverse("pending_items"))
+        waiter = self.count_queries(reverse("waiter_items"))
+
+        self.open_tables(6)
+        OrderItem.objects.filter(menuitem=self.coffee).update(is_done=True)
+        self.assertEqual(self.count_queries(reverse("pending_items")), pending)
+        self.assertEqual(self.count_queries(reverse("waiter_items")), waiter)
+
+    def test_screens_need_login(self):
+        self.client.logout()
+        for name in ("pending_items", "waiter_items"):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 302)
+
+
+class LatestOrdersFeedTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea = self.make_menu(1, stock_per_material=1000)[0]
+        self.url = reverse("get_latest_orders")
+
+    def test_inserts_and_updates_since_cursor(self):
+        first = self.committer.create("takeaway", [(self.tea.id, 1)])
+        data = self.client.get(self.url, {"since": 0}).json()
+        self.assertEqual([o["id"] for o in data["orders"]], [first.id])
+        self.assertEqual(data["orders"][0]["cashier"], "cashier")
+        cursor = data["cursor"]
+
+        second = self.committer.create("takeaway", [(self.tea.id, 2)])
+        self.committer.pay(first, "cash")
+        data = self.client.get(self.url, {"since": cursor}).json()
+        by_id = {o["id"]: o for o in data["orders"]}
+        self.assertEqual(set(by_id), {first.id, second.id})
+        self.assertTrue(by_id[first.id]["is_paid"])
+        self.assertEqual(by_id[first.id]["payment_method"], "كاش")
+
+    def test_serialized_from_one_query(self):
+        from . import order_feed
+
+        for _ in range(4):
+            self.committer.create("takeaway", [(self.tea.id, 1)])
+        top = order_feed.head()
+        with self.assertNumQueries(1):
+            data = order_feed.changes_since(0, top)
+        self.assertEqual(len(data["orders"]), 4)
+
+    @override_settings(ORDERS_LONG_POLL_RECHECK=0.05)
+    def test_idle_long_poll_times_out_empty(self):
+        self.committer.create("takeaway", [(self.tea.id, 1)])
+        cursor = self.client.get(self.url).json()["cursor"]
+        data = self.client.get(self.url, {"since": cursor, "wait": 0.2}).json()
+        self.assertEqual(data["orders"], [])
+        self.assertEqual(data["cursor"], cursor)
+
+
+class BulkMarkDoneTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.tea, self.coffee, self.sandwich = self.make_menu(3, stock_per_material=1000)
+        MenuItem.objects.filter(pk=self.sandwich.pk).update(section="canteen")
+        self.order = OrderCommitter(self.user).set_table_items(
+            4, [(self.tea.id, 2), (self.coffee.id, 1), (self.sandwich.id, 1)]
+        )
+
+    def test_ticket_for_one_section_in_one_update(self):
+        from . import kitchen_feed
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_json(reverse("mark_items_done"), {"order_id": self.order.id, "section": "barista"})
+        data = response.json()
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "main_orderitem"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(data["done"], 2)
+        self.assertEqual(data["cursor"], kitchen_feed.head())
+
+        done = dict(self.order.items.values_list("menuitem__section", "is_done").order_by("menuitem__section"))
+        self.assertEqual(done, {"barista": True, "canteen": False})
+        self.assertFalse(self.order.items.filter(is_done=True, done_at__isnull=True).exists())
+
+    def test_chosen_items_only(self):
+        tea = self.order.items.get(menuitem=self.tea)
+        data = self.post_json(reverse("mark_items_done"), {"item_ids": [tea.id]}).json()
+        self.assertEqual(data["done"], 1)
+        self.assertEqual(list(self.order.items.filter(is_done=True).values_list("id", flat=True)), [tea.id])
+        self.assertEqual(self.post_json(reverse("mark_items_done"), {}).status_code, 400)
+
+    def test_single_tap_does_not_load_the_order_again(self):
+        tea = self.order.items.get(menuitem=self.tea)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse("mark_item_done", args=[tea.id]))
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "main_order" WHERE' in q["sql"]])
+
+    def test_items_from_several_orders_publish_one_event_each(self):
+        from . import events
+        from .order_commit import OrderCommitter
+
+        other = OrderCommitter(self.user).set_table_items(5, [(self.tea.id, 1)])
+        item_ids = [self.order.items.get(menuitem=self.coffee).id, other.items.get().id]
+        last = events._recent[-1][0] if events._recent else 0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_json(reverse("mark_items_done"), {"item_ids": item_ids})
+
+        published = [json.loads(payload) for seq, _, payload in list(events._recent) if seq > last]
+        self.assertEqual(sorted(p["id"] for p in published), sorted([self.order.id, other.id]))
+        self.assertEqual({p["status"] for p in published}, {"items_done"})
+
+
+class KitchenLifecycleTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=1000)
+
+    def test_served_items_stay_on_the_bill(self):
+        from . import kitchen_feed
+
+        order = self.committer.set_table_items(2, [(self.tea.id, 1), (self.coffee.id, 1)])
+        total = order.total
+        kitchen_feed.complete_items(order_id=order.id)
+        self.client.get(reverse("waiter_mark_done", args=[order.id]), {"version": order.version})
+
+        order.refresh_from_db()
+        self.assertEqual(order.total, total)
+        self.assertEqual(order.items.filter(served_at__isnull=False).count(), 2)
+        self.assertEqual(kitchen_feed.open_items(is_done=True), [])
+
+    def test_reorder_after_served_reaches_the_kitchen(self):
+        from . import kitchen_feed
+
+        order = self.committer.set_table_items(99, [(self.tea.id, 1)])
+        kitchen_feed.complete_items(order_id=order.id)
+        order = self.committer.clear_done_items(order)
+        stock_before = StockMovement.objects.filter(kind__in=["sale", "restore"]).aggregate(n=Sum("quantity"))["n"]
+
+        # الشاشة بتبعت اللي لسه ما اتقدمش بس → شاي واحد جديد
+        order = self.committer.set_table_items(99, [(self.tea.id, 1)])
+        pending = kitchen_feed.open_items(is_done=False)
+        self.assertEqual([(g["order"].id, [i.quantity for i in g["items"]]) for g in pending], [(order.id, [1])])
+        self.assertEqual(
+            sorted((i.quantity, i.is_done, i.served_at is None) for i in order.items.all()),
+            [(1, False, True), (1, True, False)],
+        )
+
+        # patch_lines كمان: الزيادة سطر مستني، والنقص ما بيرجّعش اللي اتقدم للمخزن
+        order, result = self.committer.patch_lines(order.id, [(self.tea.id, None, 1)])
+        self.assertEqual(result, {self.tea.id: 2})
+        order, result = self.committer.patch_lines(order.id, [(self.tea.id, 0, None)])
+        self.assertEqual(list(order.items.values_list("quantity", flat=True)), [1])
+        self.assertEqual(
+            StockMovement.objects.filter(kind__in=["sale", "restore"]).aggregate(n=Sum("quantity"))["n"], stock_before
+        )
+        state = self.client.get(reverse("get_order", args=[99])).json()
+        self.assertEqual((state["items"], [r["quantity"] for r in state["served"]]), ([], [1]))
+
+    def test_start_is_recorded_once(self):
+        order = self.committer.set_table_items(2, [(self.tea.id, 1)])
+        url = reverse("mark_items_done")
+        self.post_json(url, {"order_id": order.id, "action": "start"})
+        started = order.items.get().started_at
+        self.assertIsNotNone(started)
+        self.assertEqual(self.post_json(url, {"order_id": order.id, "action": "start"}).json()["done"], 0)
+        self.assertEqual(order.items.get().started_at, started)
+
+    def test_hourly_stats(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from . import kitchen_stats
+
+        base = timezone.now().replace(hour=20, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        order = self.committer.create("takeaway", [(self.tea.id, 1)])
+        for minutes, prep in enumerate([60, 120, 180, 240]):
+            item = OrderItem.objects.create(order=order, menuitem=self.coffee, quantity=1)
+            queued = base + timedelta(minutes=minutes)
+            OrderItem.objects.filter(pk=item.pk).update(
+                queued_at=queued, started_at=queued, done_at=queued + timedelta(seconds=prep), is_done=True
+            )
+        order.items.filter(menuitem=self.tea).delete()
+
+        stats = {(s.section, s.hour): s for s in kitchen_stats.compute(days=7)}
+        stat = stats[("barista", 20)]
+        self.assertEqual(stat.prep_p50, 120)
+        self.assertEqual(stat.prep_p95, 240)
+        self.assertEqual(stat.items_per_hour, Decimal("0.57"))
+        self.assertEqual(stat.queue_peak, 2)
+
+        kitchen_stats.rebuild(days=7)
+        self.assertEqual(self.client.get(reverse("kitchen_report")).status_code, 200)
+
+
+class OrdersListTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.tea = self.make_menu(1, stock_per_material=1000)[0]
+        self.orders = [OrderCommitter(self.user).create("takeaway", [(self.tea.id, 1)]) for _ in range(4)]
+        self.cafe = OrderCommitter(self.user).set_table_items(1, [(self.tea.id, 2)])
+        other = User.objects.create_user("other", password="pw")
+        self.other_order = OrderCommitter(other).create("qeta3", [(self.tea.id, 1)])
+
+    def test_counters_and_totals(self):
+        response = self.client.get(reverse("orders_list"), {"type": "takeaway"})
+        ctx = response.context
+        self.assertEqual(ctx["total_orders"], 4)
+        self.assertEqual(ctx["total_sales"], sum(o.total for o in self.orders))
+        self.assertEqual((ctx["cafe_count"], ctx["takeaway_count"], ctx["qeta3_count"], ctx["all_count"]), (1, 4, 1, 6))
+
+    def test_query_count_does_not_grow(self):
+        from .order_commit import OrderCommitter
+
+        def queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse("orders_list"))
+            return len(ctx.captured_queries)
+
+        before = queries()
+        for _ in range(5):
+            OrderCommitter(self.user).create("takeaway", [(self.tea.id, 1)])
+        self.assertEqual(queries(), before)
+
+    def test_keyset_pages_walk_every_order_once(self):
+        seen = []
+        params = {}
+        with mock.patch("main.views.ORDERS_PAGE_SIZE", 2):
+            while True:
+                ctx = self.client.get(reverse("orders_list"), params).context
+                seen += [o.id for o in ctx["orders"]]
+                if not ctx["next_cursor"]:
+                    break
+                params = {"before": ctx["next_cursor"]}
+        expected = list(Order.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cashier_filter_by_id(self):
+        other = User.objects.get(username="other")
+        ctx = self.client.get(reverse("orders_list"), {"cashier": other.id}).context
+        self.assertEqual([o.id for o in ctx["orders"]], [self.other_order.id])
+        ctx = self.client.get(reverse("orders_list"), {"cashier": "other"}).context
+        self.assertEqual(ctx["total_orders"], 1)
+
+    def test_unknown_cashier_name_matches_nothing(self):
+        for name in ("nobody", "othe"):
+            ctx = self.client.get(reverse("orders_list"), {"cashier": name}).context
+            self.assertEqual((ctx["orders"], ctx["total_orders"]), ([], 0))
+
+    @override_settings(CAFE_DAY_STARTS_AT=6)
+    def test_today_is_the_business_day_on_a_range(self):
+        from datetime import datetime
+
+        def at(day, hour):
+            return timezone.make_aware(datetime(2026, 3, day, hour))
+
+        # يوم الشغل 1 مارس: من 1 مارس 6 الصبح لحد 2 مارس 6 الصبح
+        for order, moment in zip(self.orders, (at(1, 5), at(1, 10), at(2, 2), at(2, 7))):
+            Order.objects.filter(id=order.id).update(created_at=moment)
+        Order.objects.exclude(id__in=[o.id for o in self.orders]).update(created_at=at(1, 4))
+
+        with mock.patch("main.views.now", return_value=at(2, 4)), CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("orders_list"), {"date": "today"})
+        self.assertEqual({o.id for o in response.context["orders"]}, {self.orders[1].id, self.orders[2].id})
+        self.assertFalse([q for q in ctx.captured_queries if "django_datetime_cast_date" in q["sql"]])
+
+
+class DailySalesRollupTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=1000)
+
+    def rollup(self):
+        from .models import DailySalesRollup
+
+        return {
+            row.menuitem_id: (row.quantity, row.revenue)
+            for row in DailySalesRollup.objects.all()
+            if row.quantity
+        }
+
+    def assertMatchesRebuild(self):
+        from . import sales_rollup
+
+        live = self.rollup()
+        sales_rollup.rebuild()
+        self.assertEqual(live, self.rollup())
+
+    def test_commit_edit_and_delete_keep_rollup_in_step(self):
+        self.committer.create("takeaway", [(self.tea.id, 2)])
+        order = self.committer.set_table_items(5, [(self.tea.id, 1), (self.coffee.id, 3)])
+        self.assertEqual(self.rollup(), {self.tea.id: (3, Decimal("30.00")), self.coffee.id: (3, Decimal("30.00"))})
+
+        order, _ = self.committer.patch_lines(order.id, [(self.coffee.id, None, -2)])
+        self.assertEqual(self.rollup()[self.coffee.id], (1, Decimal("10.00")))
+        self.assertMatchesRebuild()
+
+        self.committer.delete(order)
+        self.assertEqual(self.rollup(), {self.tea.id: (2, Decimal("20.00"))})
+        self.assertMatchesRebuild()
+
+    def test_daily_closing_reads_rollup(self):
+        self.committer.create("takeaway", [(self.tea.id, 2), (self.coffee.id, 1)])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("daily_closing"))
+        self.assertFalse([q for q in ctx.captured_queries if '"main_orderitem"' in q["sql"]])
+        self.assertEqual(
+            {s["section"]: s["total_qty"] for s in response.context["section_summary"]}, {"باريستا": 3}
+        )
+
+    def test_section_change_does_not_split_the_day(self):
+        from .models import DailySalesRollup
+
+        order = self.committer.set_table_items(5, [(self.tea.id, 3)])
+        MenuItem.objects.filter(pk=self.tea.pk).update(section="canteen")
+        self.committer.patch_lines(order.id, [(self.tea.id, None, -1)])
+
+        rows = list(DailySalesRollup.objects.values_list("section", "menuitem_id", "quantity", "revenue"))
+        self.assertEqual(rows, [("barista", self.tea.id, 2, Decimal("20.00"))])
+
+    def test_concurrent_first_sale_of_the_day_is_added_not_lost(self):
+        from . import sales_rollup
+        from .models import DailySalesRollup
+
+        # كاشير تاني عمل صف الشاي بتاع النهارده بعد ما قرينا إن مفيش صف
+        DailySalesRollup.objects.create(
+            day=sales_rollup.business_day(timezone.now()), section="barista", menuitem=self.tea,
+            quantity=1, revenue=10, cost=0,
+        )
+        real = DailySalesRollup.objects.select_for_update
+        reads = []
+
+        def first_read_misses(*args, **kwargs):
+            reads.append(1)
+            return DailySalesRollup.objects.none() if len(reads) == 1 else real(*args, **kwargs)
+
+        with mock.patch.object(DailySalesRollup.objects, "select_for_update", first_read_misses):
+            self.committer.create("takeaway", [(self.tea.id, 2)])
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(self.rollup(), {self.tea.id: (3, Decimal("30.00"))})
+        self.assertEqual(DailySalesRollup.objects.count(), 1)
+
+
+class ClosingJobTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=1000)
+        self.today = timezone.localdate()
+        cache.clear()
+
+    def history(self, menuitem, *additions):
+        from .models import SinastarInventoryHistory
+
+        material = Recipe.objects.get(menuitem=menuitem).material
+        for addition in additions:
+            SinastarInventoryHistory.objects.create(material=material, addition=addition, type="Baresta")
+        return material
+
+    def additions(self, material):
+        from .models import SinastarInventoryHistory
+
+        return list(
+            SinastarInventoryHistory.objects.filter(material=material).order_by("created_at", "id")
+            .values_list("addition", flat=True)
+        )
+
+    def test_job_computes_totals_and_settles_history_fifo(self):
+        from . import closing_jobs
+        from .models import ClosingJob, ExtraExpense
+
+        tea_material = self.history(self.tea, 5, 10)
+        self.committer.create("takeaway", [(self.tea.id, 3)])  # 6 وحدات من المكون
+        ExtraExpense.objects.create(category="tips", amount=7)
+        ExtraExpense.objects.create(category="nesrayat", amount=2)
+        paid = Order.objects.filter(is_paid=True).aggregate(s=Sum("total"))["s"] or 0
+
+        job = closing_jobs.enqueue(self.today, self.today, self.user)
+        self.assertTrue(closing_jobs.run(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.step), ("done", "finished"))
+        self.assertEqual(job.closing.total_sales_orders, paid)
+        self.assertEqual((job.closing.total_tips, job.closing.total_nesrayat), (7, 2))
+        self.assertEqual(self.additions(tea_material), [9])
+        self.assertEqual(StockMovement.objects.filter(kind="closing").count(), 2)
+        # الشغلانة اللي خلصت ما تتشغلش تاني
+        self.assertFalse(closing_jobs.run(job.id))
+        self.assertEqual(ClosingJob.objects.get().closing_id, job.closing_id)
+
+    def test_failed_job_resumes_without_double_deduction(self):
+        from . import closing_jobs
+        from .models import MonthlyClosing
+
+        tea_material = self.history(self.tea, 4)
+        coffee_material = self.history(self.coffee, 4)
+        self.committer.create("takeaway", [(self.tea.id, 1), (self.coffee.id, 1)])
+        job = closing_jobs.enqueue(self.today, self.today, self.user)
+
+        real = closing_jobs._deduct_history
+        calls = []
+
+        def flaky(material_id, quantity):
+            calls.append(material_id)
+            if len(calls) == 2:
+                raise RuntimeError("boom")
+            real(material_id, quantity)
+
+        with mock.patch.object(closing_jobs, "_deduct_history", flaky), self.assertLogs("main.closing_jobs", "ERROR"):
+            self.assertFalse(closing_jobs.run(job.id))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.step, len(job.settled_materials)), ("failed", "history", 1))
+        self.assertIn("boom", job.error)
+
+        self.assertTrue(closing_jobs.run(job.id))
+        self.assertEqual((self.additions(tea_material), self.additions(coffee_material)), ([2], [2]))
+        self.assertEqual(MonthlyClosing.objects.count(), 1)
+
+    def test_closing_the_same_day_twice_deducts_once(self):
+        from datetime import timedelta
+
+        from . import closing_jobs
+        from .models import MonthlyClosing
+
+        tea_material = self.history(self.tea, 100)
+        self.committer.create("takeaway", [(self.tea.id, 3)])
+        first = closing_jobs.enqueue(self.today, self.today, self.user)
+        self.assertTrue(closing_jobs.run(first.id))
+
+        again = closing_jobs.enqueue(self.today, self.today, self.user)
+        self.assertEqual(again.id, first.id)
+        self.assertFalse(closing_jobs.run(again.id))
+        self.assertEqual((MonthlyClosing.objects.count(), self.additions(tea_material)), (1, [94]))
+
+        # فترة أكبر فيها اليوم المقفول → رفض بدل خصم تاني
+        with self.assertRaises(closing_jobs.AlreadyClosed):
+            closing_jobs.enqueue(self.today - timedelta(days=3), self.today, self.user)
+        response = self.client.post(reverse("create_monthly_closing"), {
+            "start_date": (self.today - timedelta(days=3)).isoformat(), "end_date": self.today.isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("تقفيلة قبل كده", response.context["error"])
+        self.assertEqual((MonthlyClosing.objects.count(), self.additions(tea_material)), (1, [94]))
+
+    def test_preview_is_read_only_and_cached(self):
+        from . import closing_jobs
+        from .models import ExtraExpense, MonthlyClosing
+
+        tea_material = self.history(self.tea, 5)
+        self.committer.create("takeaway", [(self.tea.id, 1)])
+        url = reverse("preview_monthly_closing")
+        form = {"start_date": self.today.isoformat(), "end_date": self.today.isoformat()}
+
+        first = self.client.get(url, form)
+        self.assertFalse(first.context["preview_cached"])
+        with mock.patch.object(closing_jobs, "compute_totals", side_effect=AssertionError):
+            second = self.client.get(url, form)
+        self.assertTrue(second.context["preview_cached"])
+        self.assertEqual(first.context["preview"], second.context["preview"])
+        self.assertEqual((MonthlyClosing.objects.count(), self.additions(tea_material)), (0, [5]))
+
+        # أي تغيير في الداتا → ختم جديد → حساب جديد
+        ExtraExpense.objects.create(category="tips", amount=4)
+        third = self.client.get(url, form)
+        self.assertFalse(third.context["preview_cached"])
+        self.assertEqual(third.context["preview"]["total_tips"], 4)
+
+    def test_data_stamp_reads_counters_not_tables(self):
+        from . import closing_jobs
+        from .models import ExtraExpense
+
+        expense = ExtraExpense.objects.create(category="tips", amount=4)
+        with CaptureQueriesContext(connection) as ctx:
+            before = closing_jobs.data_stamp()
+        self.assertFalse([q for q in ctx.captured_queries if "COUNT(" in q["sql"] or "SUM(" in q["sql"]])
+
+        expense.amount = 5
+        expense.save()
+        edited = closing_jobs.data_stamp()
+        expense.delete()
+        self.assertEqual(len({before, edited, closing_jobs.data_stamp()}), 3)
+
+    def test_job_reuses_cached_preview(self):
+        from . import closing_jobs
+
+        self.committer.create("takeaway", [(self.coffee.id, 2)])
+        totals, _ = closing_jobs.preview(self.today, self.today)
+        job = closing_jobs.enqueue(self.today, self.today, self.user)
+        with mock.patch.object(closing_jobs, "compute_totals", side_effect=AssertionError):
+            self.assertTrue(closing_jobs.run(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.closing.actual_profit, totals["actual_profit"])
+
+    @override_settings(CLOSING_JOBS_IN_BACKGROUND=False)
+    def test_form_enqueues_and_shows_status(self):
+        from .models import ClosingJob
+
+        form = {"start_date": self.today.isoformat(), "end_date": self.today.isoformat()}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("create_monthly_closing"), form)
+            again = self.client.post(reverse("create_monthly_closing"), form)
+        job = ClosingJob.objects.get()
+        self.assertRedirects(response, reverse("closing_job_status", args=[job.id]))
+        self.assertRedirects(again, reverse("closing_job_status", args=[job.id]))
+        self.assertEqual(job.status, "queued")
+
+        status = self.client.get(reverse("closing_job_status", args=[job.id]), {"format": "json"}).json()
+        self.assertEqual((status["status"], status["step"]), ("queued", "totals"))
+
+
+
+class ClosingSnapshotTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        from .order_commit import OrderCommitter
+
+        self.login()
+        self.committer = OrderCommitter(self.user)
+        self.tea, self.coffee = self.make_menu(2, stock_per_material=1000)
+        cache.clear()
+
+    def panel(self, name, **params):
+        return self.client.get(reverse("monthly_closing_panel", args=[name]), params)
+
+    def test_report_reads_closed_days_from_snapshots(self):
+        from datetime import timedelta
+
+        from . import closing_jobs, sales_rollup, stock
+        from .models import ClosingSnapshot, ExtraExpense
+
+        # يوم امبارح يتقفل، والنهارده هو الذيل المفتوح
+        old = self.committer.create("takeaway", [(self.tea.id, 2), (self.coffee.id, 1)])
+        ExtraExpense.objects.create(category="tips", amount=5)
+        yesterday = timezone.now() - timedelta(days=1)
+        Order.objects.filter(id=old.id).update(created_at=yesterday, is_paid=True)
+        StockMovement.objects.update(created_at=yesterday)
+        ExtraExpense.objects.update(created_at=yesterday)
+        sales_rollup.rebuild()
+        day = sales_rollup.business_day(yesterday)
+        self.assertTrue(closing_jobs.run(closing_jobs.enqueue(day, day, self.user).id))
+        self.assertTrue(ClosingSnapshot.objects.filter(kind="section").exists())
+
+        new = self.committer.create("takeaway", [(self.tea.id, 1)])
+        Order.objects.filter(id=new.id).update(is_paid=True)
+        ExtraExpense.objects.create(category="nesrayat", amount=3)
+
+        orders = self.panel("orders").context
+        self.assertEqual([o.id for o in orders["rows"]], [new.id])
+        self.assertEqual(orders["totals"]["count"], 2)
+        self.assertEqual(orders["totals"]["sales"], Order.objects.aggregate(s=Sum("total"))["s"])
+        expenses = self.panel("expenses").context["totals"]
+        self.assertEqual((expenses["tips"], expenses["nesrayat"]), (5, 3))
+
+        raw = StockMovement.objects.filter(kind__in=["sale", "restore"])
+        sold_raw = stock.sold_totals(raw)
+        sold = self.panel("sold").context
+        self.assertEqual(len(sold["rows"]), raw.filter(order_id=new.id).count())
+        self.assertEqual(
+            (sold["totals"]["units"], sold["totals"]["sale"], sold["totals"]["purchase"]),
+            (sold_raw["units"], sold_raw["sale"], sold_raw["purchase"]),
+        )
+
+        # فلتر جوه الفترة المقفولة بس → مفيش صفوف خام خالص
+        only_closed = self.panel("orders", order_start=day.isoformat(), order_end=day.isoformat()).context
+        self.assertEqual(list(only_closed["rows"]), [])
+        self.assertEqual(only_closed["totals"]["count"], 1)
+
+
+class ClosingPanelsTests(StockFixtureMixin, TestCase):
+    def setUp(self):
+        self.login()
+
+    def test_page_only_reads_closings(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("monthly_closing_list"))
+        self.assertEqual(response.status_code, 200)
+        tables = {"main_order", "main_stockmovement", "main_extraexpense", "main_sinastarinventory"}
+        self.assertFalse([q for q in ctx.captured_queries if any(f'"{t}"' in q["sql"] for t in tables)])
+
+        self.make_menu(1)
+        for panel in ("sold", "history", "store", "orders", "expenses"):
+            self.assertEqual(self.client.get(reverse("monthly_closing_panel", args=[panel])).status_code, 200)
+
+    def test_panel_pages_with_sql_totals(self):
+        from . import closing_panels
+        from .models import ExtraExpense
+
+        ExtraExpense.objects.bulk_create(
+            [ExtraExpense(category="tips", amount=1) for _ in range(closing_panels.PAGE_SIZE + 5)]
+        )
+        url = reverse("monthly_closing_panel", args=["expenses"])
+        first = self.client.get(url)
+        self.assertEqual(len(first.context["rows"]), closing_panels.PAGE_SIZE)
+        self.assertEqual(first.context["totals"]["tips"], closing_panels.PAGE_SIZE + 5)
+
+        second = self.client.get(f"{url}?{first.context['next_query']}")
+        self.assertEqual(len(second.context["rows"]), 5)
+        self.assertEqual(second.context["next_query"], "")
+        seen = {e.id for e in first.context["rows"]} | {e.id for e in second.context["rows"]}
+        self.assertEqual(len(seen), closing_panels.PAGE_SIZE + 5)
+
+        self.assertEqual(self.client.get(reverse("monthly_closing_panel", args=["nope"])).status_code, 404)
+
+    @override_settings(CAFE_DAY_STARTS_AT=6)
+    def test_date_filter_follows_business_day(self):
+        from datetime import date, datetime
+
+        from .models import ExtraExpense
+
+        at = {}
+        for label, moment in (("before", (1, 3)), ("day", (1, 10)), ("after_midnight", (2, 3))):
+            expense = ExtraExpense.objects.create(category="tips", amount=1)
+            at[label] = expense.id
+            ExtraExpense.objects.filter(id=expense.id).update(
+                created_at=timezone.make_aware(datetime(2026, 3, moment[0], moment[1]))
+            )
+
+        day = date(2026, 3, 1).isoformat()
+        context = self.client.get(
+            reverse("monthly_closing_panel", args=["expenses"]), {"exp_start": day, "exp_end": day}
+        ).context
+        self.assertEqual({e.id for e in context["rows"]}, {at["day"], at["after_midnight"]})
+        self.assertEqual(context["totals"]["tips"], 2)
@@ -28,6 +28,7 @@ urlpatterns = [
     
     path("create_order/", views.create_order, name="create_order"),
     path("in-cafe/", views.in_cafe, name="in_cafe"),
+    path("in-cafe/board/", views.table_board_json, name="table_board"),
 
     path("orders/", views.orders_list, name="orders_list"),
     path("orders/<int:order_id>/", views.order_detail, name="order_detail"),
@@ -39,17 +40,25 @@ urlpatterns = [
     path("takeaway/", views.takeaway, name="takeaway"),
     path("takeaway/order/", views.create_takeaway_order, name="create_takeaway_order"),
     path("pending-items/", views.pending_items, name="pending_items"),
+    path("pending-items/feed/", views.kitchen_feed_view, name="kitchen_feed"),
+    path("events/", views.order_events, name="order_events"),
     path("mark-item-done/<int:item_id>/", views.mark_item_done, name="mark_item_done"),
+    path("pending-items/done/", views.mark_items_done, name="mark_items_done"),
+    path("kitchen-report/", views.kitchen_report, name="kitchen_report"),
     path("waiter-items/", views.waiter_items, name="waiter_items"),
     path("waiter-items/done/<int:order_id>/", views.waiter_mark_done, name="waiter_mark_done"),
 
     path("qeta3/", views.qeta3, name="qeta3"),
     path("qeta3/order/", views.create_qeta3_order, name="create_qeta3_order"),
     path("check_menuitem/", views.check_menuitem, name="check_menuitem"),
+    path("check_cart/", views.check_cart, name="check_cart"),
     path("officer-orders/", views.officer_orders, name="officer_orders"),
     path("daily-closing/", views.daily_closing, name="daily_closing"),
     path("monthly_closing/", views.monthly_closing_list, name="monthly_closing_list"),
+    path("monthly_closing/panel/<str:panel>/", views.monthly_closing_panel, name="monthly_closing_panel"),
     path("monthly_closing/create/", views.create_monthly_closing, name="create_monthly_closing"),
+    path("monthly_closing/preview/", views.preview_monthly_closing, name="preview_monthly_closing"),
+    path("monthly_closing/jobs/<int:job_id>/", views.closing_job_status, name="closing_job_status"),
     path("sinastar_inventory/history/", views.sinastar_inventory_history, name="sinastar_inventory_history"),
     path("update_addition/<int:item_id>/<str:action>/", views.update_addition, name="update_addition"),
 
@@ -57,6 +66,7 @@ urlpatterns = [
     path("extra-expenses/", views.extra_expenses_view, name="extra_expenses"),
     path("extra-expenses/delete/<int:pk>/", views.delete_expense, name="delete_expense"),
     path("orders/<int:table_number>/get/", views.get_order, name="get_order"),
+    path("orders/<int:order_id>/lines/", views.patch_order_lines, name="patch_order_lines"),
     path("order/<int:order_id>/print/", views.print_order, name="print_order"),
 
     
@@ -1,24 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from .models import Product, Material, MaterialHistory,SinastarInventory,MenuItem, Recipe, Material, Order, OrderItem,MonthlyClosing,SinastarInventoryHistory,SoldMaterialHistory,ExtraExpense,Officer
+from .models import Product, Material, MaterialHistory,SinastarInventory,MenuItem, Material, Order, OrderItem,MonthlyClosing,ClosingJob,SinastarInventoryHistory,ExtraExpense,Officer
 from .forms import InventoryPasswordForm,SinastarInventoryForm,OrderItemForm,OrderForm,ExtraExpenseForm,MaterialForm
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 import json
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.db import transaction
 from django.utils.timezone import now, timedelta
 from django.forms import inlineformset_factory
-from .decorators import role_required
-from django.db.models import Sum, Count, F
+from .decorators import role_required, idempotent
+from django.db.models import Sum, Count, Exists, F, OuterRef, Q
 from datetime import timedelta,date,datetime
 from django.db.models.functions import TruncDay
-from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_date, parse_datetime
 from decimal import Decimal
 from django.db import models
+from . import closing_jobs, closing_panels, events, kitchen_feed, kitchen_stats, order_feed, sales_rollup, stock, table_board
+from .order_commit import OrderCommitter, InsufficientStock, UnknownMenuItems, StaleOrder, OrderClosed, BadVersion
 
 
 # ----------------- Authentication -----------------
@@ -154,6 +158,7 @@ def inventory_view(request):
     materials = Material.objects.all()
     return render(request, 'inventory.html', {'materials': materials})
 @login_required
+@transaction.atomic  # المخزن الفرعي + ملخص MaterialStock (من الـ signal) + المخزن الرئيسي مع بعض
 def add_sinastar_inventory(request):
     if request.method == 'POST':
         form = SinastarInventoryForm(request.POST)
@@ -265,13 +270,8 @@ def sinastar_inventory_list(request):
 def in_cafe(request):
     menu_items = MenuItem.objects.filter(is_active=True, show_in_cafe=True)
 
-    tables = []
-    for i in range(1, 21):  # 10 ترابيزات
-        order = Order.objects.filter(table_number=i, is_paid=False).first()
-        tables.append({
-            "number": i,
-            "order": order  # لو فيه أوردر غير مدفوع بيرجع، غير كده بيرجع None
-        })
+    # كل الترابيزات بأوردراتها المفتوحة في استعلامين (عددها من CAFE_TABLE_COUNT)
+    tables = table_board.board()
 
     return render(request, "in_cafe.html", {
         "menu_items": menu_items,
@@ -279,8 +279,15 @@ def in_cafe(request):
     })
 
 
+@login_required
+def table_board_json(request):
+    """لوحة الترابيزات للتابلت — نفس الاستعلامين من غير المنيو."""
+    return JsonResponse(table_board.board_json())
+
+
 @csrf_exempt
 @login_required
+@idempotent
 def create_order(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST فقط"}, status=405)
@@ -296,120 +303,76 @@ def create_order(request):
         if not items:
             return JsonResponse({"error": "الأصناف مطلوبة"}, status=400)
 
-        with transaction.atomic():
-            order = Order.objects.filter(
-                order_type="cafe", table_number=table_number, is_paid=False
-            ).first()
-
-            if not order:
-                order = Order.objects.create(
-                    order_type="cafe", table_number=table_number, cashier=request.user
-                )
-
-            old_items = {oi.menuitem_id: oi for oi in order.items.all()}
-            new_items = {int(it["menuitem_id"]): it for it in items}
-
-            # 1) لو صنف اتشال
-            for mid, old_item in old_items.items():
-                if mid not in new_items:
-                    _restore_materials(old_item.menuitem, old_item.quantity, request.user)
-                    old_item.delete()
-
-            # 2) تعديل / إضافة أصناف
-            for mid, new_item in new_items.items():
-                qty_new = int(new_item.get("quantity", 1))
-                if mid in old_items:
-                    old_item = old_items[mid]
-                    qty_old = old_item.quantity
-
-                    if qty_new <= 0:
-                        # لو الكمية الجديدة صفر → رجّع كل الكمية القديمة واحذف الصنف
-                        _restore_materials(old_item.menuitem, qty_old, request.user)
-                        old_item.delete()
-                    else:
-                        if qty_new > qty_old:
-                            _deduct_materials(old_item.menuitem, qty_new - qty_old, request.user)
-                        elif qty_new < qty_old:
-                            _restore_materials(old_item.menuitem, qty_old - qty_new, request.user)
-                        old_item.quantity = qty_new
-                        old_item.save()
-
-                else:
-                    menuitem = get_object_or_404(MenuItem, id=mid)
-                    _deduct_materials(menuitem, qty_new, request.user)
-                    OrderItem.objects.create(order=order, menuitem=menuitem, quantity=qty_new)
-
-            order.tax = order.subtotal * Decimal("0.14")
-            order.save()
+        order = OrderCommitter(request.user).set_table_items(
+            table_number,
+            [(it["menuitem_id"], it.get("quantity", 1)) for it in items],
+            expected_version=data.get("version"),
+        )
 
-        return JsonResponse({"ok": True, "order_id": order.id})
+        return JsonResponse({"ok": True, "order_id": order.id, "version": order.version})
 
+    except StaleOrder as e:
+        return _stale_order_response(e)
+    except BadVersion as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except UnknownMenuItems as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except InsufficientStock as e:
+        return JsonResponse({"error": "المخزن لا يكفي", "missing": e.missing}, status=400)
     except Exception as e:
         import traceback
         print("❌ Error in create_order:", traceback.format_exc())
         return JsonResponse({"error": str(e)}, status=500)
 
-def _deduct_materials(menuitem, qty, user):
-    recipes = Recipe.objects.filter(menuitem=menuitem)
-    for recipe in recipes:
-        material = recipe.material
-        required_qty = recipe.quantity * qty
-        inventories = SinastarInventory.objects.filter(material=material)
-        if not inventories.exists():
-            raise ValueError(f"المكون {material.name} مش موجود في أي مخزن")
-
-        total_addition = sum(inv.addition for inv in inventories)
-        if total_addition < required_qty:
-            raise ValueError(f"الإضافات لا تكفي: {material.name}")
-
-        remaining = required_qty
-        for inv in inventories:
-            if remaining <= 0: break
-            deducted = min(inv.addition, remaining)
-            inv.addition -= deducted
-            remaining -= deducted
-            inv.save()
-            if deducted > 0:
-                SoldMaterialHistory.objects.create(
-                    material=inv.material,
-                    quantity=deducted,
-                    addition=deducted,
-                    addition_cost=inv.addition_cost,
-                    purchase_price=inv.purchase_price,
-                    type=inv.type,
-                )
-        
-def _restore_materials(menuitem, qty, user):
-    recipes = Recipe.objects.filter(menuitem=menuitem)
-    for recipe in recipes:
-        material = recipe.material
-        return_qty = recipe.quantity * qty
-
-        # 1) رجّع الكمية للمخزن
-        inv = SinastarInventory.objects.filter(material=material).first()
-        if inv:
-            inv.addition += return_qty
-            inv.save()
-
-        # 2) انقص من سجل المبيعات
-        sold_qs = SoldMaterialHistory.objects.filter(material=material).order_by("-id")
-        remaining = return_qty
-        for sold in sold_qs:
-            if remaining <= 0:
-                break
-
-            deducted = min(sold.quantity, remaining)
-
-            # قلل من الكمية والإضافة مع بعض
-            sold.quantity -= deducted
-            sold.addition -= deducted
-
-            if sold.quantity <= 0 and sold.addition <= 0:
-                sold.delete()
-            else:
-                sold.save()
+@csrf_exempt
+@login_required
+@idempotent
+def patch_order_lines(request, order_id):
+    """
+    تعديل سطور بعينها في أوردر مفتوح بدل ما نبعت الترابيزة كلها:
+    {"version": 3, "lines": [{"menuitem_id": 5, "delta": 1}, {"menuitem_id": 7, "quantity": 0}]}
+    """
+    if request.method not in ("POST", "PATCH"):
+        return JsonResponse({"error": "POST أو PATCH فقط"}, status=405)
+
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+        lines = data.get("lines", [])
+        if not lines:
+            return JsonResponse({"error": "السطور مطلوبة"}, status=400)
+
+        changes = []
+        for line in lines:
+            if "quantity" not in line and "delta" not in line:
+                return JsonResponse({"error": "كل سطر محتاج quantity أو delta"}, status=400)
+            changes.append((line["menuitem_id"], line.get("quantity"), line.get("delta")))
+
+        order, result = OrderCommitter(request.user).patch_lines(
+            order_id, changes, expected_version=data.get("version")
+        )
+
+        return JsonResponse({
+            "ok": True,
+            "order_id": order.id,
+            "version": order.version,
+            "subtotal": str(order.subtotal),
+            "tax": str(order.tax),
+            "total": str(order.total),
+            "lines": [{"menuitem_id": mid, "quantity": qty} for mid, qty in result.items()],
+        })
 
-            remaining -= deducted
+    except Order.DoesNotExist:
+        return JsonResponse({"error": "الأوردر مش موجود"}, status=404)
+    except StaleOrder as e:
+        return _stale_order_response(e)
+    except OrderClosed as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except UnknownMenuItems as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except InsufficientStock as e:
+        return JsonResponse({"error": "المخزن لا يكفي", "missing": e.missing}, status=400)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
 @login_required
 def get_order(request, table_number):
@@ -420,113 +383,165 @@ def get_order(request, table_number):
         if not order:
             return JsonResponse({"order": None, "items": []})
 
-        items = []
-        for oi in order.items.select_related("menuitem"):  # ✅ استخدم related_name="items"
-            items.append({
-                "menuitem_id": oi.menuitem.id,
-                "name": oi.menuitem.name,
-                "quantity": oi.quantity,
-                "price": float(oi.menuitem.price),
-            })
-
-        return JsonResponse({
-            "order": {
-                "id": order.id,
-                "table_number": order.table_number,
-                "subtotal": str(order.subtotal),
-                "tax": str(order.tax),
-                "total": str(order.total),  # 👈 أضفتها عشان يبان السعر النهائي
-            },
-            "items": items
-        })
+        return JsonResponse(_order_state(order))
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
+
+def _order_state(order):
+    """شكل الأوردر في الـ JSON — نفسه في get_order وفي رد الـ 409."""
+    # items: اللي لسه ممكن يتعدل (سطر واحد لكل صنف)، served: اللي اتقدم — للعرض بس
+    items = {}
+    served = {}
+    for oi in order.items.select_related("menuitem").order_by("id"):  # ✅ استخدم related_name="items"
+        group = served if oi.served_at else items
+        row = group.setdefault(oi.menuitem_id, {
+            "menuitem_id": oi.menuitem.id,
+            "name": oi.menuitem.name,
+            "quantity": 0,
+            "price": float(oi.unit_price),
+            "is_done": True,
+        })
+        row["quantity"] += oi.quantity
+        row["is_done"] = row["is_done"] and oi.is_done
+
+    return {
+        "order": {
+            "id": order.id,
+            "table_number": order.table_number,
+            "is_paid": order.is_paid,
+            "payment_method": order.payment_method,
+            "subtotal": str(order.subtotal),
+            "tax": str(order.tax),
+            "total": str(order.total),  # 👈 أضفتها عشان يبان السعر النهائي
+            "version": order.version,
+        },
+        "items": list(items.values()),
+        "served": list(served.values()),
+    }
+
+
+def _stale_order_response(error):
+    """409: حد عدّل الأوردر قبلك — معاه شكل الأوردر الحالي عشان الشاشة تتحدث من غير request تاني."""
+    return JsonResponse(
+        {"error": "الأوردر اتعدل من حد تاني، راجع التعديلات وحاول تاني", "version": error.version,
+         **_order_state(error.order)},
+        status=409,
+    )
+
+ORDERS_PAGE_SIZE = 50
+
+
+def _orders_page_cursor(order):
+    return f"{order.created_at.isoformat()}_{order.id}"
+
+
+def _parse_orders_cursor(raw):
+    """"<created_at>_<id>" → (datetime, id) أو None لو مش سليم."""
+    created_at, _, order_id = (raw or "").rpartition("_")
+    moment = parse_datetime(created_at) if created_at else None
+    if moment is None or not order_id.isdigit():
+        return None
+    return moment, int(order_id)
+
+
 def orders_list(request):
     order_type = request.GET.get("type")  # فلتر النوع
     date_filter = request.GET.get("date")  # فلتر التاريخ
-    cashier_name = request.GET.get("cashier")  # فلتر الكاشير
+    cashier_id = request.GET.get("cashier")  # فلتر الكاشير (id)
     payment_filter = request.GET.get("payment")
-    all_orders = Order.objects.all().select_related("cashier")
-    
-    # فلترة النوع
-    if order_type in ["cafe", "takeaway","qeta3"]:
-        all_orders = all_orders.filter(order_type=order_type)
+    # الـ cursor قبل الأوردرات: أي حفظ بينهم هيرجع تاني في الـ long-poll
+    orders_cursor = order_feed.head()
+
+    # فلاتر التاريخ والكاشير والدفع — العدادات بتاعة الأنواع من غير التاريخ والكاشير زي ما كانت
+    scope = Q()
 
-    # فلترة التاريخ
-    today = now().date()
+    # فلترة التاريخ بحدود يوم الشغل (day_bounds) — range على created_at نفسه فالـ index بيخدمه
+    today = sales_rollup.business_day(now())
     if date_filter == "today":
-        all_orders = all_orders.filter(created_at__date=today)
+        start, end = sales_rollup.day_bounds(today)
+        scope &= Q(created_at__gte=start, created_at__lt=end)
     elif date_filter == "week":
         start_week = today - timedelta(days=today.weekday())
-        all_orders = all_orders.filter(created_at__date__gte=start_week)
+        scope &= Q(created_at__gte=sales_rollup.day_bounds(start_week)[0])
     elif date_filter == "month":
-        all_orders = all_orders.filter(
-            created_at__month=today.month,
-            created_at__year=today.year,
-        )
-
-    # فلترة الكاشير
-    if cashier_name:
-        all_orders = all_orders.filter(cashier__username__icontains=cashier_name)
+        scope &= Q(created_at__gte=sales_rollup.day_bounds(today.replace(day=1))[0])
+
+    # فلترة الكاشير بالـ id (index على cashier_id) — اللينكات القديمة بالاسم بتتحول لـ id
+    # (الاسم لازم يطابق بالظبط من غير حالة الحروف — مش جزء منه زي icontains زمان)
+    if cashier_id and not cashier_id.isdigit():
+        cashier_id = User.objects.filter(username__iexact=cashier_id).values_list("id", flat=True).first()
+        if cashier_id is None:
+            # اسم مش موجود → ولا أوردر، مش كل الأوردرات
+            scope &= Q(pk__in=[])
+    if cashier_id:
+        scope &= Q(cashier_id=int(cashier_id))
 
     # ✅ فلترة طريقة الدفع
     if payment_filter in ["cash", "vodafone", "moagel"]:
-        all_orders = all_orders.filter(payment_method=payment_filter)
-    # إحصائيات
-    total_orders = all_orders.count()
-    total_sales = sum(order.total for order in all_orders)
+        scope &= Q(payment_method=payment_filter)
+
+    filtered = scope
+    if order_type in ["cafe", "takeaway", "qeta3"]:
+        filtered &= Q(order_type=order_type)
+
+    # إحصائيات + العدادات (بدون فلترة التاريخ أو الكاشير) في استعلام واحد
+    stats = Order.objects.aggregate(
+        total_orders=Count("id", filter=filtered),
+        total_sales=Sum("total", filter=filtered),
+        cafe_count=Count("id", filter=Q(order_type="cafe")),
+        takeaway_count=Count("id", filter=Q(order_type="takeaway")),
+        qeta3_count=Count("id", filter=Q(order_type="qeta3")),
+        all_count=Count("id"),
+    )
 
-    # العدادات (بدون فلترة التاريخ أو الكاشير)
-    cafe_count = Order.objects.filter(order_type="cafe").count()
-    takeaway_count = Order.objects.filter(order_type="takeaway").count()
-    qeta3_count = Order.objects.filter(order_type="qeta3").count()
-    all_count = Order.objects.count()
+    # صفحات بـ keyset على (created_at, id): الصفحة الجاية بتبدأ بعد آخر صف — من غير OFFSET
+    orders = Order.objects.filter(filtered).select_related("cashier", "officer").order_by("-created_at", "-id")
+    before = _parse_orders_cursor(request.GET.get("before"))
+    if before:
+        moment, order_id = before
+        orders = orders.filter(Q(created_at__lt=moment) | Q(created_at=moment, id__lt=order_id))
+    orders = list(orders[:ORDERS_PAGE_SIZE + 1])
+    next_cursor = _orders_page_cursor(orders[ORDERS_PAGE_SIZE - 1]) if len(orders) > ORDERS_PAGE_SIZE else None
 
     return render(request, "orders_list.html", {
-        "orders": all_orders.order_by("-created_at"),
+        "orders": orders[:ORDERS_PAGE_SIZE],
+        "next_cursor": next_cursor,
+        "first_page": before is None,
         "active_filter": order_type or "all",
         "date_filter": date_filter or "all",
-        "cashier_filter": cashier_name or "",
+        "cashier_filter": int(cashier_id) if cashier_id else "",
+        # الكاشيرات اللي ليهم أوردرات — Exists لكل يوزر على index الـ cashier_id
+        "cashiers": User.objects.filter(Exists(Order.objects.filter(cashier=OuterRef("pk")))).order_by("username"),
         "payment_filter": payment_filter or "",
-        "cafe_count": cafe_count,
-        "takeaway_count": takeaway_count,
-        "qeta3_count": qeta3_count,
-        "all_count": all_count,
-        "total_orders": total_orders,
-        "total_sales": total_sales,
+        "cafe_count": stats["cafe_count"],
+        "takeaway_count": stats["takeaway_count"],
+        "qeta3_count": stats["qeta3_count"],
+        "all_count": stats["all_count"],
+        "total_orders": stats["total_orders"],
+        "total_sales": stats["total_sales"] or 0,
+        "orders_cursor": orders_cursor,
     })
 from django.http import JsonResponse
 
 @login_required
-def get_latest_orders(request):
-    from .models import Order
+async def get_latest_orders(request):
+    """
+    long-poll لصفحة الأوردرات: ?since=<cursor>&wait=<ثواني>.
+    لو مفيش جديد بعد الـ cursor الطلب بيستنى لحد wait (أقصاه ORDERS_LONG_POLL_TIMEOUT)،
+    وبيرجّع الأوردرات الجديدة والمتعدلة (دفع، تعديل أصناف) من استعلام واحد.
+    """
+    try:
+        since = int(request.GET.get("since", 0))
+        wait = min(float(request.GET.get("wait", 0)), order_feed.max_wait())
+    except ValueError:
+        return JsonResponse({"error": "since و wait لازم يبقوا أرقام"}, status=400)
 
-    # نستقبل آخر ID ظاهر في الصفحة
-    last_id = request.GET.get('last_id')
-    if last_id:
-        new_orders = Order.objects.filter(id__gt=last_id).order_by('id')
+    if wait > 0:
+        top = await order_feed.wait_for_change(since, wait)
     else:
-        new_orders = Order.objects.all().order_by('-id')[:10]
-
-    data = []
-    for order in new_orders:
-        data.append({
-            'id': order.id,
-            'order_type': order.order_type,
-            'table_number': order.table_number,
-            'cashier': order.cashier.username if order.cashier else '',
-            'created_at': order.created_at.strftime("%Y-%m-%d %H:%M"),
-            'is_paid': order.is_paid,
-            'payment_method': order.get_payment_method_display() if order.is_paid else '',
-            'subtotal': float(order.subtotal),
-            'discount': float(order.discount),
-            'tax': float(order.tax),
-            'total': float(order.total),
-            'note': order.note or '',
-        })
-
-    return JsonResponse({'orders': data})
+        top = await sync_to_async(order_feed.head)()
+    return JsonResponse(await sync_to_async(order_feed.changes_since)(since, top))
 
 
 def order_detail(request, order_id):
@@ -559,10 +574,13 @@ def pay_order(request, order_id):
 def confirm_payment(request, order_id, method):
     order = get_object_or_404(Order, id=order_id)
 
-    # تحديث بيانات الدفع
-    order.payment_method = method
-    order.is_paid = True
-    order.save()
+    # تحديث بيانات الدفع — لو الأوردر اتعدل بعد ما الكاشير شاف الإجمالي يبقى 409
+    try:
+        OrderCommitter(request.user).pay(order, method, expected_version=request.GET.get("version"))
+    except StaleOrder as e:
+        return _stale_order_response(e)
+    except BadVersion as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
     # لو الدفع كاش أو فودافون كاش → يروح صفحة الطباعة
     if method in ["cash", "vodafone"]:
@@ -586,52 +604,72 @@ def edit_order_from_list(request, order_id):
         formset = OrderItemFormSet(request.POST, instance=order)
 
         if form.is_valid() and formset.is_valid():
-            with transaction.atomic():
-                # 🟢 خزن نسخة من الأصناف القديمة
-                old_items = {oi.pk: oi for oi in OrderItem.objects.filter(order=order)}
-
-                form.save()
-
-                # 🟡 احفظ العناصر الجديدة والمعدلة
-                instances = formset.save(commit=False)
-                updated_item_pks = []
-
-                for inst in instances:
-                    inst.order = order
-                    inst.save()
-                    updated_item_pks.append(inst.pk)
-
-                    old_item = old_items.pop(inst.pk, None)
-                    if old_item:
-                        diff = inst.quantity - old_item.quantity
-                        if diff > 0:
-                            _deduct_materials(inst.menuitem, diff, request.user)
-                        elif diff < 0:
-                            _restore_materials(inst.menuitem, abs(diff), request.user)
-                    else:
-                        _deduct_materials(inst.menuitem, inst.quantity, request.user)
-
-                # 🟠 احذف العناصر اللي فعلاً اتعلم عليها كـ delete
-                for obj in formset.deleted_objects:
-                    _restore_materials(obj.menuitem, obj.quantity, request.user)
-                    obj.delete()
-
-                # ⚙️ الجديد هنا: احتفظ بالأصناف القديمة اللي مش في الـ POST
-                # لو المستخدم ما لمسهاش، سيبها زي ما هي
-                for pk, oi in old_items.items():
-                    if pk not in updated_item_pks:
-                        # 🟣 نرجعها للأوردر زي ما كانت بدون أي تعديل
-                        oi.order = order
-                        oi.save()
-
-                # ✅ تحديث الضريبة
-                try:
-                    order.tax = order.subtotal * Decimal("0.14")
-                except Exception:
-                    pass
-                order.save()
-
-            return redirect("orders_list")
+            try:
+                with transaction.atomic():
+                    committer = OrderCommitter(request.user)
+                    # 🔒 لو حد عدّل الأوردر من ساعة ما الصفحة اتفتحت → 409 بالشكل الجديد
+                    committer.claim(order, request.POST.get("version"))
+
+                    # 🟢 خزن نسخة من الأصناف القديمة (وملخصها عشان مبيعات اليوم تتعدل بالفرق)
+                    old_items = {oi.pk: oi for oi in OrderItem.objects.filter(order=order)}
+                    rollup_before = sales_rollup.snapshot(order)
+
+                    form.save()
+
+                    # 🟡 احفظ العناصر الجديدة والمعدلة
+                    instances = formset.save(commit=False)
+                    deltas = []
+                    new_items = []
+
+                    for inst in instances:
+                        old_item = old_items.get(inst.pk)
+                        if old_item is None or old_item.menuitem_id != inst.menuitem_id:
+                            # صنف جديد أو اتغير → سعره وتكلفته بتوع دلوقتي
+                            inst.unit_price = None
+                            new_items.append(inst)
+                        inst.order = order
+                        inst.save()
+
+                        if old_item:
+                            deltas.append((old_item.menuitem_id, -old_item.quantity))
+                        deltas.append((inst.menuitem_id, inst.quantity))
+
+                    # 🟠 احذف العناصر اللي فعلاً اتعلم عليها كـ delete
+                    removed = []
+                    for obj in formset.deleted_objects:
+                        old_item = old_items.get(obj.pk, obj)
+                        deltas.append((old_item.menuitem_id, -old_item.quantity))
+                        removed.append(obj.pk)
+                    # بأثر عشان شاشة المطبخ تشيله
+                    kitchen_feed.remove_items(OrderItem.objects.filter(pk__in=removed))
+
+                    # 🔵 المخزن + الضريبة مرة واحدة
+                    # الأصناف اللي المستخدم ما لمسهاش فاضلة زي ما هي
+                    committer.settle(order, deltas, new_items, rollup_before=rollup_before)
+
+            except StaleOrder as e:
+                # نعرض الأوردر زي ما هو دلوقتي مع رسالة، والتعديلات تتعمل تاني عليه
+                order = e.order
+                form = OrderForm(instance=order)
+                formset = OrderItemFormSet(instance=order)
+                form.add_error(None, "الأوردر اتعدل من حد تاني — دي النسخة الحالية، عدّل عليها تاني")
+                return render(request, "edit_order_from_list.html", {
+                    "form": form,
+                    "formset": formset,
+                    "order": order
+                }, status=409)
+            except BadVersion as e:
+                form.add_error(None, str(e))
+                return render(request, "edit_order_from_list.html", {
+                    "form": form,
+                    "formset": formset,
+                    "order": order
+                }, status=400)
+            except InsufficientStock as e:
+                order.refresh_from_db(fields=["version"])  # الـ claim اترجع مع الـ rollback
+                form.add_error(None, "المخزن لا يكفي: " + str(e))
+            else:
+                return redirect("orders_list")
 
         else:
             print("Form errors:", form.errors)
@@ -653,12 +691,13 @@ def delete_order_from_list(request, order_id):
     order = get_object_or_404(Order, id=order_id)
 
     if request.method == "POST":
-        with transaction.atomic():
-            # 🟢 رجّع كل المخزون قبل الحذف
-            for oi in order.items.all():
-                _restore_materials(oi.menuitem, oi.quantity, request.user)
-
-            order.delete()
+        # 🟢 رجّع كل المخزون قبل الحذف
+        try:
+            OrderCommitter(request.user).delete(order, expected_version=request.POST.get("version"))
+        except StaleOrder as e:
+            return _stale_order_response(e)
+        except BadVersion as e:
+            return JsonResponse({"error": str(e)}, status=400)
 
         return redirect("orders_list")
 
@@ -693,6 +732,7 @@ def takeaway(request):
 
 @csrf_exempt
 @login_required
+@idempotent
 def create_takeaway_order(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST فقط"}, status=405)
@@ -705,94 +745,22 @@ def create_takeaway_order(request):
         if not items:
             return JsonResponse({"error": "مفيش أصناف"}, status=400)
 
-        missing_materials = []
-
-        # ✅ التشيك على الكميات المتاحة في المخزن
-        for item in items:
-            menuitem_id = item.get("menuitem_id")
-            qty = int(item.get("quantity", 1))
-            menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-
-            recipes = Recipe.objects.filter(menuitem=menuitem)
-            for recipe in recipes:
-                material = recipe.material
-                required_qty = recipe.quantity * qty
-
-                inventories = SinastarInventory.objects.filter(material=material)
-                if not inventories.exists():
-                    missing_materials.append(f"{material.name} مش موجود في أي مخزن")
-                    continue
-
-                total_addition = sum(inv.addition for inv in inventories)
-                if total_addition < required_qty:
-                    missing_materials.append(
-                        f"{material.name} (مطلوب {required_qty}، متاح {total_addition})"
-                    )
-
-        if missing_materials:
-            return JsonResponse(
-                {"error": "المخزن لا يكفي", "missing": missing_materials},
-                status=400,
-            )
-
-        # ✅ إنشاء الأوردر وسحب المواد من المخزون
-        with transaction.atomic():
-            order = Order.objects.create(
-                order_type="takeaway",
-                cashier=request.user,
-                note=note  # ✅ حفظ الملاحظة في الأوردر
-            )
+        # ✅ إنشاء الأوردر وسحب المواد من المخزون (التشيك جوه الخصم نفسه)
+        order = OrderCommitter(request.user).create(
+            "takeaway",
+            [(item.get("menuitem_id"), item.get("quantity", 1)) for item in items],
+            note=note,  # ✅ حفظ الملاحظة في الأوردر
+        )
 
-            for item in items:
-                menuitem_id = item.get("menuitem_id")
-                qty = int(item.get("quantity", 1))
-                menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-
-                # إنشاء عنصر الأوردر
-                OrderItem.objects.create(order=order, menuitem=menuitem, quantity=qty)
-
-                # خصم المواد من المخزون
-                recipes = Recipe.objects.filter(menuitem=menuitem)
-                for recipe in recipes:
-                    material = recipe.material
-                    required_qty = recipe.quantity * qty
-
-                    inventories = SinastarInventory.objects.filter(material=material)
-                    remaining = required_qty
-
-                    for inv in inventories:
-                        if remaining <= 0:
-                            break
-
-                        deducted = 0
-                        if inv.addition >= remaining:
-                            deducted = remaining
-                            inv.addition -= remaining
-                            remaining = 0
-                        else:
-                            deducted = inv.addition
-                            remaining -= inv.addition
-                            inv.addition = 0
-
-                        inv.save()
-
-                        # 🟢 سجل في SoldMaterialHistory (تجميع يومي)
-                        sold_item = SoldMaterialHistory.objects.filter(material=inv.material).first()
-                        if not sold_item:
-                            sold_item = SoldMaterialHistory.objects.create(
-                                material=inv.material,
-                                quantity=0,
-                                addition=0,
-                                addition_cost=inv.addition_cost,
-                                purchase_price=inv.purchase_price,
-                            )
-
-                        sold_item.quantity += deducted
-                        sold_item.addition += deducted
-                        sold_item.save()
-
-            return JsonResponse({"success": True, "order_id": order.id})
+        return JsonResponse({"success": True, "order_id": order.id})
 
+    except UnknownMenuItems as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except InsufficientStock as e:
+        return JsonResponse(
+            {"error": "المخزن لا يكفي", "missing": e.missing},
+            status=400,
+        )
     except Exception as e:
         import traceback
         print("❌ Error in create_takeaway_order:", traceback.format_exc())
@@ -806,29 +774,9 @@ def check_menuitem(request):
             menuitem_id = data.get("menuitem_id")
             qty = int(data.get("quantity", 1))
 
-            menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-
-            missing_materials = []
-            recipes = Recipe.objects.filter(menuitem=menuitem)
-
-            for recipe in recipes:
-                material = recipe.material
-                required_qty = recipe.quantity * qty
+            get_object_or_404(MenuItem, id=menuitem_id)
 
-                # 🟢 هات كل الـ rows الخاصة بالمكون بغض النظر عن type
-                inventories = SinastarInventory.objects.filter(material=material)
-
-                if not inventories.exists():
-                    missing_materials.append(f"{material.name} (مش موجود في أي مخزن)")
-                    continue
-
-                total_addition = sum(inv.addition for inv in inventories)
-
-                # ✅ check على addition فقط
-                if total_addition < required_qty:
-                    missing_materials.append(
-                        f"{material.name} (مطلوب {required_qty}، متاح {total_addition})"
-                    )
+            missing_materials = stock.check_lines([(menuitem_id, qty)])
 
             if missing_materials:
                 return JsonResponse({"ok": False, "missing": missing_materials})
@@ -840,25 +788,62 @@ def check_menuitem(request):
 
     return JsonResponse({"ok": False, "error": "POST فقط"}, status=405)
 
-def pending_items(request):
-    role = getattr(request.user.profile, "role", None)
-    inv_type = request.GET.get("type")  # Baresta / Buffet / Canteen
+@login_required
+def check_cart(request):
+    """
+    تشيك السلة كلها في request واحد بدل check_menuitem لكل ضغطة:
+    النقص لكل مكون + أقصى كمية لكل سطر مع باقي السلة.
+    """
+    if request.method != "POST":
+        return JsonResponse({"ok": False, "error": "POST فقط"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        items = data.get("items", [])
+        order_id = data.get("order_id")
+
+        # أصناف الترابيزة اللي اتخصمت قبل كده ما تتحسبش تاني
+        held = {}
+        if order_id:
+            # اللي اتقدم مش في السلة — مكوناته اتخصمت واتاكلت
+            held = dict(
+                OrderItem.objects.filter(order_id=order_id, served_at__isnull=True)
+                .values_list("menuitem_id").annotate(n=Sum("quantity")).order_by()
+            )
 
-    orders = Order.objects.filter(is_paid=False).order_by("created_at")
+        cart = {}
+        for it in items:
+            mid = int(it["menuitem_id"])
+            cart[mid] = cart.get(mid, 0) + int(it.get("quantity", 1))
 
-    filtered_orders = []
-    for order in orders:
-        items = order.items.filter(is_done=False)
+        if MenuItem.objects.filter(id__in=cart).count() != len(cart):
+            return JsonResponse({"ok": False, "error": "صنف غير موجود"}, status=404)
+        result = stock.cart_availability(
+            (mid, qty - held.get(mid, 0)) for mid, qty in cart.items()
+        )
 
-        # فلترة حسب القسم (على مستوى الـ MenuItem.section)
-        if inv_type:
-            items = items.filter(menuitem__section=inv_type)
+        for line in result["lines"]:
+            line["quantity"] = cart[line["menuitem_id"]]
+            if line["can_add"] is not None:
+                line["max_quantity"] = line["quantity"] + line["can_add"]
 
-        if items.exists():
-            filtered_orders.append({
-                "order": order,
-                "items": items
-            })
+        result["missing"] = [
+            f"{s['name']} (مطلوب {s['required']}، متاح {s['available']})" for s in result["shortages"]
+        ]
+        return JsonResponse(result)
+
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+@login_required
+def pending_items(request):
+    role = getattr(request.user.profile, "role", None)
+    inv_type = request.GET.get("type")  # Baresta / Buffet / Canteen
+    # الـ cursor قبل الأصناف: أي تغيير بينهم هيرجع تاني في الفيد ومش هيضيع
+    cursor = kitchen_feed.head()
+
+    # فلترة حسب القسم (على مستوى الـ MenuItem.section) — كله في استعلام واحد
+    filtered_orders = kitchen_feed.open_items(is_done=False, section=inv_type)
 
     # ✅ تحديد إذا كان المستخدم ينتمي لجروب "barista"
     #is_barista = request.user.groups.filter(name="barista").exists()
@@ -867,31 +852,111 @@ def pending_items(request):
         "orders": filtered_orders,
         "inv_type": inv_type,
         "role": role,  # إرسال المتغير للتمبليت
+        "cursor": cursor,
     })
 
 
+@login_required
+async def order_events(request):
+    """
+    Server-Sent Events لشاشات المطبخ والأوردرات (ASGI بس).
+    المتصفح بيبعت Last-Event-ID لوحده لما يعيد الاتصال فبيكمّل من مكانه.
+    على WSGI بيرجع 204 → EventSource بيقف والشاشة بتفضل على الـ polling.
+    """
+    if "wsgi.input" in request.META:
+        return HttpResponse(status=204)
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    response = StreamingHttpResponse(events.stream(last_event_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+def kitchen_feed_view(request):
+    """
+    الجديد في أصناف المطبخ بعد ?since=<cursor> (و ?type=<section> اختياري).
+    الشاشة بتبعت الـ cursor اللي رجعلها آخر مرة؛ لو reset=true تعمل reload.
+    """
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        return JsonResponse({"error": "since لازم يبقى رقم"}, status=400)
+    return JsonResponse(kitchen_feed.changes_since(since, request.GET.get("type") or None))
+
+
 def mark_item_done(request, item_id):
-    item = get_object_or_404(OrderItem, id=item_id)
+    item = get_object_or_404(OrderItem.objects.select_related("order"), id=item_id)
     item.is_done = True
     item.save()
+    OrderCommitter.announce(item.order, "updated")
 
     # لو عايز ترجع AJAX
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        return JsonResponse({"success": True, "order_id": item.order.id})
+        return JsonResponse({"success": True, "order_id": item.order_id, "cursor": item.change_seq})
 
     return redirect("pending_items")
 
-def waiter_items(request):
-    orders = Order.objects.filter(is_paid=False).order_by("created_at")
 
-    finished_orders = []
-    for order in orders:
-        items = order.items.filter(is_done=True)  # بس اللي خلصت
-        if items.exists():
-            finished_orders.append({
-                "order": order,
-                "items": items
-            })
+@login_required
+def mark_items_done(request):
+    """
+    bump bar: {"order_id", "item_ids", "section", "action"} — التذكرة كلها أو أصناف بعينها
+    في UPDATE واحد. action = "done" (الافتراضي) أو "start" لما المطبخ يبدأ فيها.
+    بيرجّع رقم التغيير: لو هو الـ cursor + 1 الشاشة تمشي عليه من غير ما تسأل الفيد.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST فقط"}, status=405)
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+        order_id = data.get("order_id")
+        item_ids = data.get("item_ids")
+        if order_id is None and not item_ids:
+            return JsonResponse({"error": "رقم الأوردر أو الأصناف مطلوبة"}, status=400)
+        action = data.get("action", "done")
+        if action not in ("done", "start"):
+            return JsonResponse({"error": "action لازم تبقى done أو start"}, status=400)
+        mark = kitchen_feed.complete_items if action == "done" else kitchen_feed.start_items
+        count, cursor, order_ids = mark(
+            order_id=int(order_id) if order_id is not None else None,
+            item_ids=[int(i) for i in item_ids] if item_ids else None,
+            section=data.get("section") or None,
+        )
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "بيانات غير صحيحة"}, status=400)
+
+    # item_ids ممكن تبقى من كذا أوردر → حدث لكل أوردر اتأثر
+    status = "items_done" if action == "done" else "items_started"
+    for affected in order_ids:
+        events.publish("order", {"id": affected, "status": status})
+    return JsonResponse({"success": True, "done": count, "cursor": cursor})
+
+
+@login_required
+def kitchen_report(request):
+    """ضغط كل قسم بالساعة من KitchenLoadStat (محسوب مسبقًا) + الطابور دلوقتي."""
+    if request.method == "POST":
+        try:
+            days = max(int(request.POST.get("days", kitchen_stats.DEFAULT_DAYS)), 1)
+        except ValueError:
+            days = kitchen_stats.DEFAULT_DAYS
+        kitchen_stats.rebuild(days)
+        messages.success(request, "✅ اتحسب التقرير من جديد")
+        return redirect("kitchen_report")
+
+    sections, computed_at = kitchen_stats.report()
+    days = next((stat.days for sec in sections for stat in sec["hours"] if stat), kitchen_stats.DEFAULT_DAYS)
+    return render(request, "kitchen_report.html", {
+        "sections": sections,
+        "computed_at": computed_at,
+        "days": days,
+    })
+
+
+@login_required
+def waiter_items(request):
+    # بس اللي خلصت — استعلام واحد لكل الأوردرات
+    finished_orders = kitchen_feed.open_items(is_done=True)
 
     return render(request, "waiter_items.html", {
         "orders": finished_orders
@@ -900,7 +965,12 @@ def waiter_mark_done(request, order_id):
     order = get_object_or_404(Order, id=order_id)
 
     # نخلي كل الايتمات اللي خلصت خلاص تتشال من صفحة الويتر
-    order.items.filter(is_done=True).delete()
+    try:
+        OrderCommitter(request.user).clear_done_items(order, expected_version=request.GET.get("version"))
+    except StaleOrder as e:
+        return _stale_order_response(e)
+    except BadVersion as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
     return redirect("waiter_items")
 
@@ -934,6 +1004,7 @@ def qeta3(request):
 
 @csrf_exempt
 @login_required
+@idempotent
 def create_qeta3_order(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST فقط"}, status=405)
@@ -950,112 +1021,28 @@ def create_qeta3_order(request):
             return JsonResponse({"error": "لازم تختار اسم الظابط"}, status=400)
 
         officer = get_object_or_404(Officer, id=officer_id)
-        missing_materials = []
-
-        # ✅ التشيك الأول على المخزن
-        for item in items:
-            menuitem_id = item.get("menuitem_id")
-            qty = int(item.get("quantity", 1))
-            menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-
-            recipes = Recipe.objects.filter(menuitem=menuitem)
-            for recipe in recipes:
-                material = recipe.material
-                required_qty = recipe.quantity * qty
-
-                inventories = SinastarInventory.objects.filter(material=material)
-                if not inventories.exists():
-                    missing_materials.append(f"{material.name} مش موجود في أي مخزن")
-                    continue
-
-                total_addition = sum(inv.addition for inv in inventories)
-                if total_addition < required_qty:
-                    missing_materials.append(
-                        f"{material.name} (مطلوب {required_qty}، متاح {total_addition})"
-                    )
-
-        if missing_materials:
-            return JsonResponse(
-                {"error": "المخزن لا يكفي", "missing": missing_materials},
-                status=400,
-            )
-
-        # ✅ إنشاء الأوردر
-        with transaction.atomic():
-            order = Order.objects.create(
-                order_type="qeta3",
-                cashier=request.user,
-                officer=officer
-            )
+        # ✅ إنشاء الأوردر (الخصم من officer.discount_rate جوه الـ committer)
+        order = OrderCommitter(request.user).create(
+            "qeta3",
+            [(item.get("menuitem_id"), item.get("quantity", 1)) for item in items],
+            officer=officer,
+        )
 
-            subtotal = Decimal("0.00")
-
-            for item in items:
-                menuitem_id = item.get("menuitem_id")
-                qty = int(item.get("quantity", 1))
-                menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-
-                OrderItem.objects.create(order=order, menuitem=menuitem, quantity=qty)
-                subtotal += Decimal(menuitem.price) * qty
-
-                # تحديث المخزن
-                recipes = Recipe.objects.filter(menuitem=menuitem)
-                for recipe in recipes:
-                    material = recipe.material
-                    required_qty = recipe.quantity * qty
-                    inventories = SinastarInventory.objects.filter(material=material)
-                    remaining = required_qty
-
-                    for inv in inventories:
-                        if remaining <= 0:
-                            break
-
-                        deducted = 0
-                        if inv.addition >= remaining:
-                            deducted = remaining
-                            inv.addition -= remaining
-                            remaining = 0
-                        else:
-                            deducted = inv.addition
-                            remaining -= inv.addition
-                            inv.addition = 0
-
-                        inv.save()
-
-                        sold_item = SoldMaterialHistory.objects.filter(
-                            material=inv.material,
-                            type=inv.type  # لو النوع مهم في التمييز
-                        ).first()
-
-                        if not sold_item:
-                            sold_item = SoldMaterialHistory.objects.create(
-                                material=inv.material,
-                                type=inv.type,
-                                quantity=0,
-                                addition=0,
-                                addition_cost=inv.addition_cost,
-                                purchase_price=inv.purchase_price,
-                            )
-
-                        sold_item.quantity += deducted
-                        sold_item.addition += deducted
-                        sold_item.save()
-
-
-            # ✅ الخصم من officer.discount_rate
-            discount = subtotal * officer.discount_rate
-            order.discount = discount
-            order.tax = Decimal("0.00")
-            order.save(update_fields=["discount", "tax"])
-
-            return JsonResponse({
-                "success": True,
-                "order_id": order.id,
-                "subtotal": str(order.subtotal),  # property
-                "discount": str(order.discount),
-                "total": str(order.total)         # property
-            })
+        return JsonResponse({
+            "success": True,
+            "order_id": order.id,
+            "subtotal": str(order.subtotal),
+            "discount": str(order.discount),
+            "total": str(order.total)
+        })
 
+    except UnknownMenuItems as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except InsufficientStock as e:
+        return JsonResponse(
+            {"error": "المخزن لا يكفي", "missing": e.missing},
+            status=400,
+        )
     except Exception as e:
         import traceback
         print("❌ Error in create_qeta3_order:", traceback.format_exc())
@@ -1095,7 +1082,7 @@ def officer_orders(request):
     # ✅ حساب الإجماليات
     total_sum = Decimal("0.00")
     for order in orders:
-        subtotal = sum(Decimal(i.menuitem.price) * i.quantity for i in order.items.all())
+        subtotal = sum(i.total_price for i in order.items.all())
         discount_amount = subtotal * order.officer.discount_rate if order.officer else Decimal("0.00")
         total = subtotal - discount_amount
         order.calc_subtotal = subtotal
@@ -1125,30 +1112,29 @@ def daily_closing(request):
     if selected_date:
         selected_date = parse_date(selected_date)
     else:
-        selected_date = now().date()
+        selected_date = sales_rollup.business_day(now())
 
-    # 🟢 الاوردرات
-    order_items = OrderItem.objects.filter(order__created_at__date=selected_date)
+    # 🟢 ملخص اليوم المتجمع (DailySalesRollup) — كام صف لكل صنف بدل ما نلف على الأصناف
+    rows = list(sales_rollup.day_summary(selected_date))
 
-    # 🟢 اجمع حسب السكشن
-    section_summary = (
-        order_items.values("menuitem__section")
-        .annotate(
-            total_qty=Sum("quantity"),
-            total_sales=Sum(F("menuitem__price") * F("quantity")),
-        )
-        .order_by("menuitem__section")
-    )
+    # 🟢 تفاصيل الأصناف
+    item_summary = [
+        {
+            "menuitem__name": row.menuitem.name,
+            "menuitem__section": row.section,
+            "total_qty": row.quantity,
+            "total_sales": row.revenue,
+        }
+        for row in rows
+    ]
 
-    # 🟢 اجمع تفاصيل الأصناف
-    item_summary = (
-        order_items.values("menuitem__name", "menuitem__section")
-        .annotate(
-            total_qty=Sum("quantity"),
-            total_sales=Sum(F("menuitem__price") * F("quantity")),
-        )
-        .order_by("menuitem__section", "menuitem__name")
-    )
+    # 🟢 اجمع حسب السكشن
+    by_section = {}
+    for row in rows:
+        total = by_section.setdefault(row.section, {"total_qty": 0, "total_sales": Decimal("0.00")})
+        total["total_qty"] += row.quantity
+        total["total_sales"] += row.revenue
+    section_summary = [{"menuitem__section": section, **total} for section, total in sorted(by_section.items())]
 
     # 🟢 ترجمات السكاشن
     SECTION_DISPLAY = {
@@ -1169,11 +1155,16 @@ def daily_closing(request):
         for s in section_summary
     ]
 
-    # 🟢 هات النسريات والتبس
-    expenses = ExtraExpense.objects.filter(created_at__date=selected_date).order_by("-created_at")
+    # 🟢 هات النسريات والتبس — range على created_at بدل __date، والإجماليين في استعلام واحد
+    day_start, day_end = sales_rollup.day_bounds(selected_date)
+    expenses = ExtraExpense.objects.filter(created_at__gte=day_start, created_at__lt=day_end).order_by("-created_at")
 
-    total_nesrayat = expenses.filter(category="nesrayat").aggregate(Sum("amount"))["amount__sum"] or 0
-    total_tips = expenses.filter(category="tips").aggregate(Sum("amount"))["amount__sum"] or 0
+    expense_totals = expenses.aggregate(
+        nesrayat=Sum("amount", filter=Q(category="nesrayat")),
+        tips=Sum("amount", filter=Q(category="tips")),
+    )
+    total_nesrayat = expense_totals["nesrayat"] or 0
+    total_tips = expense_totals["tips"] or 0
     total_all = total_nesrayat + total_tips
 
     return render(
@@ -1211,233 +1202,90 @@ def profit_chart_data(request):
 
 @login_required
 def monthly_closing_list(request):
-    # 🟢 فلتر التاريخ بتاع SoldMaterialHistory
-    sold_start = request.GET.get("sold_start")
-    sold_end = request.GET.get("sold_end")
-    sold_history = SoldMaterialHistory.objects.all()
-    if sold_start:
-        sold_history = sold_history.filter(created_at__date__gte=parse_date(sold_start))
-    if sold_end:
-        sold_history = sold_history.filter(created_at__date__lte=parse_date(sold_end))
-
-    total_quantity = sum(item.quantity for item in sold_history)
-    total_addition = sum(item.addition for item in sold_history)
-    total_sale = sum(item.total_sale_price for item in sold_history)
-    total_purchase = sum(item.total_purchase_price for item in sold_history)
-    total_profit = sum(item.profit for item in sold_history)
-
-    # 🟢 فلتر التاريخ بتاع SinastarInventoryHistory
-    inv_start = request.GET.get("inv_start")
-    inv_end = request.GET.get("inv_end")
-    inventory_history = SinastarInventoryHistory.objects.all()
-    if inv_start:
-        inventory_history = inventory_history.filter(created_at__date__gte=parse_date(inv_start))
-    if inv_end:
-        inventory_history = inventory_history.filter(created_at__date__lte=parse_date(inv_end))
-
-    updated_total_sum = sum(item.total_sale_price for item in inventory_history)
-    total_purchase_sum = sum(item.total_purchase_price for item in inventory_history)
-    total_profit_sum = sum(item.profit for item in inventory_history)
-
-    # 🟢 فلتر التاريخ بتاع SinastarInventory (المخزن الحالي)
-    store_start = request.GET.get("store_start")
-    store_end = request.GET.get("store_end")
-    current_inventory = SinastarInventory.objects.all()
-    if store_start:
-        current_inventory = current_inventory.filter(updated_at__date__gte=parse_date(store_start))
-    if store_end:
-        current_inventory = current_inventory.filter(updated_at__date__lte=parse_date(store_end))
-
-    store_total_sale = sum(item.total_sale_price for item in current_inventory)
-    store_total_purchase = sum(item.total_purchase_price for item in current_inventory)
-    store_total_profit = sum(item.profit for item in current_inventory)
-
-    # 🟢 جدول الفواتير (Orders)
-    order_start = request.GET.get("order_start")
-    order_end = request.GET.get("order_end")
-    orders = Order.objects.filter(is_paid=True)
-    if order_start:
-        orders = orders.filter(created_at__date__gte=parse_date(order_start))
-    if order_end:
-        orders = orders.filter(created_at__date__lte=parse_date(order_end))
-
-    total_orders = orders.count()
-
-    total_orders_sales = 0
-    for order in orders:
-        items_total = sum(item.total_price for item in order.items.all())
-        order_total = items_total + order.tax + order.service_charge - order.discount
-        total_orders_sales += order_total
-
-    # 🟢 جدول ExtraExpense
-    exp_start = request.GET.get("exp_start")
-    exp_end = request.GET.get("exp_end")
-    expenses = ExtraExpense.objects.all().order_by("-created_at")
-    if exp_start:
-        expenses = expenses.filter(created_at__date__gte=parse_date(exp_start))
-    if exp_end:
-        expenses = expenses.filter(created_at__date__lte=parse_date(exp_end))
-
-    total_nesrayat = expenses.filter(category="nesrayat").aggregate(Sum("amount"))["amount__sum"] or 0
-    total_tips = expenses.filter(category="tips").aggregate(Sum("amount"))["amount__sum"] or 0
-    total_all_exp = total_nesrayat + total_tips
-
-    context = {
-        # ✅ Sold Materials
-        "sold_history": sold_history,
-        "total_quantity": total_quantity,
-        "total_addition": total_addition,
-        "total_sale": total_sale,
-        "total_purchase": total_purchase,
-        "total_profit": total_profit,
-        "sold_start": sold_start,
-        "sold_end": sold_end,
-
-        # ✅ Inventory History
-        "inventory_history": inventory_history,
-        "updated_total_sum": updated_total_sum,
-        "total_purchase_sum": total_purchase_sum,
-        "total_profit_sum": total_profit_sum,
-        "inv_start": inv_start,
-        "inv_end": inv_end,
-
-        # ✅ Current Inventory
-        "current_inventory": current_inventory,
-        "store_total_sale": store_total_sale,
-        "store_total_purchase": store_total_purchase,
-        "store_total_profit": store_total_profit,
-        "store_start": store_start,
-        "store_end": store_end,
-
-        # ✅ Orders
-        "orders": orders.order_by("-created_at"),
-        "order_start": order_start,
-        "order_end": order_end,
-        "total_orders": total_orders,
-        "total_orders_sales": total_orders_sales,
-
-        # ✅ Closings
+    # الصفحة نفسها جدول التقفيلات بس — باقي الجداول بتتحمّل من monthly_closing_panel لما تتفتح
+    return render(request, "monthly_closing_list.html", {
         "closings": MonthlyClosing.objects.all().order_by("-created_at"),
+        "panels": request.GET,  # لينكات الفلاتر القديمة (?sold_start=...) بتفتح الجدول بتاعها على طول
+    })
 
-        # ✅ Extra Expenses
-        "expenses": expenses,
-        "total_nesrayat": total_nesrayat,
-        "total_tips": total_tips,
-        "total_all_exp": total_all_exp,
-        "exp_start": exp_start,
-        "exp_end": exp_end,
-    }
-    return render(request, "monthly_closing_list.html", context)
+@login_required
+def monthly_closing_panel(request, panel):
+    """جدول واحد من صفحة التقفيلات: صفحة صفوف (keyset) + إجماليات SQL على الفلتر كله."""
+    build = closing_panels.PANELS.get(panel)
+    if build is None:
+        return JsonResponse({"error": "جدول مش معروف"}, status=404)
+
+    rows, field, context = build(request.GET)
+    before = _parse_orders_cursor(request.GET.get("before"))
+    rows, last = closing_panels.page(rows, field, before)
+
+    query = request.GET.copy()
+    query.pop("before", None)
+    first_query = query.urlencode()
+    if last:
+        query["before"] = f"{last[0].isoformat()}_{last[1]}"
+    context.update({
+        "panel": panel,
+        "rows": rows,
+        "first_page": before is None,
+        "first_query": first_query,
+        "next_query": query.urlencode() if last else "",
+    })
+    return render(request, f"closing_panel_{panel}.html", context)
 
 @login_required
 def create_monthly_closing(request):
     if request.method == "POST":
-        start_date = request.POST.get("start_date")
-        end_date = request.POST.get("end_date")
+        start_date = parse_date(request.POST.get("start_date") or "")
+        end_date = parse_date(request.POST.get("end_date") or "")
 
         if not start_date or not end_date:
-            return render(request, "create_monthly_closing.html", {
+            return render(request, "create_closing_form.html", {
                 "error": "لازم تختار تاريخ البداية والنهاية"
             })
+        if start_date > end_date:
+            return render(request, "create_closing_form.html", {
+                "error": "تاريخ البداية لازم يكون قبل تاريخ النهاية"
+            })
 
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-
-        # 1️⃣ إجمالي مبيعات الفواتير
-        orders = Order.objects.filter(
-            is_paid=True,
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        )
-        total_sales_orders = 0
-        for order in orders:
-            items_total = sum(item.total_price for item in order.items.all())
-            order_total = items_total + order.tax + order.service_charge - order.discount
-            total_sales_orders += order_total
-
-        # 2️⃣ إجمالي بيع المتبقي (SinastarInventory)
-        current_items = SinastarInventory.objects.filter(
-            updated_at__date__gte=start_date,
-            updated_at__date__lte=end_date
-        )
-        total_sales_inventory = sum(item.total_sale_price for item in current_items)
-
-        # 3️⃣ إجمالي الشراء = (سعر شراء المواد المباعة + سعر شراء المخزن الحالي)
-        sold_items = SoldMaterialHistory.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        )
-        sold_purchase_total = sum(item.total_purchase_price for item in sold_items)
-
-        current_purchase_total = sum(item.total_purchase_price for item in current_items)
-
-        total_purchase_inventory = sold_purchase_total + current_purchase_total
-
-        # 4️⃣ الربح
-        total_profit = (total_sales_orders + total_sales_inventory) - total_purchase_inventory
-
-        # 5️⃣ الربح من المخزن
-        profit_from_inventory = sum(item.profit for item in current_items)
-
-        # 6️⃣ الخزينة (قبل الخصم والإضافة)
-        actual_profit = total_profit - profit_from_inventory
-
-        # 7️⃣ اجمع النسريات + التبس
-        total_nesrayat = ExtraExpense.objects.filter(
-            category="nesrayat",
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        ).aggregate(Sum("amount"))["amount__sum"] or 0
-
-        total_tips = ExtraExpense.objects.filter(
-            category="tips",
-            created_at__date__gte=start_date,
-            created_at__lte=end_date
-        ).aggregate(Sum("amount"))["amount__sum"] or 0
-
-        # 8️⃣ عدل الربح الفعلي (خصم النسريات + إضافة التبس)
-        actual_profit = actual_profit - total_nesrayat + total_tips
-
-        # ✅ حفظ الـ Closing
-        closing = MonthlyClosing.objects.create(
-            month=start_date,
-            start_date=start_date,
-            end_date=end_date,
-            total_sales_orders=total_sales_orders,
-            total_sales_inventory=total_sales_inventory,
-            total_purchase_inventory=total_purchase_inventory,
-            total_profit=total_profit,
-            profit_from_inventory=profit_from_inventory,
-            actual_profit=actual_profit,
-            total_nesrayat=total_nesrayat,
-            total_tips=total_tips,
-        )
-
-        # ✅ تعديل History (الخصم من SinastarInventoryHistory حسب المباع)
-        for sold in sold_items:
-            qty_to_deduct = sold.quantity
-            histories = SinastarInventoryHistory.objects.filter(material=sold.material).order_by("created_at")
-
-            for h in histories:
-                if qty_to_deduct <= 0:
-                    break
-                if h.addition >= qty_to_deduct:
-                    h.addition -= qty_to_deduct
-                    h.save()
-                    qty_to_deduct = 0
-                else:
-                    qty_to_deduct -= h.addition
-                    h.addition = 0
-                    h.save()
-
-            SinastarInventoryHistory.objects.filter(material=sold.material, addition=0).delete()
+        # الحساب والتسوية بيتعملوا في الخلفية (closing_jobs) — الصفحة بتعرض حالة الشغلانة بس
+        try:
+            job = closing_jobs.enqueue(start_date, end_date, request.user)
+        except closing_jobs.AlreadyClosed as e:
+            return render(request, "create_closing_form.html", {"error": str(e)})
+        return redirect("closing_job_status", job_id=job.id)
 
-        # ✅ تحديث الـ updated_at لكل المخزون
-        SinastarInventory.objects.all().update(updated_at=now())
+    return render(request, "create_closing_form.html")
 
-        return redirect("monthly_closing_list")
+@login_required
+def preview_monthly_closing(request):
+    """معاينة أرقام التقفيلة لأي فترة من غير ما يتكتب أي حاجة (والنتيجة متخزنة في الكاش)."""
+    start_date = parse_date(request.GET.get("start_date") or "")
+    end_date = parse_date(request.GET.get("end_date") or "")
+    context = {"start_date": request.GET.get("start_date", ""), "end_date": request.GET.get("end_date", "")}
+
+    if not start_date or not end_date:
+        context["error"] = "لازم تختار تاريخ البداية والنهاية"
+    elif start_date > end_date:
+        context["error"] = "تاريخ البداية لازم يكون قبل تاريخ النهاية"
+    else:
+        context["preview"], context["preview_cached"] = closing_jobs.preview(start_date, end_date)
+    return render(request, "create_closing_form.html", context)
 
-    return render(request, "create_closing_form.html")
+@login_required
+def closing_job_status(request, job_id):
+    job = get_object_or_404(ClosingJob.objects.select_related("closing"), id=job_id)
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "id": job.id,
+            "status": job.status,
+            "step": job.step,
+            "settled": len(job.settled_materials),
+            "materials_total": job.materials_total,
+            "closing_id": job.closing_id,
+            "error": job.error,
+        })
+    return render(request, "closing_job_status.html", {"job": job})
 
 @login_required
 def sinastar_inventory_history(request):
@@ -1468,9 +1316,11 @@ def sinastar_inventory_history(request):
     return render(request, "sinastar_inventory_history.html", context)
 
 @login_required
+@transaction.atomic
 def update_addition(request, item_id, action):
     try:
-        item = SinastarInventory.objects.get(id=item_id)
+        # القفل بيمنع إن خصم أوردر في نفس اللحظة يضيع لما نحفظ الصف
+        item = SinastarInventory.objects.select_for_update().get(id=item_id)
         data = json.loads(request.body.decode("utf-8"))
         amount = int(data.get("amount", 1))
 
@@ -1591,7 +1441,7 @@ def print_order(request, order_id):
 
     # احسب الإجمالي لكل صنف
     for item in items:
-        item.line_total = Decimal(item.menuitem.price) * item.quantity
+        item.line_total = item.total_price
 
     # احسب الإجماليات
     subtotal = sum(item.line_total for item in items)
@@ -1629,10 +1479,12 @@ def mark_order_paid(request, order_id):
 
     try:
         order = Order.objects.get(id=order_id)
-        order.payment_method = payment_method
-        order.is_paid = True
-        order.save()
-        return JsonResponse({"success": True})
+        OrderCommitter(request.user).pay(order, payment_method, expected_version=request.POST.get("version"))
+        return JsonResponse({"success": True, "version": order.version})
+    except StaleOrder as e:
+        return _stale_order_response(e)
+    except BadVersion as e:
+        return JsonResponse({"error": str(e)}, status=400)
     except Order.DoesNotExist:
         return JsonResponse({"error": "الأوردر غير موجود."}, status=404)
 
@@ -1677,7 +1529,7 @@ def sinastar_inventory_shortage(request):
     from reportlab.pdfgen import canvas
 
     # ✅ لو الـ addition أقل من الحد الأدنى يتحسب نواقص
-    items = SinastarInventory.objects.filter(addition__lt=F('minimum_stock'))
+    items = SinastarInventory.objects.filter(addition__lt=F('minimum_stock')).select_related('material__stock')
 
     # نحسب النقص (الفرق بين الحد الأدنى والكمية الفعلية)
     for item in items:
@@ -93,6 +93,15 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # كل transaction بتاخد قفل الكتابة من أولها، والكاشير التاني يستنى بدل "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # ملف مش ذاكرة عشان اختبار الكاشيرات المتوازية (الذاكرة المشتركة بتقفل الجداول فورًا)
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 